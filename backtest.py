@@ -0,0 +1,168 @@
+"""Rating-model backtest: replay the matches table under many configurations.
+
+Before each match the pre-match win probability of side A is taken from
+mmr.expected_score on the two team ratings (aggregated as the
+configuration says); the result is then applied with the configuration's
+formula. Each configuration is scored by log-loss, Brier score and
+accuracy. Matches are loaded once, converted to integer player slots and
+shared with a process pool that evaluates the grid in parallel, each
+worker keeping ratings in flat arrays. One JSON line per configuration,
+best log-loss first.
+
+usage: python backtest.py [--db mmr_bot.db] [--k 8 16 24 32] [--deltas 15 25] [--scales 0.5 1 1.5]
+                          [--teams mean top_weighted] [--warmup 1000] [--processes 8]
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import sqlite3
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from db import DB_PATH
+from mmr import expected_score
+from rating import DEFAULT_MMR, TEAM_AGGREGATIONS, get_formula, get_team_aggregation, load_seeds, parse_match_rows, stream_matches
+
+DEFAULT_K = (8, 12, 16, 20, 24, 32, 40, 48)
+DEFAULT_DELTAS = (10, 15, 20, 25, 30)
+DEFAULT_SCALES = (0.5, 0.75, 1.0, 1.25, 1.5)
+# probabilities are clipped so one confident miss can't make log-loss infinite
+EPSILON = 1e-15
+
+class History:
+    """All matches as integer player slots: ``slots[starts[i]:splits[i]]`` is side A of match i,
+    ``slots[splits[i]:starts[i+1]]`` side B, ``winners[i]`` is 1 if A won."""
+
+    __slots__ = ('slots', 'starts', 'splits', 'winners', 'seeds')
+
+    def __init__(self):
+        self.slots = array('i')
+        self.starts = array('i', [0])
+        self.splits = array('i')
+        self.winners = bytearray()
+        self.seeds = array('i')
+
+    def __len__(self):
+        return len(self.winners)
+
+def load_history(path: str) -> History:
+    """Read every match of the database at ``path`` (read-only, one snapshot) into a History."""
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        conn.execute('BEGIN')
+        seeds = load_seeds(conn)
+        history = History()
+        index: Dict[str, int] = {}
+
+        def slot(pid):
+            i = index.get(pid)
+            if i is None:
+                i = index[pid] = len(index)
+                history.seeds.append(seeds.get(pid, DEFAULT_MMR))
+            return i
+
+        for _, a_ids, b_ids, winner in parse_match_rows(stream_matches(conn)):
+            history.slots.extend(slot(pid) for pid in a_ids)
+            history.splits.append(len(history.slots))
+            history.slots.extend(slot(pid) for pid in b_ids)
+            history.starts.append(len(history.slots))
+            history.winners.append(1 if winner == 'A' else 0)
+        return history
+    finally:
+        conn.close()
+
+def grid(formulas: List[str], ks, deltas, scales, teams) -> List[Tuple[str, dict, str]]:
+    """(formula, params, team aggregation used for predictions) per configuration."""
+    configs = []
+    for team in teams:
+        if 'flat' in formulas:
+            configs.extend(('flat', {'delta': d}, team) for d in deltas)
+        if 'elo' in formulas:
+            configs.extend(('elo', {'k': k, 'team': team}, team) for k in ks)
+        if 'elo_dynamic' in formulas:
+            configs.extend(('elo_dynamic', {'scale': s, 'team': team}, team) for s in scales)
+    return configs
+
+_history: Optional[History] = None
+
+def _init_worker(history: History):
+    global _history
+    _history = history
+
+def evaluate(config: Tuple[str, dict, str], warmup: int = 0, history: Optional[History] = None) -> dict:
+    """Replay the whole history under one configuration and score its predictions."""
+    h = history if history is not None else _history
+    name, params, team = config
+    formula = get_formula(name, **params)
+    aggregate = get_team_aggregation(team)
+    mmr = array('i', h.seeds)
+    games = array('i', bytes(4 * len(h.seeds)))
+    slots, starts, splits, winners = h.slots, h.starts, h.splits, h.winners
+    log_loss = brier = correct = 0.0
+    scored = 0
+    start = time.perf_counter()
+    for i in range(len(winners)):
+        a = slots[starts[i]:splits[i]]
+        b = slots[splits[i]:starts[i + 1]]
+        a_mmrs = [mmr[j] for j in a]
+        b_mmrs = [mmr[j] for j in b]
+        score_a = float(winners[i])
+        if i >= warmup:
+            p = expected_score(aggregate(a_mmrs), aggregate(b_mmrs))
+            p = min(max(p, EPSILON), 1 - EPSILON)
+            log_loss -= math.log(p if score_a else 1 - p)
+            brier += (p - score_a) ** 2
+            correct += 0.5 if p == 0.5 else float((p > 0.5) == bool(score_a))
+            scored += 1
+        a_deltas, b_deltas = formula(a_mmrs, b_mmrs, [games[j] for j in a], [games[j] for j in b], score_a)
+        for sl, deltas in ((a, a_deltas), (b, b_deltas)):
+            for j, d in zip(sl, deltas):
+                mmr[j] = max(0, mmr[j] + d)
+                games[j] += 1
+    n = max(scored, 1)
+    return {
+        'formula': name,
+        'params': params,
+        'team': team,
+        'matches': scored,
+        'log_loss': round(log_loss / n, 5),
+        'brier': round(brier / n, 5),
+        'accuracy': round(correct / n, 4),
+        'wall_s': round(time.perf_counter() - start, 3),
+    }
+
+def run(history: History, configs, warmup: int = 0, processes: int = 0) -> List[dict]:
+    """Evaluate every configuration (in a process pool unless ``processes`` is 0); best log-loss first."""
+    if processes:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(history,)) as pool:
+            # several configurations per task keeps IPC overhead negligible
+            chunksize = max(1, len(configs) // (processes * 4))
+            results = list(pool.map(evaluate, configs, itertools.repeat(warmup), chunksize=chunksize))
+    else:
+        results = [evaluate(c, warmup, history) for c in configs]
+    results.sort(key=lambda r: r['log_loss'])
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--formulas', nargs='+', default=['flat', 'elo', 'elo_dynamic'], choices=['flat', 'elo', 'elo_dynamic'])
+    parser.add_argument('--k', type=float, nargs='+', default=DEFAULT_K, help='fixed K values for elo')
+    parser.add_argument('--deltas', type=int, nargs='+', default=DEFAULT_DELTAS, help='deltas for flat')
+    parser.add_argument('--scales', type=float, nargs='+', default=DEFAULT_SCALES, help='multipliers on dynamic_k_factor tiers for elo_dynamic')
+    parser.add_argument('--teams', nargs='+', default=list(TEAM_AGGREGATIONS), choices=list(TEAM_AGGREGATIONS), help='team rating aggregations')
+    parser.add_argument('--warmup', type=int, default=0, help='replay but do not score the first N matches')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='0 runs in this process')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    history = load_history(args.db)
+    configs = grid(args.formulas, args.k, args.deltas, args.scales, args.teams)
+    results = run(history, configs, args.warmup, args.processes)
+    for row in results:
+        print(json.dumps(row, ensure_ascii=False))
+    print(json.dumps({'matches': len(history), 'configs': len(configs), 'processes': args.processes, 'wall_s': round(time.perf_counter() - start, 2)}))
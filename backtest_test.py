@@ -0,0 +1,67 @@
+"""Rating backtest: history loading, scoring and the process pool.
+
+A single even match must score exactly log(2) / 0.25 / 0.5; on a history
+where one player always wins, a faster-learning K must predict better;
+the pool must give the same numbers as the in-process run.
+
+usage: python backtest_test.py
+"""
+import asyncio
+import math
+import os
+import tempfile
+
+from backtest import evaluate, grid, load_history, run
+from db import DB
+from rating import DEFAULT_MMR
+
+def scores(rows):
+    return [{k: v for k, v in r.items() if k != 'wall_s'} for r in rows]
+
+async def build(path: str):
+    db = DB(path)
+    await db.connect()
+    await db.ensure()
+    try:
+        await db.record_match(['1'], ['2'], 'A')
+        await db.upsert_player('3', 'three', regular=1500, general=1500)
+        for i in range(60):
+            await db.record_match(['1', str(4 + i % 4)], ['3', str(8 + i % 3)], 'A')
+    finally:
+        await db.close()
+
+def main():
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        asyncio.run(build(path))
+        history = load_history(path)
+        assert len(history) == 61 and len(history.starts) == 62 and len(history.slots) == 2 + 60 * 4
+        # slots in order of first appearance, seeded with the rating before their first match
+        assert list(history.seeds[:4]) == [DEFAULT_MMR, DEFAULT_MMR, DEFAULT_MMR, 1500]
+        assert list(history.slots[:2]) == [0, 1] and history.winners[0] == 1
+
+        assert evaluate(('elo', {'k': 24, 'team': 'mean'}, 'mean'), history=history)['matches'] == 61
+        assert evaluate(('elo', {'k': 24, 'team': 'mean'}, 'mean'), warmup=60, history=history)['matches'] == 1
+        # the first match alone: both sides at DEFAULT_MMR, so p = 0.5
+        one = load_history(path)
+        one.starts, one.splits, one.winners = one.starts[:2], one.splits[:1], one.winners[:1]
+        single = evaluate(('flat', {'delta': 20}, 'mean'), history=one)
+        assert (single['matches'], single['log_loss'], single['brier'], single['accuracy']) == (1, round(math.log(2), 5), 0.25, 0.5)
+
+        assert len(grid(['flat', 'elo', 'elo_dynamic'], [8, 16], [10], [1.0, 1.5], ['mean', 'max'])) == 2 * (1 + 2 + 2)
+        configs = grid(['elo'], [4, 48], [], [], ['mean'])
+        results = run(history, configs, warmup=1, processes=0)
+        assert [r['log_loss'] for r in results] == sorted(r['log_loss'] for r in results)
+        assert results[0]['params']['k'] == 48, results
+        assert results[0]['accuracy'] > 0.5
+        configs = grid(['flat', 'elo', 'elo_dynamic'], [8, 24], [15], [1.0], ['mean', 'top_weighted'])
+        assert scores(run(history, configs, processes=2)) == scores(run(history, configs, processes=0))
+        print('OK')
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import asyncio
+import glob
+import logging
+import os
+import sqlite3
+import time
+from typing import Callable, Iterable, List
+
+BACKUP_DIR = 'backups'
+# Pages copied per backup step. The source is only read-locked during a
+# step (and in WAL mode writers are never blocked), so small steps keep
+# the bot responsive while a large file is copied.
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_PAUSE = 0.005
+# A write to the source between steps restarts the copy; after this many
+# restarts the rest is copied in one step from a single read snapshot.
+BACKUP_MAX_RESTARTS = 3
+# periodic backups kept per database file
+BACKUP_KEEP = 14
+
+class _TooManyRestarts(Exception):
+    pass
+
+def backup_file(src_path: str, dest_path: str, pages: int = BACKUP_PAGES_PER_STEP,
+                pause: float = BACKUP_STEP_PAUSE, max_restarts: int = BACKUP_MAX_RESTARTS) -> int:
+    """Copy a live database with SQLite's online backup API; returns the page count.
+
+    Blocking; run it in a worker thread. The copy is written next to
+    ``dest_path`` and renamed into place only once complete.
+    """
+    tmp = dest_path + '.part'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    src = sqlite3.connect(f'file:{src_path}?mode=ro', uri=True)
+    dst = sqlite3.connect(tmp)
+    try:
+        restarts = 0
+        last_remaining = None
+
+        def progress(status, remaining, total):
+            nonlocal restarts, last_remaining
+            if last_remaining is not None and remaining > last_remaining:
+                restarts += 1
+                if restarts > max_restarts:
+                    raise _TooManyRestarts()
+            last_remaining = remaining
+
+        try:
+            src.backup(dst, pages=pages, progress=progress, sleep=pause)
+        except _TooManyRestarts:
+            logging.info('Backup of %s kept restarting under writes; finishing in one step', src_path)
+            src.backup(dst)
+        page_count = dst.execute('PRAGMA page_count').fetchone()[0]
+    finally:
+        dst.close()
+        src.close()
+    os.replace(tmp, dest_path)
+    return page_count
+
+def backup_path(src_path: str, dest_dir: str = BACKUP_DIR, label: str = 'backup') -> str:
+    base = os.path.splitext(os.path.basename(src_path))[0]
+    return os.path.join(dest_dir, f'{base}-{label}-{time.strftime("%Y%m%d-%H%M%S")}.db')
+
+async def backup_database(src_path: str, dest_dir: str = BACKUP_DIR, label: str = 'backup') -> str:
+    """Back up a database file without blocking the event loop; returns the backup path."""
+    if src_path == ':memory:':
+        raise ValueError('cannot back up an in-memory database')
+    os.makedirs(dest_dir, exist_ok=True)
+    dest = backup_path(src_path, dest_dir, label)
+    start = time.perf_counter()
+    page_count = await asyncio.to_thread(backup_file, src_path, dest)
+    logging.info('Backed up %s -> %s (%d pages, %.1fs)', src_path, dest, page_count, time.perf_counter() - start)
+    return dest
+
+def prune_backups(src_path: str, dest_dir: str = BACKUP_DIR, label: str = 'backup', keep: int = BACKUP_KEEP) -> List[str]:
+    """Delete all but the newest ``keep`` backups of ``src_path`` with ``label``; returns the removed paths."""
+    base = os.path.splitext(os.path.basename(src_path))[0]
+    # timestamps in the name sort chronologically
+    existing = sorted(glob.glob(os.path.join(dest_dir, f'{base}-{label}-*.db')))
+    removed = existing[:-keep] if keep > 0 else existing
+    for path in removed:
+        os.remove(path)
+    return removed
+
+async def backup_periodically(paths: Callable[[], Iterable[str]], interval: float, dest_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP):
+    """Every ``interval`` seconds, back up each file returned by ``paths()``."""
+    while True:
+        await asyncio.sleep(interval)
+        for path in paths():
+            try:
+                await backup_database(path, dest_dir)
+                prune_backups(path, dest_dir, keep=keep)
+            except Exception:
+                logging.exception('Backup of %s failed', path)
@@ -0,0 +1,235 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+from typing import List, NamedTuple, Sequence, Tuple
+import heapq
+import math
+import random
+import time
+
+from mmr import team_mmr_from_members, expected_score
+
+MAX_PLAYERS = 12
+# sign-ups /밸런스 splits into several 5v5 games (balance_lobbies) once there are more than MAX_PLAYERS
+MAX_LOBBY_PLAYERS = 100
+
+class Split(NamedTuple):
+    team_a: List[int]      # indices into the input rating list
+    team_b: List[int]
+    mmr_a: int             # team_mmr_from_members of each side
+    mmr_b: int
+    gap: float             # |avg(A) - avg(B)|, the value being minimised
+    win_prob_a: float      # expected_score(mmr_a, mmr_b)
+
+def _pair_masks(pairs: Sequence[Tuple[int, int]], n: int) -> List[int]:
+    masks = []
+    for i, j in pairs:
+        if not (0 <= i < n and 0 <= j < n) or i == j:
+            raise ValueError(f'invalid constraint pair: ({i}, {j})')
+        masks.append((1 << i) | (1 << j))
+    return masks
+
+def balance_teams(
+    mmrs: Sequence[int],
+    top_k: int = 5,
+    together: Sequence[Tuple[int, int]] = (),
+    apart: Sequence[Tuple[int, int]] = (),
+) -> List[Split]:
+    """Return the ``top_k`` most even two-team splits of ``mmrs``, best first.
+
+    Every split with ``len(mmrs) // 2`` players on side A is enumerated as a
+    bitmask (252 for 5v5, 924 for 6v6). Player 0 is pinned to side A so
+    mirrored splits are only evaluated once. Splits are ranked by the
+    difference in average MMR, which for fixed team sizes is the same order
+    as ``expected_score`` distance from 0.5.
+
+    ``together``/``apart`` are index pairs that must end up on the same /
+    opposite sides. Raises ValueError if no split satisfies them.
+    """
+    n = len(mmrs)
+    if n < 2:
+        raise ValueError('at least two players are required')
+    if n > MAX_PLAYERS:
+        raise ValueError(f'at most {MAX_PLAYERS} players can be balanced at once')
+    together_masks = _pair_masks(together, n)
+    apart_masks = _pair_masks(apart, n)
+
+    size_a = n // 2
+    size_b = n - size_a
+    total = sum(mmrs)
+    candidates = []
+    # with uneven sides player 0 may sit on either, so only pin it for even n
+    first = 1 if size_a == size_b else 0
+    bits = [1 << i for i in range(n)]
+    for rest in combinations(range(first, n), size_a - first):
+        mask = sum(map(bits.__getitem__, rest)) | first
+        if together_masks and any(mask & pm not in (0, pm) for pm in together_masks):
+            continue
+        if apart_masks and any(mask & pm in (0, pm) for pm in apart_masks):
+            continue
+        sum_a = sum(map(mmrs.__getitem__, rest)) + (mmrs[0] if first else 0)
+        gap = abs(sum_a / size_a - (total - sum_a) / size_b)
+        candidates.append((gap, mask))
+
+    if not candidates:
+        raise ValueError('no split satisfies the given constraints')
+
+    out = []
+    for gap, mask in heapq.nsmallest(top_k, candidates):
+        team_a = [i for i in range(n) if mask >> i & 1]
+        team_b = [i for i in range(n) if not mask >> i & 1]
+        mmr_a = team_mmr_from_members([mmrs[i] for i in team_a])
+        mmr_b = team_mmr_from_members([mmrs[i] for i in team_b])
+        out.append(Split(team_a, team_b, mmr_a, mmr_b, gap, expected_score(mmr_a, mmr_b)))
+    return out
+
+def balance_players(
+    player_ids: Sequence[str],
+    mmrs: Sequence[int],
+    top_k: int = 5,
+    together: Sequence[Tuple[str, str]] = (),
+    apart: Sequence[Tuple[str, str]] = (),
+) -> List[Tuple[List[str], List[str], Split]]:
+    """ID-based wrapper around balance_teams: returns (team_a_ids, team_b_ids, split)."""
+    index = {pid: i for i, pid in enumerate(player_ids)}
+    if len(index) != len(player_ids):
+        raise ValueError('duplicate players')
+
+    def to_idx(pairs):
+        try:
+            return [(index[a], index[b]) for a, b in pairs]
+        except KeyError as e:
+            raise ValueError(f'constraint refers to a player not in the lobby: {e.args[0]}')
+
+    splits = balance_teams(mmrs, top_k, to_idx(together), to_idx(apart))
+    return [([player_ids[i] for i in s.team_a], [player_ids[i] for i in s.team_b], s) for s in splits]
+
+# --- multi-lobby partitioning -------------------------------------------------
+
+class LobbyPlan(NamedTuple):
+    games: List[Split]     # one Split per lobby, indices into the input list
+    bench: List[int]       # players left over when the count isn't a multiple of 2*team_size
+    worst_gap: float       # largest |avg(A) - avg(B)| over all games
+    worst_win_prob: float  # win_prob_a furthest from 0.5 over all games
+
+def snake_draft(order: Sequence[int], n_teams: int) -> List[List[int]]:
+    """Deal ``order`` (strongest first) to ``n_teams`` teams as 1..n, n..1, 1..n, ..."""
+    teams = [[] for _ in range(n_teams)]
+    for pos, idx in enumerate(order):
+        rnd, k = divmod(pos, n_teams)
+        teams[k if rnd % 2 == 0 else n_teams - 1 - k].append(idx)
+    return teams
+
+def _anneal(mmrs: Sequence[int], team_size: int, n_lobbies: int, time_budget: float, seed: int) -> List[List[int]]:
+    """Snake-draft seeding followed by swap-based simulated annealing.
+
+    Teams 2k and 2k+1 form lobby k. The cost is the sum of squared per-lobby
+    sum differences, which pushes down the worst game without ignoring the rest.
+    Runs for ``time_budget`` seconds and returns the best team layout seen.
+    """
+    rng = random.Random(seed)
+    n_teams = 2 * n_lobbies
+    order = sorted(range(len(mmrs)), key=lambda i: mmrs[i], reverse=True)[:n_teams * team_size]
+    teams = snake_draft(order, n_teams)
+    # the snake gives team 0 the best player and team n-1 the second best; pair them up
+    # so that each lobby starts balanced
+    teams = [teams[k // 2] if k % 2 == 0 else teams[n_teams - 1 - k // 2] for k in range(n_teams)]
+    sums = [sum(mmrs[i] for i in t) for t in teams]
+    gaps = [sums[2 * k] - sums[2 * k + 1] for k in range(n_lobbies)]
+    cost = sum(g * g for g in gaps)
+    best_cost = cost
+    best = [list(t) for t in teams]
+
+    t0 = float(max(mmrs) - min(mmrs) or 1) ** 2
+    temp = t0
+    deadline = time.perf_counter() + time_budget
+    start = time.perf_counter()
+    it = 0
+    while True:
+        it += 1
+        if it & 255 == 0:
+            now = time.perf_counter()
+            if now >= deadline or best_cost == 0:
+                break
+            # geometric cooling from t0 down to ~1e-3 over the budget
+            temp = t0 * (1e-3 / t0) ** ((now - start) / time_budget)
+        ta = rng.randrange(n_teams)
+        tb = rng.randrange(n_teams - 1)
+        if tb >= ta:
+            tb += 1
+        pa = rng.randrange(team_size)
+        pb = rng.randrange(team_size)
+        d = mmrs[teams[tb][pb]] - mmrs[teams[ta][pa]]
+        if d == 0:
+            continue
+        la, lb = ta // 2, tb // 2
+        sa = 1 if ta % 2 == 0 else -1
+        sb = 1 if tb % 2 == 0 else -1
+        if la == lb:
+            new_ga = gaps[la] + sa * d - sb * d
+            delta = new_ga * new_ga - gaps[la] * gaps[la]
+        else:
+            new_ga = gaps[la] + sa * d
+            new_gb = gaps[lb] - sb * d
+            delta = new_ga * new_ga + new_gb * new_gb - gaps[la] * gaps[la] - gaps[lb] * gaps[lb]
+        if delta > 0 and rng.random() >= math.exp(-delta / temp):
+            continue
+        teams[ta][pa], teams[tb][pb] = teams[tb][pb], teams[ta][pa]
+        sums[ta] += d
+        sums[tb] -= d
+        if la == lb:
+            gaps[la] = new_ga
+        else:
+            gaps[la] = new_ga
+            gaps[lb] = new_gb
+        cost += delta
+        if cost < best_cost:
+            best_cost = cost
+            best = [list(t) for t in teams]
+    return best
+
+def balance_lobbies(
+    mmrs: Sequence[int],
+    team_size: int = 5,
+    time_budget: float = 0.2,
+    restarts: int = 1,
+    processes: int = 0,
+    seed: int = 0,
+) -> LobbyPlan:
+    """Split a large sign-up list into several balanced ``team_size`` v ``team_size`` games.
+
+    Exhaustive search stops scaling past one lobby, so this runs ``restarts``
+    independent annealing runs of ``time_budget`` seconds each and keeps the
+    plan with the smallest worst-game gap. With ``processes`` > 0 the restarts
+    run in a process pool. The lowest-rated players beyond the last full lobby
+    are benched.
+    """
+    players_per_game = 2 * team_size
+    n_lobbies = len(mmrs) // players_per_game
+    if n_lobbies == 0:
+        raise ValueError(f'at least {players_per_game} players are required')
+    mmrs = list(mmrs)
+    seeds = [seed + r for r in range(max(1, restarts))]
+    args = [(mmrs, team_size, n_lobbies, time_budget, s) for s in seeds]
+    if processes and len(seeds) > 1:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            layouts = list(pool.map(_anneal, *zip(*args)))
+    else:
+        layouts = [_anneal(*a) for a in args]
+
+    best_plan = None
+    for teams in layouts:
+        games = []
+        for k in range(n_lobbies):
+            team_a, team_b = sorted(teams[2 * k]), sorted(teams[2 * k + 1])
+            mmr_a = team_mmr_from_members([mmrs[i] for i in team_a])
+            mmr_b = team_mmr_from_members([mmrs[i] for i in team_b])
+            gap = abs(sum(mmrs[i] for i in team_a) - sum(mmrs[i] for i in team_b)) / team_size
+            games.append(Split(team_a, team_b, mmr_a, mmr_b, gap, expected_score(mmr_a, mmr_b)))
+        playing = {i for g in games for i in g.team_a + g.team_b}
+        bench = [i for i in range(len(mmrs)) if i not in playing]
+        worst_gap = max(g.gap for g in games)
+        worst_win_prob = max((g.win_prob_a for g in games), key=lambda p: abs(p - 0.5))
+        plan = LobbyPlan(games, bench, worst_gap, worst_win_prob)
+        if best_plan is None or plan.worst_gap < best_plan.worst_gap:
+            best_plan = plan
+    return best_plan
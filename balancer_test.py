@@ -0,0 +1,137 @@
+"""Team balancer: optimal two-team splits, multi-lobby plans and the read-only rating lookup behind /밸런스.
+
+Every split is checked against a brute force over all team assignments,
+for even and odd player counts, with and without together/apart
+constraints. Lobby plans must seat full 5v5 games, bench the lowest-rated
+leftovers and beat a greedy assignment. The lookup must rate unknown
+players at DEFAULT_MMR without creating their rows.
+
+usage: python balancer_test.py
+"""
+import asyncio
+import os
+import random
+import tempfile
+from itertools import combinations
+
+from balancer import balance_lobbies, balance_players, balance_teams
+from db import DB
+from playercache import PlayerCache
+from rating import DEFAULT_MMR
+
+def brute_force_gap(mmrs, together=(), apart=()):
+    n = len(mmrs)
+    size_a = n // 2
+    best = None
+    for team_a in combinations(range(n), size_a):
+        side = set(team_a)
+        if any((i in side) != (j in side) for i, j in together) or any((i in side) == (j in side) for i, j in apart):
+            continue
+        sum_a = sum(mmrs[i] for i in team_a)
+        gap = abs(sum_a / size_a - (sum(mmrs) - sum_a) / (n - size_a))
+        best = gap if best is None else min(best, gap)
+    return best
+
+def check_split(mmrs, top_k=3, together=(), apart=()):
+    splits = balance_teams(mmrs, top_k, together, apart)
+    n = len(mmrs)
+    assert abs(splits[0].gap - brute_force_gap(mmrs, together, apart)) < 1e-9, (mmrs, splits[0])
+    assert [s.gap for s in splits] == sorted(s.gap for s in splits)
+    for s in splits:
+        assert sorted(s.team_a + s.team_b) == list(range(n))
+        assert sorted((len(s.team_a), len(s.team_b))) == [n // 2, n - n // 2]
+        assert all((i in s.team_a) == (j in s.team_a) for i, j in together)
+        assert all((i in s.team_a) != (j in s.team_a) for i, j in apart)
+    return splits
+
+def even_split():
+    rng = random.Random(1)
+    for _ in range(20):
+        check_split([int(rng.gauss(1200, 200)) for _ in range(10)])
+    # a perfectly even split exists and must be found
+    best = check_split([1500, 1400, 1300, 1200, 1100, 1500, 1400, 1300, 1200, 1100])[0]
+    assert best.gap == 0 and best.mmr_a == best.mmr_b and best.win_prob_a == 0.5
+    # mirrored splits are not listed twice
+    splits = balance_teams([1000, 1100, 1200, 1300], top_k=10)
+    assert len(splits) == 3, splits
+    check_split([int(rng.gauss(1200, 200)) for _ in range(10)], together=[(0, 1), (2, 3)], apart=[(0, 4)])
+
+def odd_counts():
+    rng = random.Random(2)
+    for n in (2, 3, 5, 7, 9, 11):
+        for _ in range(5):
+            check_split([int(rng.gauss(1200, 200)) for _ in range(n)])
+    # with uneven sides the strongest player may land on the bigger team
+    best = check_split([2000, 1000, 1000])[0]
+    assert 0 in best.team_b and best.gap == 500, best
+    ids = ['a', 'b', 'c', 'd', 'e']
+    team_a, team_b, split = balance_players(ids, [1600, 1200, 1200, 1200, 800], top_k=1, apart=[('a', 'e')])[0]
+    assert 'a' in team_a and 'e' in team_b or 'a' in team_b and 'e' in team_a
+    assert sorted(team_a + team_b) == ids
+    for bad in (dict(together=[('a', 'z')]), dict(together=[('a', 'b')], apart=[('a', 'b')])):
+        try:
+            balance_players(ids, [1200] * 5, **bad)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f'invalid constraints accepted: {bad}')
+
+def greedy_worst_gap(mmrs, team_size=5):
+    """Strongest first, each player to the open team with the lowest total; teams 2k and 2k+1 play each other."""
+    n_teams = 2 * (len(mmrs) // (2 * team_size))
+    teams = [[] for _ in range(n_teams)]
+    for m in sorted(mmrs, reverse=True)[:n_teams * team_size]:
+        min(filter(lambda t: len(t) < team_size, teams), key=sum).append(m)
+    return max(abs(sum(teams[k]) - sum(teams[k + 1])) / team_size for k in range(0, n_teams, 2))
+
+def lobbies():
+    improved = 0
+    for trial, n in enumerate((20, 27, 40, 63)):
+        rng = random.Random(trial)
+        mmrs = [int(rng.gauss(1200, 150)) for _ in range(n)]
+        plan = balance_lobbies(mmrs, time_budget=0.05, seed=trial)
+        assert len(plan.games) == n // 10
+        assert all(len(g.team_a) == len(g.team_b) == 5 for g in plan.games)
+        seated = [i for g in plan.games for i in g.team_a + g.team_b]
+        assert sorted(seated + plan.bench) == list(range(n)) and len(set(seated)) == len(seated)
+        assert len(plan.bench) == n % 10 and max((mmrs[i] for i in plan.bench), default=0) <= min(mmrs[i] for i in seated)
+        assert plan.worst_gap == max(g.gap for g in plan.games)
+        greedy = greedy_worst_gap(mmrs)
+        assert plan.worst_gap <= greedy, (n, plan.worst_gap, greedy)
+        improved += plan.worst_gap < greedy
+    assert improved >= 3, 'annealing rarely beats the greedy assignment'
+    try:
+        balance_lobbies([1200] * 9)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('a lobby was planned without 10 players')
+
+async def no_writes():
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    db = DB(path)
+    await db.connect()
+    await db.ensure()
+    try:
+        await db.upsert_player('1', 'known', regular=1500, general=1500)
+        players = PlayerCache()
+        players.attach(db)
+        assert await players.mmrs(['1', '2', '3']) == [1500, DEFAULT_MMR, DEFAULT_MMR]
+        assert (await db.table_counts())['players'] == 1, 'unknown players were created'
+        assert await db.get_player('2') is None
+    finally:
+        await db.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+def main():
+    even_split()
+    odd_counts()
+    lobbies()
+    asyncio.run(no_writes())
+    print('OK')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""Multi-lobby balancer benchmark: solution quality vs. wall time per lobby size.
+
+usage: python bench_balancer.py [--trials N] [--processes N]
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+
+from balancer import balance_lobbies
+
+LOBBY_SIZES = (20, 30, 40, 60)
+TIME_BUDGETS = (0.01, 0.05, 0.2, 0.5)
+
+def run(trials: int, processes: int):
+    results = []
+    for n in LOBBY_SIZES:
+        for budget in TIME_BUDGETS:
+            gaps = []
+            walls = []
+            for trial in range(trials):
+                rng = random.Random(trial)
+                mmrs = [int(rng.gauss(1200, 150)) for _ in range(n)]
+                start = time.perf_counter()
+                plan = balance_lobbies(mmrs, time_budget=budget, restarts=max(1, processes), processes=processes, seed=trial)
+                walls.append(time.perf_counter() - start)
+                gaps.append(plan.worst_gap)
+            row = {
+                'players': n,
+                'time_budget': budget,
+                'wall_s': round(statistics.mean(walls), 4),
+                'worst_gap_mean': round(statistics.mean(gaps), 2),
+                'worst_gap_max': round(max(gaps), 2),
+            }
+            print(json.dumps(row))
+            results.append(row)
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--trials', type=int, default=5)
+    parser.add_argument('--processes', type=int, default=0)
+    args = parser.parse_args()
+    run(args.trials, args.processes)
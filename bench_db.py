@@ -0,0 +1,167 @@
+"""DB and rating-path benchmark with synthetic players and matches.
+
+Seeds a fresh database with a synthetic population, then drives
+DB.record_match, DB.list_top_players, DB.get_team_members_mmrs and the
+functions in mmr.py sequentially and from many concurrent coroutines.
+Results (ops/sec and p50/p95/p99 latency in ms) are printed as JSON so
+runs can be diffed between releases.
+
+usage: python bench_db.py [--players 1000 100000] [--ops 2000] [--concurrency 50] [--output bench.json]
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from typing import Awaitable, Callable, List
+
+from db import DB, init_db
+from mmr import team_mmr_from_members, expected_score, update_elo, dynamic_k_factor
+from rating import get_formula
+
+MAX_TEAM_SIZE = 6  # same limit as /기록
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = max(0, math.ceil(p * len(sorted_values)) - 1)
+    return sorted_values[k]
+
+def summarize(name: str, latencies: List[float], wall: float, **extra) -> dict:
+    lat = sorted(latencies)
+    return {
+        'name': name,
+        'ops': len(lat),
+        'wall_s': round(wall, 4),
+        'ops_per_sec': round(len(lat) / wall, 1) if wall > 0 else None,
+        'p50_ms': round(percentile(lat, 0.50) * 1000, 4),
+        'p95_ms': round(percentile(lat, 0.95) * 1000, 4),
+        'p99_ms': round(percentile(lat, 0.99) * 1000, 4),
+        **extra,
+    }
+
+def seed_population(path: str, players: int, rng: random.Random):
+    """Insert ``players`` synthetic rows directly (setup, not measured)."""
+    conn = sqlite3.connect(path)
+    rows = ((str(10**17 + i), f'player{i}', 1200, max(0, int(rng.gauss(1200, 200))), 0, 1200) for i in range(players))
+    conn.executemany('INSERT INTO players(discord_id, name, mmr_regular, mmr_general, games_played, max_mmr) VALUES(?,?,?,?,?,?)', rows)
+    conn.commit()
+    conn.close()
+
+def random_match(rng: random.Random, players: int):
+    size_a = rng.randint(1, MAX_TEAM_SIZE)
+    size_b = rng.randint(1, MAX_TEAM_SIZE)
+    ids = [str(10**17 + i) for i in rng.sample(range(players), size_a + size_b)]
+    return ids[:size_a], ids[size_a:], rng.choice('AB')
+
+async def timed_sequential(name: str, ops: int, make_call: Callable[[], Awaitable], **extra) -> dict:
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(ops):
+        t = time.perf_counter()
+        await make_call()
+        latencies.append(time.perf_counter() - t)
+    return summarize(name, latencies, time.perf_counter() - start, **extra)
+
+async def timed_concurrent(name: str, ops: int, concurrency: int, make_call: Callable[[], Awaitable], **extra) -> dict:
+    latencies = []
+    remaining = ops
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            t = time.perf_counter()
+            await make_call()
+            latencies.append(time.perf_counter() - t)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return summarize(name, latencies, time.perf_counter() - start, concurrency=concurrency, **extra)
+
+def timed_cpu(name: str, ops: int, fn: Callable[[], object], **extra) -> dict:
+    # per-call timing of sub-microsecond functions is mostly timer overhead;
+    # time batches of 100 calls and report per-call figures
+    batch = 100
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(max(1, ops // batch)):
+        t = time.perf_counter()
+        for _ in range(batch):
+            fn()
+        latencies.append((time.perf_counter() - t) / batch)
+    wall = time.perf_counter() - start
+    result = summarize(name, latencies, wall, **extra)
+    result['ops'] = len(latencies) * batch
+    result['ops_per_sec'] = round(result['ops'] / wall, 1)
+    return result
+
+async def bench_population(players: int, ops: int, concurrency: int, seed: int) -> List[dict]:
+    rng = random.Random(seed)
+    fd, path = tempfile.mkstemp(suffix='.db', prefix='bench_')
+    os.close(fd)
+    try:
+        await init_db(path)
+        seed_population(path, players, rng)
+        db = DB(path)
+        await db.connect()
+        await db.ensure()
+        try:
+            common = {'players': players}
+            results = [
+                await timed_sequential('record_match', ops, lambda: db.record_match(*random_match(rng, players)), **common),
+                await timed_concurrent('record_match', ops, concurrency, lambda: db.record_match(*random_match(rng, players)), **common),
+                await timed_sequential('list_top_players', ops, lambda: db.list_top_players(10), **common),
+                await timed_concurrent('list_top_players', ops, concurrency, lambda: db.list_top_players(10), **common),
+                await timed_sequential('get_team_members_mmrs', ops, lambda: db.get_team_members_mmrs(random_match(rng, players)[0]), **common),
+                await timed_concurrent('get_team_members_mmrs', ops, concurrency, lambda: db.get_team_members_mmrs(random_match(rng, players)[0]), **common),
+            ]
+        finally:
+            await db.close()
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    return results
+
+def bench_rating(ops: int, seed: int) -> List[dict]:
+    rng = random.Random(seed)
+    team = [int(rng.gauss(1200, 200)) for _ in range(5)]
+    other = [int(rng.gauss(1200, 200)) for _ in range(5)]
+    games = [rng.randint(0, 100) for _ in range(5)]
+    results = [
+        timed_cpu('team_mmr_from_members', ops, lambda: team_mmr_from_members(team)),
+        timed_cpu('expected_score', ops, lambda: expected_score(1250, 1190)),
+        timed_cpu('update_elo', ops, lambda: update_elo(1250, 1190, 1.0)),
+        timed_cpu('dynamic_k_factor', ops, lambda: dynamic_k_factor(17)),
+    ]
+    for name in ('flat', 'elo', 'elo_dynamic'):
+        formula = get_formula(name)
+        results.append(timed_cpu(f'formula:{name}', ops, lambda: formula(team, other, games, games, 1.0)))
+    return results
+
+async def run(populations: List[int], ops: int, concurrency: int, seed: int) -> dict:
+    results = bench_rating(ops * 50, seed)
+    for players in populations:
+        results.extend(await bench_population(players, ops, concurrency, seed))
+    return {'ts': time.strftime('%Y-%m-%dT%H:%M:%S'), 'ops': ops, 'concurrency': concurrency, 'results': results}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--players', type=int, nargs='+', default=[1000, 100000], help='population sizes (up to 1000000)')
+    parser.add_argument('--ops', type=int, default=2000, help='operations per benchmark')
+    parser.add_argument('--concurrency', type=int, default=50, help='coroutines in the concurrent runs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+    report = asyncio.run(run(args.players, args.ops, args.concurrency, args.seed))
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
@@ -5,7 +5,14 @@ import logging
 from discord.ext import commands
 import discord
 
-from commands import setup_commands
+from commands import setup_commands, guilds
+from tree_sync import sync_command_tree
+import charts
+import tournament
+from backup import backup_periodically
+from outbox import OutboxWorker, new_session
+from dispatch import dispatcher
+from metrics import instrument_commands, instrument_db, instrument_http, monitor_event_loop, start_http_endpoint
 try:
     import keyring
 except Exception:
@@ -20,6 +27,81 @@ INTENTS.message_content = enable_priv
 INTENTS.members = enable_priv
 
 PREFIX = '!'
+# Set to expose Prometheus-style metrics on http://127.0.0.1:<port>/metrics
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+# SHARDED=1 runs an AutoShardedBot (shard count from Discord unless SHARD_COUNT is set)
+SHARDED = os.getenv('SHARDED', '0') == '1'
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '0')) or None
+# Comma-separated guild ids to sync slash commands to directly instead of globally (development)
+DEV_GUILD_IDS = [int(g) for g in os.getenv('DEV_GUILD_IDS', '').split(',') if g.strip()]
+# Sync even if the command tree fingerprint is unchanged
+FORCE_COMMAND_SYNC = os.getenv('FORCE_COMMAND_SYNC', '0') == '1'
+# Online backup of every database into backups/ this often (0 disables)
+BACKUP_INTERVAL_HOURS = float(os.getenv('BACKUP_INTERVAL_HOURS', '0'))
+# Base URL of lol-balancer-api (e.g. http://localhost:8080); recorded matches are synced to it via the outbox
+BALANCER_API_URL = os.getenv('BALANCER_API_URL', '')
+
+class BalancerMixin:
+    metrics_runner = None
+    outbox_session = None
+
+    def start_outbox_sync(self):
+        """Run one outbox worker per open database, sharing a keep-alive HTTP session."""
+        self.outbox_session = new_session()
+        workers = {}
+
+        def start(data):
+            worker = workers[data.guild_id] = OutboxWorker(data.db, BALANCER_API_URL, session=self.outbox_session)
+            worker.start()
+
+        async def stop(data):
+            worker = workers.pop(data.guild_id, None)
+            if worker is not None:
+                await worker.stop()
+
+        guilds.on_open.append(start)
+        guilds.on_close.append(stop)
+
+    async def setup_hook(self):
+        instrument_http(self)
+        self.loop.create_task(monitor_event_loop(self))
+        if METRICS_PORT:
+            self.metrics_runner = await start_http_endpoint(METRICS_PORT)
+        # open the default DB pool once for the lifetime of the bot, run schema
+        # migrations and load the leaderboard; per-guild databases (DB_PER_GUILD=1)
+        # get the same treatment lazily on first use
+        if BALANCER_API_URL:
+            self.start_outbox_sync()
+        await guilds.open_default()
+        logging.info('DB pool opened (%s, readers=%d, per-guild=%s)', guilds.default.db.path, guilds.default.db.readers, guilds.per_guild)
+        logging.info('Leaderboard loaded (%d players)', len(guilds.default.leaderboard))
+        if BACKUP_INTERVAL_HOURS > 0:
+            self.loop.create_task(backup_periodically(guilds.db_paths, BACKUP_INTERVAL_HOURS * 3600))
+        # register slash commands once per process (not on every reconnect), and
+        # only when the command tree actually changed since the last sync
+        try:
+            await sync_command_tree(self.tree, DEV_GUILD_IDS, force=FORCE_COMMAND_SYNC)
+        except Exception as e:
+            logging.warning('Failed to sync commands: %s', e)
+
+    async def close(self):
+        try:
+            await super().close()
+        finally:
+            if self.metrics_runner is not None:
+                await self.metrics_runner.cleanup()
+            await dispatcher.close()
+            await guilds.close()
+            if self.outbox_session is not None:
+                await self.outbox_session.close()
+            charts.shutdown()
+            tournament.shutdown()
+
+class BalancerBot(BalancerMixin, commands.Bot):
+    pass
+
+class ShardedBalancerBot(BalancerMixin, commands.AutoShardedBot):
+    pass
 
 def main():
     token = os.getenv('DISCORD_TOKEN')
@@ -36,19 +118,20 @@ def main():
         raise SystemExit('Set DISCORD_TOKEN environment variable or store token in keyring (use store_token.ps1)')
 
     logging.info(f'Privileged intents enabled: {enable_priv}')
-    bot = commands.Bot(command_prefix=PREFIX, intents=INTENTS)
+    if SHARDED:
+        logging.info('Starting in sharded mode (shard_count=%s)', SHARD_COUNT or 'auto')
+        bot = ShardedBalancerBot(command_prefix=PREFIX, intents=INTENTS, shard_count=SHARD_COUNT)
+    else:
+        bot = BalancerBot(command_prefix=PREFIX, intents=INTENTS)
 
     @bot.event
     async def on_ready():
         logging.info(f'Logged in as {bot.user} (id={bot.user.id})')
-        try:
-            # register slash commands
-            await bot.tree.sync()
-            logging.info('Slash commands synced')
-        except Exception as e:
-            logging.warning('Failed to sync commands: %s', e)
 
     setup_commands(bot)
+    # time every command handler and DB call (see /디버그 and METRICS_PORT)
+    instrument_commands(bot)
+    guilds.on_create.append(lambda data: instrument_db(data.db))
 
     bot.run(token)
 
@@ -0,0 +1,49 @@
+import asyncio
+import importlib.util
+import io
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import List, Optional
+
+# Rendering runs in worker processes: matplotlib holds the GIL while drawing
+# and keeps global state, so neither the event loop nor other threads should share it.
+CHART_WORKERS = 1
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+def charts_available() -> bool:
+    return importlib.util.find_spec('matplotlib') is not None
+
+def render_mmr_chart(points: List[dict], title: str = '') -> bytes:
+    """PNG of a DB.mmr_series() result: the closing MMR per bucket with its low/high band."""
+    # the Agg canvas + Figure API avoids pyplot's global figure registry
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    import matplotlib.dates as mdates
+
+    xs = [datetime.fromisoformat(p['ts']) for p in points]
+    fig = Figure(figsize=(8, 4), dpi=100)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.fill_between(xs, [p['low'] for p in points], [p['high'] for p in points], color='#3498db', alpha=0.2, linewidth=0)
+    ax.plot(xs, [p['close'] for p in points], color='#2980b9', marker='o' if len(points) <= 60 else None, markersize=3)
+    ax.set_title(title)
+    ax.set_ylabel('MMR')
+    ax.grid(True, alpha=0.3)
+    ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(ax.xaxis.get_major_locator()))
+    fig.tight_layout()
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png')
+    return buf.getvalue()
+
+async def render_off_loop(points: List[dict], title: str = '') -> bytes:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=CHART_WORKERS)
+    return await asyncio.get_running_loop().run_in_executor(_pool, render_mmr_chart, points, title)
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
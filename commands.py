@@ -1,12 +1,50 @@
+import asyncio
+import io
+import os
+import tempfile
 import discord
 from discord.ext import commands
 from discord import app_commands
 from typing import List, Optional
 
-from db import DB
+from guilds import GuildStore
 from mmr import team_mmr_from_members
+from balancer import balance_lobbies, balance_players, LobbyPlan, MAX_LOBBY_PLAYERS, MAX_PLAYERS
+from rating import FORMULAS
+from metrics import metrics
+from matchqueue import QueueManager, balance_popped
+from charts import charts_available, render_off_loop
+from backup import backup_database
+from db import SEASON_CARRYOVER
+from names import resolver
+from dispatch import dispatcher
+import tournament
+from transfer import TABLES, FORMATS, detect_format, export_table, import_table
 
-db = DB()
+# Per-guild SQLite files when DB_PER_GUILD=1; otherwise every guild shares mmr_bot.db
+guilds = GuildStore(per_guild=os.getenv('DB_PER_GUILD', '0') == '1')
+# the shared/default handle (also used for DMs)
+db = guilds.default.db
+leaderboard = guilds.default.leaderboard
+
+RANKING_PAGE_SIZE = 10
+# rendered /랭킹 pages: (guild_id, page) -> (leaderboard version, embed)
+ranking_embeds = {}
+RANKING_EMBED_CACHE_SIZE = 256
+RECORD_SUMMARY_TITLE = '📝 경기 기록'
+# Discord's default attachment limit for bots
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+# open matchmaking queues, one per (guild_id, channel_id); popped at 10 players
+queues = QueueManager()
+
+def track_queue_ratings(data):
+    """Re-rate queued players as their matches are recorded in ``data``'s database."""
+    if not guilds.per_guild:
+        queues.track(data.db)  # one database for every guild
+    elif data.guild_id is not None:
+        queues.track(data.db, data.guild_id)
+
+guilds.on_open.append(track_queue_ratings)
 
 def mmr_to_tier(mmr: int) -> str:
     # Simple tier mapping; adjust ranges as needed
@@ -31,6 +69,86 @@ def parse_member_input(member_str: str) -> List[str]:
         out.append(t)
     return out
 
+def validate_match_teams(a_ids: List[str], b_ids: List[str], winner: str) -> Optional[str]:
+    """Return an error message if the teams/winner aren't a valid match, else None."""
+    if winner not in ('A', 'B'):
+        return '승자에는 A 또는 B만 입력하세요.'
+    if not a_ids or not b_ids:
+        return '양 팀 모두 최소 1명 이상이어야 합니다.'
+    if len(a_ids) > 6 or len(b_ids) > 6:
+        return '각 팀은 최대 6명까지 허용됩니다.'
+    if len(set(a_ids)) != len(a_ids) or len(set(b_ids)) != len(b_ids):
+        return '같은 유저가 한 팀에 두 번 포함될 수 없습니다.'
+    if set(a_ids) & set(b_ids):
+        return '같은 유저가 양 팀에 중복으로 포함될 수 없습니다.'
+    return None
+
+def parse_pair_groups(groups_str: Optional[str]) -> List[tuple]:
+    """Parse comma-separated player groups ("@a @b, @c @d") into ID pairs.
+
+    A group of more than two players is expanded into pairs with its first member.
+    """
+    pairs = []
+    if not groups_str:
+        return pairs
+    for group in groups_str.split(','):
+        ids = parse_member_input(group)
+        if len(ids) < 2:
+            raise ValueError(f'그룹에는 두 명 이상이 필요합니다: {group.strip()}')
+        pairs.extend((ids[0], other) for other in ids[1:])
+    return pairs
+
+def balance_embed(results, title: str = '⚖️ 팀 밸런스') -> discord.Embed:
+    """Render balance_players() results: the best split plus any alternatives."""
+    team_a, team_b, best = results[0]
+    embed = discord.Embed(title=title, color=0x3498db)
+    embed.add_field(name=f'🟦 A팀 (평균 {best.mmr_a})', value='\n'.join(f'<@{pid}>' for pid in team_a), inline=True)
+    embed.add_field(name=f'🟥 B팀 (평균 {best.mmr_b})', value='\n'.join(f'<@{pid}>' for pid in team_b), inline=True)
+    embed.add_field(name='예상 승률', value=f'A {best.win_prob_a*100:.1f}% · B {(1-best.win_prob_a)*100:.1f}% (평균 차이 {best.gap:.1f})', inline=False)
+    if len(results) > 1:
+        alt_lines = []
+        for i, (alt_a, alt_b, s) in enumerate(results[1:], start=2):
+            alt_lines.append(f"{i}. A: {' '.join(f'<@{pid}>' for pid in alt_a)} vs B: {' '.join(f'<@{pid}>' for pid in alt_b)} (차이 {s.gap:.1f})")
+        embed.add_field(name='대안', value='\n'.join(alt_lines), inline=False)
+    return embed
+
+def lobbies_embed(plan: LobbyPlan, ids: List[str]) -> discord.Embed:
+    """Render a balance_lobbies() plan: one field per game, then the benched players."""
+    embed = discord.Embed(title=f'⚖️ 로비 분배 ({len(plan.games)}경기)', color=0x3498db)
+    for k, game in enumerate(plan.games, start=1):
+        team_a = ' '.join(f'<@{ids[i]}>' for i in game.team_a)
+        team_b = ' '.join(f'<@{ids[i]}>' for i in game.team_b)
+        embed.add_field(name=f'{k}경기 · A {game.mmr_a} vs B {game.mmr_b} (차이 {game.gap:.1f})', value=f'🟦 {team_a}\n🟥 {team_b}', inline=False)
+    if plan.bench:
+        embed.add_field(name=f'대기 ({len(plan.bench)}명)', value=' '.join(f'<@{ids[i]}>' for i in plan.bench), inline=False)
+    embed.set_footer(text=f'최대 평균 차이 {plan.worst_gap:.1f}')
+    return embed
+
+TOURNAMENT_FORMAT_LABELS = {'single_elimination': '싱글 엘리미네이션', 'round_robin': '풀리그', 'swiss': '스위스'}
+
+def tournament_embed(t: dict, teams: dict) -> discord.Embed:
+    """Current round (with game numbers for /토너먼트결과) and standings of a DB.get_tournament() result."""
+    def name(team_id):
+        return teams[team_id]['name'] if team_id in teams else f'#{team_id}'
+
+    status = '진행 중' if t['status'] == 'running' else '종료'
+    embed = discord.Embed(title=f"🏆 {t['name']} (#{t['id']})", color=0x9b59b6)
+    embed.description = f"{TOURNAMENT_FORMAT_LABELS.get(t['format'], t['format'])} · {len(t['team_ids'])}팀 · {status}"
+    if t['champion_team_id'] is not None:
+        embed.add_field(name='우승', value=f"👑 {name(t['champion_team_id'])}", inline=False)
+    pending = [g for g in t['games'] if g['winner'] is None]
+    if pending:
+        current = pending[0]['round']
+        lines = [f"`{g['id']}` {name(g['team_a'])} vs {name(g['team_b'])}" for g in pending if g['round'] == current]
+        embed.add_field(name=f'{current}라운드 남은 경기 (경기 번호)', value='\n'.join(lines)[:1024], inline=False)
+    wins = dict.fromkeys(t['team_ids'], 0)
+    for g in t['games']:
+        if g['winner'] is not None:
+            wins[g['team_a'] if g['winner'] == 'A' else g['team_b']] += 1
+    order = sorted(t['team_ids'], key=lambda tid: (-wins[tid], t['team_ids'].index(tid)))
+    embed.add_field(name='순위 (승수)', value='\n'.join(f'{i}. {name(tid)} · {wins[tid]}승' for i, tid in enumerate(order, start=1))[:1024], inline=False)
+    return embed
+
 def setup_commands(bot: commands.Bot):
     # prefix command
     @bot.command(name='랭킹')
@@ -41,39 +159,108 @@ def setup_commands(bot: commands.Bot):
     async def register_prefix(ctx: commands.Context, team_name: str, *member_ids: str):
         # 서버 채널 + 호출자 권한 확인 (관리자 또는 서버관리)
         if ctx.guild is None:
-            await ctx.send('이 명령은 서버 채널에서만 사용할 수 있습니다.')
+            dispatcher.send(ctx.channel, '이 명령은 서버 채널에서만 사용할 수 있습니다.')
             return
         perms = getattr(ctx.author, 'guild_permissions', None)
         if not perms or not (perms.administrator or perms.manage_guild):
-            await ctx.send('관리자 또는 서버 관리 권한이 있어야 사용할 수 있습니다.')
+            dispatcher.send(ctx.channel, '관리자 또는 서버 관리 권한이 있어야 사용할 수 있습니다.')
             return
         # member_ids expected to be discord IDs or mentions; store raw strings for now
         await register_team(ctx, team_name, list(member_ids))
 
     # slash commands
     @bot.tree.command(name='랭킹', description='MMR 랭킹 확인')
-    async def ranking(interaction: discord.Interaction):
+    @app_commands.describe(page='페이지 번호 (10명 단위)')
+    async def ranking(interaction: discord.Interaction, page: int = 1):
         await interaction.response.defer()
-        # Simple ranking: list top players by mmr_general
-        await db.ensure()
-        tops = await db.list_top_players(10, use_regular=False)
+        page = max(page, 1)
+        g = await guilds.get(interaction.guild_id)
+        # the same page is re-rendered only after the leaderboard changes
+        key = (interaction.guild_id, page)
+        version = g.leaderboard.version
+        cached = ranking_embeds.get(key)
+        if g.leaderboard.loaded and cached is not None and cached[0] == version:
+            dispatcher.followup(interaction, embed=cached[1])
+            return
+        # Served from the in-memory leaderboard; fall back to SQLite if it isn't loaded
+        if g.leaderboard.loaded:
+            tops = g.leaderboard.page(page, RANKING_PAGE_SIZE)
+            pages = g.leaderboard.page_count(RANKING_PAGE_SIZE)
+        else:
+            tops = (await g.db.list_top_players(page * RANKING_PAGE_SIZE, use_regular=False))[(page - 1) * RANKING_PAGE_SIZE:]
+            pages = None
         if not tops:
-            await interaction.followup.send('랭킹 데이터가 없습니다. 플레이어를 추가하세요.')
+            dispatcher.followup(interaction, '랭킹 데이터가 없습니다. 플레이어를 추가하세요.')
             return
+        # one batched lookup for the whole page; changed names are written back to players.name
+        names = await resolver.resolve_and_store(interaction.client, interaction.guild, g.db, tops)
         # Build an embed similar to the screenshot: emoji, name, mmr, wins/losses, winrate, max mmr
-        embed = discord.Embed(title='🏅 MMR Top 10', color=0xf1c40f)
-        for i, p in enumerate(tops):
+        title = '🏅 MMR Top 10' if page == 1 else f'🏅 MMR 랭킹 {page}페이지'
+        if pages:
+            title += f' ({page}/{pages})'
+        embed = discord.Embed(title=title, color=0xf1c40f)
+        for i, p in enumerate(tops, start=(page - 1) * RANKING_PAGE_SIZE):
             win = p.get('wins', 0) or 0
             loss = p.get('losses', 0) or 0
             gp = p.get('games_played', 0) or 0
             winrate = f"{(win/gp*100):.1f}%" if gp > 0 else '0%'
-            name = p.get('name')
+            name = names.get(p['discord_id']) or p.get('name')
             mmr = p.get('mmr')
             max_mmr = p.get('max_mmr')
             emoji = '🥇' if i == 0 else ('🥈' if i == 1 else ('🥉' if i == 2 else '🔹'))
             tier = mmr_to_tier(mmr if mmr is not None else 1200)
             embed.add_field(name=f"{emoji} {i+1}. {name} ({tier})", value=f"MMR: {mmr} · 전적: {win}승 {loss}패 · 승률: {winrate} · 최고 MMR: {max_mmr}", inline=False)
-        await interaction.followup.send(embed=embed)
+        if g.leaderboard.loaded:
+            if len(ranking_embeds) >= RANKING_EMBED_CACHE_SIZE:
+                ranking_embeds.clear()
+            # keyed to the version the page was read at: a change during name resolution just means a re-render next time
+            ranking_embeds[key] = (version, embed)
+        dispatcher.followup(interaction, embed=embed)
+
+    @bot.tree.command(name='팀랭킹', description='등록된 팀의 레이팅 랭킹 (멤버 MMR 기준)')
+    @app_commands.describe(page='페이지 번호 (10팀 단위)')
+    async def team_ranking(interaction: discord.Interaction, page: int = 1):
+        await interaction.response.defer()
+        page = max(page, 1)
+        g = await guilds.get(interaction.guild_id)
+        # teams.rating is kept current by every match, so this is one indexed read
+        teams = await g.db.list_top_teams(RANKING_PAGE_SIZE, (page - 1) * RANKING_PAGE_SIZE)
+        if not teams:
+            dispatcher.followup(interaction, '등록된 팀이 없습니다. /팀등록 으로 팀을 추가하세요.')
+            return
+        title = '🛡️ 팀 랭킹' if page == 1 else f'🛡️ 팀 랭킹 {page}페이지'
+        embed = discord.Embed(title=title, color=0x3498db)
+        for i, t in enumerate(teams, start=(page - 1) * RANKING_PAGE_SIZE):
+            emoji = '🥇' if i == 0 else ('🥈' if i == 1 else ('🥉' if i == 2 else '🔹'))
+            # mentions render as names inside embeds without pinging anyone
+            members = ' '.join(f'<@{pid}>' if pid.isdigit() else pid for pid in t['member_ids'])
+            embed.add_field(name=f"{emoji} {i+1}. {t['name']} ({mmr_to_tier(t['rating'])})", value=f"레이팅: {t['rating']} · 멤버: {members}", inline=False)
+        dispatcher.followup(interaction, embed=embed)
+
+    @bot.tree.command(name='내정보', description='내(또는 다른 유저의) MMR, 티어, 순위, 전적, 최근 경기 결과')
+    @app_commands.describe(member='조회할 유저 (기본: 나)')
+    async def my_info(interaction: discord.Interaction, member: Optional[discord.Member] = None):
+        # opening the guild's database or a cache miss can outlast the 3-second reply window
+        await interaction.response.defer()
+        user = member or interaction.user
+        pid = str(user.id)
+        g = await guilds.get(interaction.guild_id)
+        # hot players are answered from memory (player cache + leaderboard), no SQLite round trip
+        p = await g.players.get(pid)
+        if p is None:
+            dispatcher.followup(interaction, f'{user.display_name} 님의 기록이 없습니다.')
+            return
+        gp = p.games_played or 0
+        winrate = f'{(p.wins / gp * 100):.1f}%' if gp > 0 else '0%'
+        rank = g.leaderboard.rank_of(pid)
+        form = ' '.join('승' if r == 'W' else '패' for r in p.recent) or '없음'
+        embed = discord.Embed(title=f'📋 {user.display_name} 님의 정보', color=0x2ecc71)
+        embed.add_field(name='MMR', value=f'{p.mmr_general} ({mmr_to_tier(p.mmr_general)})')
+        embed.add_field(name='순위', value=f'{rank}위 / {len(g.leaderboard)}명' if rank else '-')
+        embed.add_field(name='최고 MMR', value=str(p.max_mmr))
+        embed.add_field(name='전적', value=f'{p.wins}승 {p.losses}패 · 승률: {winrate}', inline=False)
+        embed.add_field(name=f'최근 {g.players.form_length}경기 (최신순)', value=form, inline=False)
+        dispatcher.followup(interaction, embed=embed)
 
     # Slash command version: accept up to 6 Member options for better UX
     @bot.tree.command(name='팀등록', description='팀 등록: 팀명 + 멤버(최대 6명) + (선택)시드MMR')
@@ -103,43 +290,384 @@ def setup_commands(bot: commands.Bot):
         ids = [str(m.id) for m in members]
         # validation
         if not ids:
-            await interaction.followup.send('적어도 한 명 이상의 멤버를 멘션으로 선택해야 합니다.')
+            dispatcher.followup(interaction, '적어도 한 명 이상의 멤버를 멘션으로 선택해야 합니다.')
             return
         if len(ids) > 6:
-            await interaction.followup.send('최대 6명까지 등록할 수 있습니다.')
+            dispatcher.followup(interaction, '최대 6명까지 등록할 수 있습니다.')
             return
         if len(set(ids)) != len(ids):
-            await interaction.followup.send('중복된 멤버가 있습니다. 동일한 유저는 한 번만 선택하세요.')
+            dispatcher.followup(interaction, '중복된 멤버가 있습니다. 동일한 유저는 한 번만 선택하세요.')
             return
-        await db.ensure()
+        g = await guilds.get(interaction.guild_id)
         # upsert players with seed mmr if provided
-        for pid in ids:
-            await db.upsert_player(pid, str(pid), regular=seed if seed else 1200, general=seed if seed else 1200)
-        await db.register_team(team_name, ids, seed)
-        await interaction.followup.send(f'팀 **{team_name}** 이(가) 등록되었습니다. 시드: {seed} 멤버: {len(ids)}')
+        for m in members:
+            pid = str(m.id)
+            await g.db.upsert_player(pid, m.display_name, regular=seed if seed else 1200, general=seed if seed else 1200)
+        await g.db.register_team(team_name, ids, seed)
+        dispatcher.followup(interaction, f'팀 **{team_name}** 이(가) 등록되었습니다. 시드: {seed} 멤버: {len(ids)}')
 
     @bot.tree.command(name='기록', description='경기 기록: /기록 teamA_ids | teamB_ids | winner(A/B)')
     async def record(interaction: discord.Interaction, team_a: str, team_b: str, winner: str):
+        # the caller gets a private ack; the channel sees one summary message per burst
+        await interaction.response.defer(ephemeral=True)
+        # same parsing as /기록수정, so a mention and a bare ID are the same player
+        a_ids = parse_member_input(team_a) if team_a else []
+        b_ids = parse_member_input(team_b) if team_b else []
+        error = validate_match_teams(a_ids, b_ids, winner)
+        if error:
+            dispatcher.followup(interaction, error)
+            return
+        g = await guilds.get(interaction.guild_id)
+        match_id = await g.db.record_match(a_ids, b_ids, winner)
+        line = f'#{match_id}: {len(a_ids)} vs {len(b_ids)} 승자: {winner}'
+        dispatcher.followup(interaction, f'기록 완료 ({line})', ephemeral=True)
+        dispatcher.summary(interaction.channel, 'record', line, RECORD_SUMMARY_TITLE, interaction=interaction)
+
+    @bot.tree.command(name='기록수정', description='경기 기록 수정 (관리자 전용): 경기 번호 + 올바른 팀/승자')
+    @app_commands.guild_only()
+    @app_commands.describe(match_id='경기 번호 (/기록 응답의 #번호)')
+    async def record_edit(interaction: discord.Interaction, match_id: int, team_a: str, team_b: str, winner: str):
+        if interaction.guild is None or not isinstance(interaction.user, discord.Member):
+            await interaction.response.send_message('이 명령은 서버 채널에서만 사용할 수 있습니다.', ephemeral=True)
+            return
+        user_perms = interaction.user.guild_permissions
+        if not (user_perms.administrator or user_perms.manage_guild):
+            await interaction.response.send_message('관리자 또는 서버 관리 권한이 있어야 사용할 수 있습니다.', ephemeral=True)
+            return
         await interaction.response.defer()
-        a_ids = [x.strip() for x in team_a.split()] if team_a else []
-        b_ids = [x.strip() for x in team_b.split()] if team_b else []
-        # basic validation
-        if winner not in ('A', 'B'):
-            await interaction.followup.send('승자에는 A 또는 B만 입력하세요.')
+        a_ids = parse_member_input(team_a)
+        b_ids = parse_member_input(team_b)
+        error = validate_match_teams(a_ids, b_ids, winner)
+        if error:
+            dispatcher.followup(interaction, error)
             return
-        if not a_ids or not b_ids:
-            await interaction.followup.send('양 팀 모두 최소 1명 이상이어야 합니다.')
+        try:
+            g = await guilds.get(interaction.guild_id)
+            replayed = await g.db.correct_match(match_id, a_ids, b_ids, winner)
+        except KeyError:
+            dispatcher.followup(interaction, f'#{match_id} 경기를 찾을 수 없습니다.')
             return
-        if len(a_ids) > 6 or len(b_ids) > 6:
-            await interaction.followup.send('각 팀은 최대 6명까지 허용됩니다.')
+        except ValueError as e:
+            dispatcher.followup(interaction, str(e))
             return
-        # no overlapping players
-        if set(a_ids) & set(b_ids):
-            await interaction.followup.send('같은 유저가 양 팀에 중복으로 포함될 수 없습니다.')
+        dispatcher.followup(interaction, f'#{match_id} 수정 완료: {len(a_ids)} vs {len(b_ids)} 승자: {winner} (재계산 {replayed}경기)')
+
+    @bot.tree.command(name='기록삭제', description='경기 기록 삭제 (관리자 전용)')
+    @app_commands.guild_only()
+    @app_commands.describe(match_id='경기 번호 (/기록 응답의 #번호)')
+    async def record_delete(interaction: discord.Interaction, match_id: int):
+        if interaction.guild is None or not isinstance(interaction.user, discord.Member):
+            await interaction.response.send_message('이 명령은 서버 채널에서만 사용할 수 있습니다.', ephemeral=True)
             return
-        await db.ensure()
-        await db.record_match(a_ids, b_ids, winner, use_regular=False)
-        await interaction.followup.send(f'기록 완료: {len(a_ids)} vs {len(b_ids)} 승자: {winner}')
+        user_perms = interaction.user.guild_permissions
+        if not (user_perms.administrator or user_perms.manage_guild):
+            await interaction.response.send_message('관리자 또는 서버 관리 권한이 있어야 사용할 수 있습니다.', ephemeral=True)
+            return
+        await interaction.response.defer()
+        try:
+            g = await guilds.get(interaction.guild_id)
+            replayed = await g.db.delete_match(match_id)
+        except KeyError:
+            dispatcher.followup(interaction, f'#{match_id} 경기를 찾을 수 없습니다.')
+            return
+        except ValueError as e:
+            dispatcher.followup(interaction, str(e))
+            return
+        dispatcher.followup(interaction, f'#{match_id} 삭제 완료 (재계산 {replayed}경기)')
+
+    @bot.tree.command(name='밸런스', description='팀 밸런스: 참가자를 MMR 차이가 가장 적은 두 팀으로 (12명 초과 시 5대5 여러 경기로) 나눕니다')
+    @app_commands.describe(players='참가자 멘션 또는 ID (공백 구분)', together='같은 팀 묶음 (예: @a @b, @c @d)', apart='다른 팀 묶음 (예: @a @b)', alternatives='추가로 보여줄 대안 수')
+    async def balance(interaction: discord.Interaction, players: str, together: Optional[str] = None, apart: Optional[str] = None, alternatives: int = 2):
+        await interaction.response.defer()
+        ids = parse_member_input(players)
+        if len(ids) < 2:
+            dispatcher.followup(interaction, '최소 2명 이상이어야 합니다.')
+            return
+        if len(ids) > MAX_LOBBY_PLAYERS:
+            dispatcher.followup(interaction, f'최대 {MAX_LOBBY_PLAYERS}명까지 나눌 수 있습니다.')
+            return
+        if len(ids) > MAX_PLAYERS and (together or apart):
+            dispatcher.followup(interaction, f'{MAX_PLAYERS}명을 넘으면 같은 팀/다른 팀 묶음은 사용할 수 없습니다.')
+            return
+        if len(set(ids)) != len(ids):
+            dispatcher.followup(interaction, '중복된 멤버가 있습니다. 동일한 유저는 한 번만 입력하세요.')
+            return
+        invalid = [pid for pid in ids if not pid.isdigit()]
+        if invalid:
+            dispatcher.followup(interaction, f'멘션 또는 숫자 ID만 입력하세요: {" ".join(invalid)}')
+            return
+        try:
+            together_pairs = parse_pair_groups(together)
+            apart_pairs = parse_pair_groups(apart)
+            g = await guilds.get(interaction.guild_id)
+            # read-only lookup: players who haven't played yet count as DEFAULT_MMR without being created
+            mmrs = await g.players.mmrs(ids)
+            if len(ids) > MAX_PLAYERS:
+                # too many for one exhaustive split: several 5v5 games, annealed off the event loop
+                plan = await asyncio.to_thread(balance_lobbies, mmrs)
+                dispatcher.followup(interaction, embed=lobbies_embed(plan, ids))
+                return
+            results = balance_players(ids, mmrs, top_k=1 + max(0, min(alternatives, 5)), together=together_pairs, apart=apart_pairs)
+        except ValueError as e:
+            dispatcher.followup(interaction, f'밸런스 실패: {e}')
+            return
+        dispatcher.followup(interaction, embed=balance_embed(results))
+
+    @bot.tree.command(name='참가', description='이 채널의 매칭 대기열에 참가합니다 (10명이 모이면 자동으로 팀을 나눕니다)')
+    @app_commands.guild_only()
+    async def queue_join(interaction: discord.Interaction):
+        pid = str(interaction.user.id)
+        key = (interaction.guild_id, interaction.channel_id)
+        current = queues.queue_of(pid)
+        if current is not None:
+            where = '이 채널' if current == key else f'<#{current[1]}>'
+            await interaction.response.send_message(f'이미 {where} 대기열에 있습니다.', ephemeral=True)
+            return
+        # opening the guild database or a cache miss may take a while
+        await interaction.response.defer()
+        g = await guilds.get(interaction.guild_id)
+        # read through the player cache (nothing is written for new players); matches
+        # recorded while queued update the rating (see track_queue_ratings)
+        mmr = (await g.players.mmrs([pid]))[0]
+        try:
+            q = queues.join(key, pid, mmr)
+        except ValueError:
+            # joined elsewhere while the rating was being fetched
+            dispatcher.followup(interaction, '이미 다른 대기열에 있습니다.')
+            return
+        popped = queues.pop_ready(key)
+        if popped is None:
+            dispatcher.followup(interaction, f'<@{pid}> 대기열 참가 ({len(q)}/{q.size})')
+            return
+        results = balance_popped(popped)
+        mentions = ' '.join(f'<@{p}>' for p, _ in popped)
+        dispatcher.followup(interaction, f'매칭 완료! {mentions}', embed=balance_embed(results, title='🎮 매칭 완료'))
+
+    @bot.tree.command(name='나가기', description='매칭 대기열에서 나갑니다')
+    @app_commands.guild_only()
+    async def queue_leave(interaction: discord.Interaction):
+        key = queues.leave(str(interaction.user.id))
+        if key is None:
+            await interaction.response.send_message('대기 중인 대기열이 없습니다.', ephemeral=True)
+            return
+        q = queues.get(key)
+        await interaction.response.send_message(f'<@{interaction.user.id}> 대기열에서 나갔습니다 ({len(q) if q else 0}/{queues.size})')
+
+    @bot.tree.command(name='큐', description='이 채널의 매칭 대기열 확인')
+    @app_commands.guild_only()
+    async def queue_show(interaction: discord.Interaction):
+        q = queues.get((interaction.guild_id, interaction.channel_id))
+        if q is None:
+            await interaction.response.send_message(f'대기열이 비어 있습니다. (0/{queues.size}) `/참가`로 참가하세요.')
+            return
+        embed = discord.Embed(title=f'⏳ 매칭 대기열 ({len(q)}/{q.size})', color=0x2ecc71)
+        embed.description = '\n'.join(f'{i}. <@{pid}> · MMR {mmr}' for i, (pid, mmr) in enumerate(q.entries.items(), start=1))
+        await interaction.response.send_message(embed=embed)
+
+    @bot.tree.command(name='그래프', description='플레이어의 MMR 변화 그래프')
+    @app_commands.describe(member='대상 (기본: 나)', days='최근 며칠 (기본: 전체)', resolution='집계 단위')
+    @app_commands.choices(resolution=[app_commands.Choice(name=label, value=value) for label, value in (('시간', 'hour'), ('일', 'day'), ('주', 'week'))])
+    async def graph(interaction: discord.Interaction, member: Optional[discord.User] = None, days: Optional[int] = None, resolution: str = 'day'):
+        if not charts_available():
+            await interaction.response.send_message('그래프 기능을 사용하려면 matplotlib을 설치하세요.', ephemeral=True)
+            return
+        await interaction.response.defer()
+        target = member or interaction.user
+        g = await guilds.get(interaction.guild_id)
+        points = await g.db.mmr_series(str(target.id), days=days if days and days > 0 else None, resolution=resolution)
+        if not points:
+            dispatcher.followup(interaction, f'{target.display_name}님의 MMR 기록이 없습니다.')
+            return
+        png = await render_off_loop(points, title=f'MMR ({resolution})')
+        first, last = points[0], points[-1]
+        embed = discord.Embed(title=f'📈 {target.display_name} MMR 그래프', color=0x3498db)
+        embed.description = f"{first['ts']} ~ {last['ts']} · {first['open']} → {last['close']} · 최고 {max(p['high'] for p in points)} · {sum(p['games'] for p in points)}경기"
+        embed.set_image(url='attachment://mmr.png')
+        dispatcher.followup(interaction, embed=embed, file=discord.File(io.BytesIO(png), filename='mmr.png'))
+
+    @bot.tree.command(name='레이팅재계산', description='전체 경기 기록으로 MMR 재계산 (관리자 전용)')
+    @app_commands.guild_only()
+    @app_commands.describe(formula='레이팅 공식 (flat, elo, elo_dynamic)')
+    @app_commands.choices(formula=[app_commands.Choice(name=name, value=name) for name in FORMULAS])
+    async def recompute(interaction: discord.Interaction, formula: str):
+        if interaction.guild is None or not isinstance(interaction.user, discord.Member):
+            await interaction.response.send_message('이 명령은 서버 채널에서만 사용할 수 있습니다.', ephemeral=True)
+            return
+        user_perms = interaction.user.guild_permissions
+        if not (user_perms.administrator or user_perms.manage_guild):
+            await interaction.response.send_message('관리자 또는 서버 관리 권한이 있어야 사용할 수 있습니다.', ephemeral=True)
+            return
+        await interaction.response.defer()
+        g = await guilds.get(interaction.guild_id)
+        count = await g.db.recompute_ratings(formula)
+        dispatcher.followup(interaction, f'재계산 완료: 공식 **{formula}**, 플레이어 {count}명. 이후 경기도 이 공식으로 기록됩니다.')
+
+    @bot.tree.command(name='시즌종료', description='시즌 종료 (관리자 전용): 백업 후 기록을 보관하고 MMR을 소프트 리셋합니다')
+    @app_commands.guild_only()
+    @app_commands.describe(name='보관할 시즌 이름', carryover=f'유지 비율 0~1 (기본 {SEASON_CARRYOVER}: 1200과의 차이를 이만큼 유지)')
+    async def season_end(interaction: discord.Interaction, name: str, carryover: float = SEASON_CARRYOVER):
+        if interaction.guild is None or not isinstance(interaction.user, discord.Member):
+            await interaction.response.send_message('이 명령은 서버 채널에서만 사용할 수 있습니다.', ephemeral=True)
+            return
+        user_perms = interaction.user.guild_permissions
+        if not (user_perms.administrator or user_perms.manage_guild):
+            await interaction.response.send_message('관리자 또는 서버 관리 권한이 있어야 사용할 수 있습니다.', ephemeral=True)
+            return
+        if not 0 <= carryover <= 1:
+            await interaction.response.send_message('유지 비율은 0과 1 사이여야 합니다.', ephemeral=True)
+            return
+        await interaction.response.defer()
+        g = await guilds.get(interaction.guild_id)
+        # online backup first (pages copied in small steps in a worker thread)
+        try:
+            backup_path = await backup_database(g.db.path, label='season')
+        except Exception as e:
+            dispatcher.followup(interaction, f'백업 실패로 시즌을 종료하지 않았습니다: {e}')
+            return
+        season = await g.db.end_season(name, carryover)
+        standings = await g.db.season_standings(season['season_id'], limit=3)
+        names = await resolver.resolve(interaction.client, interaction.guild, [p['discord_id'] for p in standings], {p['discord_id']: p['name'] for p in standings})
+        embed = discord.Embed(title=f"🏁 시즌 종료: {name}", color=0xe67e22)
+        embed.description = f"경기 {season['matches']}개 · 플레이어 {season['players']}명 보관 · MMR 유지 비율 {carryover}"
+        if standings:
+            medals = ('🥇', '🥈', '🥉')
+            embed.add_field(name='최종 순위', value='\n'.join(f"{medals[i]} {names[p['discord_id']]} · MMR {p['mmr']} ({p['wins']}승 {p['losses']}패)" for i, p in enumerate(standings)), inline=False)
+        embed.set_footer(text=f'백업: {os.path.basename(backup_path)}')
+        dispatcher.followup(interaction, embed=embed)
+
+    @bot.tree.command(name='토너먼트생성', description='등록된 팀으로 토너먼트 생성 (관리자 전용): 팀 레이팅 순으로 시드 배정')
+    @app_commands.guild_only()
+    @app_commands.describe(name='토너먼트 이름', fmt='진행 방식', teams='참가 팀 번호 (공백 구분)', rounds='스위스 라운드 수 (기본: log2(팀 수))')
+    @app_commands.choices(fmt=[app_commands.Choice(name=label, value=value) for value, label in TOURNAMENT_FORMAT_LABELS.items()])
+    async def tournament_create(interaction: discord.Interaction, name: str, fmt: str, teams: str, rounds: Optional[int] = None):
+        if interaction.guild is None or not isinstance(interaction.user, discord.Member):
+            await interaction.response.send_message('이 명령은 서버 채널에서만 사용할 수 있습니다.', ephemeral=True)
+            return
+        user_perms = interaction.user.guild_permissions
+        if not (user_perms.administrator or user_perms.manage_guild):
+            await interaction.response.send_message('관리자 또는 서버 관리 권한이 있어야 사용할 수 있습니다.', ephemeral=True)
+            return
+        await interaction.response.defer()
+        g = await guilds.get(interaction.guild_id)
+        try:
+            team_ids = [int(x) for x in teams.replace(',', ' ').split()]
+            tournament_id = await tournament.create(g.db, name, fmt, team_ids, rounds)
+        except ValueError as e:
+            dispatcher.followup(interaction, f'토너먼트 생성 실패: {e}')
+            return
+        t = await g.db.get_tournament(tournament_id)
+        dispatcher.followup(interaction, embed=tournament_embed(t, await g.db.get_teams(t['team_ids'])))
+
+    @bot.tree.command(name='토너먼트', description='토너먼트 진행 상황 (남은 경기와 순위)')
+    @app_commands.describe(tournament_id='토너먼트 번호 (기본: 가장 최근)')
+    async def tournament_show(interaction: discord.Interaction, tournament_id: Optional[int] = None):
+        await interaction.response.defer()
+        g = await guilds.get(interaction.guild_id)
+        if tournament_id is None:
+            latest = await g.db.list_tournaments(limit=1)
+            tournament_id = latest[0]['id'] if latest else 0
+        t = await g.db.get_tournament(tournament_id)
+        if t is None:
+            dispatcher.followup(interaction, '토너먼트가 없습니다. /토너먼트생성 으로 만드세요.')
+            return
+        dispatcher.followup(interaction, embed=tournament_embed(t, await g.db.get_teams(t['team_ids'])))
+
+    @bot.tree.command(name='토너먼트결과', description='토너먼트 경기 결과 기록 (관리자 전용): 팀 멤버의 MMR도 함께 반영')
+    @app_commands.guild_only()
+    @app_commands.describe(game_id='경기 번호 (/토너먼트 에 표시)', winner='승리 팀 (A: 왼쪽, B: 오른쪽)')
+    @app_commands.choices(winner=[app_commands.Choice(name='A', value='A'), app_commands.Choice(name='B', value='B')])
+    async def tournament_result(interaction: discord.Interaction, game_id: int, winner: str):
+        if interaction.guild is None or not isinstance(interaction.user, discord.Member):
+            await interaction.response.send_message('이 명령은 서버 채널에서만 사용할 수 있습니다.', ephemeral=True)
+            return
+        user_perms = interaction.user.guild_permissions
+        if not (user_perms.administrator or user_perms.manage_guild):
+            await interaction.response.send_message('관리자 또는 서버 관리 권한이 있어야 사용할 수 있습니다.', ephemeral=True)
+            return
+        await interaction.response.defer()
+        g = await guilds.get(interaction.guild_id)
+        try:
+            # the next round (or the champion) is written with the result
+            t, match_id = await tournament.record_result(g.db, game_id, winner)
+        except KeyError:
+            dispatcher.followup(interaction, f'{game_id}번 경기를 찾을 수 없습니다.')
+            return
+        except ValueError as e:
+            dispatcher.followup(interaction, f'기록 실패: {e}')
+            return
+        dispatcher.followup(interaction, f'기록 완료 (#{match_id})', embed=tournament_embed(t, await g.db.get_teams(t['team_ids'])))
+
+    @bot.tree.command(name='예측', description='토너먼트 우승 확률 예측 (팀 레이팅 기반 몬테카를로 시뮬레이션)')
+    @app_commands.describe(tournament_id='토너먼트 번호 (기본: 가장 최근)')
+    async def predict(interaction: discord.Interaction, tournament_id: Optional[int] = None):
+        await interaction.response.defer()
+        g = await guilds.get(interaction.guild_id)
+        if tournament_id is None:
+            latest = await g.db.list_tournaments(limit=1)
+            tournament_id = latest[0]['id'] if latest else 0
+        t = await g.db.get_tournament(tournament_id)
+        if t is None:
+            dispatcher.followup(interaction, '토너먼트가 없습니다. /토너먼트생성 으로 만드세요.')
+            return
+        # simulated in worker processes; reused until a rating (or a result) changes
+        teams, odds = await tournament.predict(g.db, t, g.leaderboard.version)
+        ranked = sorted(zip(teams, odds), key=lambda x: -x[1])
+        embed = discord.Embed(title=f"🔮 {t['name']} 우승 확률", color=0x9b59b6)
+        embed.description = '\n'.join(f"{i}. {team['name']} · {p * 100:.1f}% (레이팅 {tournament.team_strength(team)})" for i, (team, p) in enumerate(ranked, start=1))[:4096]
+        embed.set_footer(text=f'{tournament.SIMULATIONS:,}회 시뮬레이션')
+        dispatcher.followup(interaction, embed=embed)
+
+    @bot.tree.command(name='내보내기', description='플레이어/경기 기록 내보내기 (관리자 전용)')
+    @app_commands.guild_only()
+    @app_commands.describe(table='내보낼 데이터', fmt='파일 형식')
+    @app_commands.choices(table=[app_commands.Choice(name=t, value=t) for t in TABLES], fmt=[app_commands.Choice(name=f, value=f) for f in FORMATS])
+    async def export_data(interaction: discord.Interaction, table: str, fmt: str = 'csv'):
+        if interaction.guild is None or not isinstance(interaction.user, discord.Member):
+            await interaction.response.send_message('이 명령은 서버 채널에서만 사용할 수 있습니다.', ephemeral=True)
+            return
+        user_perms = interaction.user.guild_permissions
+        if not (user_perms.administrator or user_perms.manage_guild):
+            await interaction.response.send_message('관리자 또는 서버 관리 권한이 있어야 사용할 수 있습니다.', ephemeral=True)
+            return
+        await interaction.response.defer(ephemeral=True)
+        g = await guilds.get(interaction.guild_id)
+        # streamed to a temp file rather than built in memory
+        tmp = tempfile.TemporaryFile()
+        text = io.TextIOWrapper(tmp, encoding='utf-8', newline='')
+        count = await export_table(g.db, table, text, fmt)
+        text.flush()
+        text.detach()
+        size = tmp.tell()
+        if size > MAX_UPLOAD_BYTES:
+            tmp.close()
+            dispatcher.followup(interaction, f'파일이 너무 큽니다 ({size // 1024}KB). 서버에서 `python transfer.py export {table} ...`를 사용하세요.', ephemeral=True)
+            return
+        tmp.seek(0)
+        dispatcher.followup(interaction, f'{table} {count}행 내보내기 완료', file=discord.File(tmp, filename=f'{table}.{fmt}'), ephemeral=True)
+
+    @bot.tree.command(name='가져오기', description='CSV/JSONL 파일에서 플레이어/경기 기록 가져오기 (관리자 전용)')
+    @app_commands.guild_only()
+    @app_commands.describe(table='가져올 데이터', file='CSV 또는 JSONL 파일', recompute='경기 가져오기 후 레이팅 재계산')
+    @app_commands.choices(table=[app_commands.Choice(name=t, value=t) for t in TABLES])
+    async def import_data(interaction: discord.Interaction, table: str, file: discord.Attachment, recompute: bool = False):
+        if interaction.guild is None or not isinstance(interaction.user, discord.Member):
+            await interaction.response.send_message('이 명령은 서버 채널에서만 사용할 수 있습니다.', ephemeral=True)
+            return
+        user_perms = interaction.user.guild_permissions
+        if not (user_perms.administrator or user_perms.manage_guild):
+            await interaction.response.send_message('관리자 또는 서버 관리 권한이 있어야 사용할 수 있습니다.', ephemeral=True)
+            return
+        await interaction.response.defer()
+        g = await guilds.get(interaction.guild_id)
+        fmt = detect_format(file.filename)
+        text = io.TextIOWrapper(io.BytesIO(await file.read()), encoding='utf-8-sig', newline='')
+        try:
+            count = await import_table(g.db, table, text, fmt, recompute=recompute)
+        except (ValueError, UnicodeDecodeError) as e:
+            dispatcher.followup(interaction, f'가져오기 실패 (변경 없음): {e}')
+            return
+        done = ' · 레이팅 재계산 완료' if recompute and table == 'matches' else ''
+        dispatcher.followup(interaction, f'{table} {count}행 가져오기 완료{done}')
 
     @bot.tree.command(name='디버그', description='봇 상태 진단 (관리자 전용)')
     @app_commands.guild_only()
@@ -175,51 +703,52 @@ def setup_commands(bot: commands.Bot):
         except Exception as e:
             lines.append(f'Bot perms: could not fetch ({e})')
 
-        # DB summary
+        # DB summary (read through the async pool, honouring DB.path)
         try:
-            import sqlite3
-            conn = sqlite3.connect('mmr_bot.db')
-            cur = conn.cursor()
-            for t in ('players','teams','matches'):
-                try:
-                    cur.execute(f'SELECT COUNT(*) FROM {t}')
-                    cnt = cur.fetchone()[0]
-                    lines.append(f'{t}: {cnt} rows')
-                except Exception:
-                    lines.append(f'{t}: (table missing)')
-            conn.close()
+            g = await guilds.get(interaction.guild_id)
+            lines.append(f'DB: {g.db.path} (per-guild={guilds.per_guild})')
+            counts = await g.db.table_counts()
+            for t, cnt in counts.items():
+                lines.append(f'{t}: {cnt} rows' if cnt is not None else f'{t}: (table missing)')
+            lines.append(f'Player cache: {len(g.players)}/{g.players.capacity} (hits={g.players.hits}, misses={g.players.misses})')
         except Exception as e:
             lines.append(f'DB check failed: {e}')
 
+        # Latency / error metrics collected in-process
+        lag = metrics.gauges.get('event_loop_lag_seconds')
+        gateway = metrics.gauges.get('gateway_latency_seconds')
+        if lag is not None:
+            lines.append(f'Event loop lag: {lag*1000:.1f}ms')
+        if gateway is not None:
+            lines.append(f'Gateway latency: {gateway*1000:.1f}ms')
+        for kind, title in (('command', 'Commands'), ('db', 'DB'), ('discord_http', 'Discord API')):
+            summary = metrics.summary_lines(kind, limit=5)
+            if summary:
+                lines.append(f'-- {title} (slowest p95) --')
+                lines.extend(summary)
+
         # Send result
-        await interaction.followup.send('\n'.join(lines), ephemeral=True)
+        # Discord rejects messages over 2000 characters
+        dispatcher.followup(interaction, '\n'.join(lines)[:2000], ephemeral=True)
 
     async def register_team(ctx_or_interaction, team_name: str, member_ids: List[str]):
         # fallback for prefix command
         if isinstance(ctx_or_interaction, commands.Context):
             ctx = ctx_or_interaction
-            await db.ensure()
-            await db.register_team(team_name, member_ids, 0)
-            await ctx.send(f'팀 **{team_name}** 등록 완료. 멤버 수: {len(member_ids)}')
+            g = await guilds.get(ctx.guild.id if ctx.guild else None)
+            await g.db.register_team(team_name, member_ids, 0)
+            dispatcher.send(ctx.channel, f'팀 **{team_name}** 등록 완료. 멤버 수: {len(member_ids)}')
 
     @bot.command(name='기록')
     async def record_prefix(ctx: commands.Context, team_a: str, team_b: str, winner: str):
         # usage: !기록 "id1 id2" "id3 id4" A
-        a_ids = [x.strip() for x in team_a.split()]
-        b_ids = [x.strip() for x in team_b.split()]
-        # validation (same rules as slash)
-        if winner not in ('A', 'B'):
-            await ctx.send('승자에는 A 또는 B만 입력하세요.')
-            return
-        if not a_ids or not b_ids:
-            await ctx.send('양 팀 모두 최소 1명 이상이어야 합니다.')
-            return
-        if len(a_ids) > 6 or len(b_ids) > 6:
-            await ctx.send('각 팀은 최대 6명까지 허용됩니다.')
-            return
-        if set(a_ids) & set(b_ids):
-            await ctx.send('같은 유저가 양 팀에 중복으로 포함될 수 없습니다.')
+        a_ids = parse_member_input(team_a)
+        b_ids = parse_member_input(team_b)
+        # same rules as slash
+        error = validate_match_teams(a_ids, b_ids, winner)
+        if error:
+            dispatcher.send(ctx.channel, error)
             return
-        await db.ensure()
-        await db.record_match(a_ids, b_ids, winner, use_regular=False)
-        await ctx.send(f'기록 완료: {len(a_ids)} vs {len(b_ids)} 승자: {winner}')
+        g = await guilds.get(ctx.guild.id if ctx.guild else None)
+        match_id = await g.db.record_match(a_ids, b_ids, winner)
+        dispatcher.summary(ctx.channel, 'record', f'#{match_id}: {len(a_ids)} vs {len(b_ids)} 승자: {winner}', RECORD_SUMMARY_TITLE)
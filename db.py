@@ -1,9 +1,46 @@
 import aiosqlite
 import asyncio
-from typing import List, Optional
+import itertools
+import json
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from rating import DEFAULT_MMR, get_formula, get_team_aggregation, apply_adjustments, replay, replay_database, parse_match_rows, RatingState, ReplayLog, REPLAY_BATCH_SIZE, CHECKPOINT_INTERVAL
 
 DB_PATH = 'mmr_bot.db'
 
+# Formula used by record_match for new results; see rating.FORMULAS
+DEFAULT_RATING_FORMULA = 'flat'
+
+# Number of read-only connections kept open in pooled mode (see DB.connect)
+READER_POOL_SIZE = 2
+
+# Applied to every pooled connection. WAL lets readers run while the writer
+# commits; synchronous=NORMAL is durable in WAL mode and skips an fsync per commit.
+CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA foreign_keys = ON',
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA mmap_size = 268435456',
+)
+
+# Group commit: when several writes are already queued, the writer task waits
+# up to this long for more to arrive, then commits them all in one transaction.
+GROUP_COMMIT_WINDOW = 0.005
+GROUP_COMMIT_MAX = 256
+
+# sqlite3 keeps a per-connection cache of compiled statements; long-lived
+# connections reuse them across calls instead of re-preparing every query.
+STATEMENT_CACHE_SIZE = 256
+
 CREATE_PLAYERS = '''
 CREATE TABLE IF NOT EXISTS players (
     discord_id TEXT PRIMARY KEY,
@@ -35,10 +72,221 @@ CREATE TABLE IF NOT EXISTS matches (
 );
 '''
 
-async def init_db(path: str = DB_PATH):
-    db = await aiosqlite.connect(path)
-    await db.executescript('\n'.join([CREATE_PLAYERS, CREATE_TEAMS, CREATE_MATCHES]))
-    # Ensure wins/losses columns exist (for simple +/-25 system)
+# One row per player per match. mmr_before/mmr_after are NULL for rows
+# backfilled from matches recorded before this table existed.
+CREATE_MATCH_PARTICIPANTS = '''
+CREATE TABLE IF NOT EXISTS match_participants (
+    match_id INTEGER NOT NULL REFERENCES matches(id) ON DELETE CASCADE,
+    discord_id TEXT NOT NULL,
+    side TEXT NOT NULL,
+    mmr_before INTEGER,
+    mmr_after INTEGER,
+    PRIMARY KEY (match_id, discord_id)
+) WITHOUT ROWID;
+'''
+
+# covering index for per-player history: no lookups into the base table
+CREATE_MATCH_PARTICIPANTS_INDEX = 'CREATE INDEX IF NOT EXISTS idx_match_participants_player ON match_participants(discord_id, match_id, side, mmr_before, mmr_after)'
+
+BACKFILL_BATCH_SIZE = 5000
+
+# Rows per executemany in bulk imports and per fetchmany in exports
+IMPORT_BATCH_SIZE = 5000
+EXPORT_BATCH_SIZE = 5000
+# Secondary indexes a bulk import drops and rebuilds once at the end instead of updating per row
+BULK_DEFERRED_INDEXES = ('idx_players_mmr_general', 'idx_players_mmr_regular', 'idx_matches_ts', 'idx_match_participants_player')
+
+# Snapshot of every player's mmr_general state right after match_id (see rating.RatingState.to_blob).
+# Base checkpoints (the ``base`` column, added later) are states that can't be
+# derived from the matches before them: the last pre-upgrade match and
+# player imports. Replays start at or after the latest one.
+CREATE_RATING_CHECKPOINTS = '''
+CREATE TABLE IF NOT EXISTS rating_checkpoints (
+    match_id INTEGER PRIMARY KEY,
+    state BLOB NOT NULL
+);
+'''
+
+# Ratings set by hand (upsert_player/set_player_mmr) after match after_match_id.
+# Replays apply them before the next match, so corrections don't undo a re-seed.
+CREATE_RATING_ADJUSTMENTS = (
+    '''
+    CREATE TABLE IF NOT EXISTS rating_adjustments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        after_match_id INTEGER NOT NULL,
+        discord_id TEXT NOT NULL,
+        mmr INTEGER NOT NULL
+    );
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_rating_adjustments_match ON rating_adjustments(after_match_id)',
+)
+
+# Bucket key per mmr_series() resolution (matches.ts is UTC 'YYYY-MM-DD HH:MM:SS'); weeks start on Monday
+SERIES_RESOLUTIONS = {
+    'hour': "strftime('%Y-%m-%d %H:00:00', m.ts)",
+    'day': 'date(m.ts)',
+    'week': "date(m.ts, '-6 days', 'weekday 1')",
+}
+
+# Finished seasons. Ending a season moves its matches (and their
+# participants) into the season_* tables and snapshots every player who
+# played, so the live tables and rating replays only cover the current season.
+CREATE_SEASONS = (
+    '''
+    CREATE TABLE IF NOT EXISTS seasons (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT,
+        ended_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        matches INTEGER,
+        players INTEGER
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS season_players (
+        season_id INTEGER NOT NULL REFERENCES seasons(id),
+        discord_id TEXT NOT NULL,
+        name TEXT,
+        mmr_regular INTEGER,
+        mmr_general INTEGER,
+        games_played INTEGER,
+        max_mmr INTEGER,
+        wins INTEGER,
+        losses INTEGER,
+        PRIMARY KEY (season_id, discord_id)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS season_matches (
+        season_id INTEGER NOT NULL REFERENCES seasons(id),
+        id INTEGER NOT NULL,
+        team_a TEXT,
+        team_b TEXT,
+        winner TEXT,
+        mmr_delta INTEGER,
+        ts DATETIME,
+        PRIMARY KEY (season_id, id)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS season_match_participants (
+        season_id INTEGER NOT NULL REFERENCES seasons(id),
+        match_id INTEGER NOT NULL,
+        discord_id TEXT NOT NULL,
+        side TEXT NOT NULL,
+        mmr_before INTEGER,
+        mmr_after INTEGER,
+        PRIMARY KEY (season_id, match_id, discord_id)
+    ) WITHOUT ROWID
+    ''',
+)
+
+# Pending deliveries to lol-balancer-api (see outbox.py). Rows are written
+# in the same transaction as the match and deleted once the API accepts them;
+# idempotency_key stays fixed across retries so the API stores each match once.
+CREATE_OUTBOX = (
+    '''
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        idempotency_key TEXT NOT NULL UNIQUE,
+        payload TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL DEFAULT 0,
+        last_error TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(next_attempt_at, id)',
+)
+
+# Outbox entries the API rejected for good (see outbox.py), kept for inspection instead of retried
+CREATE_OUTBOX_FAILED = '''
+CREATE TABLE IF NOT EXISTS outbox_failed (
+    id INTEGER PRIMARY KEY,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    last_error TEXT,
+    created_at DATETIME,
+    failed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+'''
+
+# Team ratings are materialised in teams.rating (the members' mmr_general
+# combined by a rating.TEAM_AGGREGATIONS entry) and refreshed by every write
+# that moves a rating. team_members is the player -> teams index that finds
+# the teams to refresh; teams.member_ids keeps the registration order.
+DEFAULT_TEAM_AGGREGATION = 'mean'
+
+CREATE_TEAM_RATINGS = (
+    '''
+    CREATE TABLE IF NOT EXISTS team_members (
+        discord_id TEXT NOT NULL,
+        team_id INTEGER NOT NULL REFERENCES teams(id) ON DELETE CASCADE,
+        PRIMARY KEY (discord_id, team_id)
+    ) WITHOUT ROWID
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_team_members_team ON team_members(team_id)',
+    'CREATE INDEX IF NOT EXISTS idx_teams_rating ON teams(rating DESC)',
+)
+
+# Tournaments between registered teams (see tournament.py). Games are created
+# a round at a time; team_b is NULL for a bye. A decided game points at the
+# match it was recorded as, so ratings move exactly as for /기록.
+CREATE_TOURNAMENTS = (
+    '''
+    CREATE TABLE IF NOT EXISTS tournaments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        format TEXT NOT NULL,
+        rounds INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'running',
+        champion_team_id INTEGER REFERENCES teams(id),
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS tournament_teams (
+        tournament_id INTEGER NOT NULL REFERENCES tournaments(id) ON DELETE CASCADE,
+        seed INTEGER NOT NULL,
+        team_id INTEGER NOT NULL REFERENCES teams(id),
+        PRIMARY KEY (tournament_id, seed)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS tournament_games (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tournament_id INTEGER NOT NULL REFERENCES tournaments(id) ON DELETE CASCADE,
+        round INTEGER NOT NULL,
+        slot INTEGER NOT NULL,
+        team_a INTEGER NOT NULL REFERENCES teams(id),
+        team_b INTEGER REFERENCES teams(id),
+        winner TEXT,
+        match_id INTEGER REFERENCES matches(id) ON DELETE SET NULL,
+        UNIQUE (tournament_id, round, slot)
+    )
+    ''',
+)
+
+# Soft reset at season end: ratings keep this share of their distance from DEFAULT_MMR
+SEASON_CARRYOVER = 0.5
+
+PLAYER_COLUMNS = ('discord_id', 'name', 'mmr_regular', 'mmr_general', 'games_played', 'max_mmr', 'wins', 'losses')
+PLAYER_SELECT = ', '.join(PLAYER_COLUMNS)
+
+CREATE_INDEXES = (
+    'CREATE INDEX IF NOT EXISTS idx_players_mmr_general ON players(mmr_general DESC)',
+    'CREATE INDEX IF NOT EXISTS idx_players_mmr_regular ON players(mmr_regular DESC)',
+    'CREATE INDEX IF NOT EXISTS idx_matches_ts ON matches(ts)',
+)
+
+# Schema migrations, applied in order. Migration N brings the schema to
+# user_version N; each runs once per database file, in its own transaction.
+async def _migrate_base_tables(db: aiosqlite.Connection):
+    for stmt in (CREATE_PLAYERS, CREATE_TEAMS, CREATE_MATCHES):
+        await db.execute(stmt)
+
+async def _migrate_wins_losses(db: aiosqlite.Connection):
+    # Databases created before versioning may already have these columns
     cur = await db.execute("PRAGMA table_info(players)")
     cols = await cur.fetchall()
     col_names = [c[1] for c in cols]
@@ -46,144 +294,1185 @@ async def init_db(path: str = DB_PATH):
         await db.execute('ALTER TABLE players ADD COLUMN wins INTEGER DEFAULT 0')
     if 'losses' not in col_names:
         await db.execute('ALTER TABLE players ADD COLUMN losses INTEGER DEFAULT 0')
-    await db.commit()
-    await db.close()
+
+async def _migrate_indexes(db: aiosqlite.Connection):
+    for stmt in CREATE_INDEXES:
+        await db.execute(stmt)
+
+async def _migrate_match_participants(db: aiosqlite.Connection):
+    await db.execute(CREATE_MATCH_PARTICIPANTS)
+    # Backfill from the comma-joined team columns in id-ordered batches so
+    # memory stays flat however many matches exist. The index is built
+    # afterwards, which is cheaper than maintaining it row by row.
+    last_id = 0
+    while True:
+        cur = await db.execute('SELECT id, team_a, team_b FROM matches WHERE id > ? ORDER BY id LIMIT ?', (last_id, BACKFILL_BATCH_SIZE))
+        rows = await cur.fetchall()
+        if not rows:
+            break
+        batch = []
+        for match_id, team_a, team_b in rows:
+            for side, members in (('A', team_a), ('B', team_b)):
+                batch.extend((match_id, pid, side) for pid in (members.split(',') if members else []))
+        await db.executemany('INSERT OR IGNORE INTO match_participants(match_id, discord_id, side) VALUES(?,?,?)', batch)
+        last_id = rows[-1][0]
+    await db.execute(CREATE_MATCH_PARTICIPANTS_INDEX)
+
+async def _migrate_rating_checkpoints(db: aiosqlite.Connection):
+    await db.execute(CREATE_RATING_CHECKPOINTS)
+
+async def _migrate_seasons(db: aiosqlite.Connection):
+    for stmt in CREATE_SEASONS:
+        await db.execute(stmt)
+
+async def _migrate_outbox(db: aiosqlite.Connection):
+    for stmt in CREATE_OUTBOX:
+        await db.execute(stmt)
+
+async def _migrate_team_ratings(db: aiosqlite.Connection):
+    cur = await db.execute('PRAGMA table_info(teams)')
+    if 'rating' not in [c[1] for c in await cur.fetchall()]:
+        await db.execute('ALTER TABLE teams ADD COLUMN rating INTEGER')
+    for stmt in CREATE_TEAM_RATINGS:
+        await db.execute(stmt)
+    cur = await db.execute('SELECT id, member_ids FROM teams')
+    rows = [(pid, team_id) for team_id, members in await cur.fetchall() for pid in (members.split(',') if members else [])]
+    await db.executemany('INSERT OR IGNORE INTO team_members(discord_id, team_id) VALUES(?,?)', rows)
+    await _refresh_team_ratings(db, get_team_aggregation(DEFAULT_TEAM_AGGREGATION))
+
+async def _migrate_tournaments(db: aiosqlite.Connection):
+    for stmt in CREATE_TOURNAMENTS:
+        await db.execute(stmt)
+
+async def _migrate_rating_base(db: aiosqlite.Connection):
+    cur = await db.execute('PRAGMA table_info(rating_checkpoints)')
+    if 'base' not in [c[1] for c in await cur.fetchall()]:
+        await db.execute('ALTER TABLE rating_checkpoints ADD COLUMN base INTEGER NOT NULL DEFAULT 0')
+    # Matches backfilled into match_participants have no mmr_before, so they
+    # can't be replayed. Store the state right after the last of them as a
+    # base checkpoint instead: the current players, minus the matches
+    # recorded since the upgrade, whose mmr_before is exactly that state.
+    cur = await db.execute('SELECT MAX(match_id) FROM match_participants WHERE mmr_before IS NULL')
+    legacy_id = (await cur.fetchone())[0]
+    if legacy_id is None:
+        return
+    cur = await db.execute('SELECT discord_id, mmr_general, games_played, COALESCE(wins, 0), COALESCE(losses, 0), max_mmr FROM players')
+    players = {r[0]: list(r[1:]) for r in await cur.fetchall()}
+    cur = await db.execute('SELECT p.discord_id, p.mmr_before, p.mmr_after, p.side = m.winner FROM match_participants p JOIN matches m ON m.id = p.match_id '
+                           'WHERE p.match_id > ? ORDER BY p.match_id', (legacy_id,))
+    peak: Dict[str, int] = {}
+    for pid, before, after, won in await cur.fetchall():
+        p = players.get(pid)
+        if p is None:
+            continue
+        if pid not in peak:
+            p[0] = peak[pid] = before
+        p[1] -= 1
+        p[2 if won else 3] -= 1
+        peak[pid] = max(peak[pid], after)
+    for pid, top in peak.items():
+        p = players[pid]
+        if top >= p[4]:
+            # the peak came after the upgrade; the one before it isn't known
+            p[4] = p[0]
+    state = RatingState.from_rows((pid, *p) for pid, p in players.items())
+    await db.execute('DELETE FROM rating_checkpoints WHERE match_id < ?', (legacy_id,))
+    await db.execute('INSERT OR REPLACE INTO rating_checkpoints(match_id, state, base) VALUES(?,?,1)', (legacy_id, state.to_blob()))
+
+async def _migrate_rating_adjustments(db: aiosqlite.Connection):
+    for stmt in CREATE_RATING_ADJUSTMENTS:
+        await db.execute(stmt)
+
+async def _migrate_outbox_failed(db: aiosqlite.Connection):
+    await db.execute(CREATE_OUTBOX_FAILED)
+
+MIGRATIONS = [
+    _migrate_base_tables,
+    _migrate_wins_losses,
+    _migrate_indexes,
+    _migrate_match_participants,
+    _migrate_rating_checkpoints,
+    _migrate_seasons,
+    _migrate_outbox,
+    _migrate_team_ratings,
+    _migrate_tournaments,
+    _migrate_rating_base,
+    _migrate_rating_adjustments,
+    _migrate_outbox_failed,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+async def migrate(db: aiosqlite.Connection) -> int:
+    """Apply pending migrations on ``db`` and return the resulting schema version."""
+    cur = await db.execute('PRAGMA user_version')
+    version = (await cur.fetchone())[0]
+    for target, step in enumerate(MIGRATIONS[version:], start=version + 1):
+        try:
+            # explicit BEGIN: sqlite3 would otherwise autocommit each DDL statement
+            await db.execute('BEGIN')
+            await step(db)
+            # PRAGMA does not accept bound parameters
+            await db.execute(f'PRAGMA user_version = {target}')
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
+        version = target
+    return version
+
+async def init_db(path: str = DB_PATH):
+    db = await aiosqlite.connect(path)
+    try:
+        await migrate(db)
+    finally:
+        await db.close()
+
+async def open_connection(path: str = DB_PATH, readonly: bool = False) -> aiosqlite.Connection:
+    """Open a long-lived connection with the pool pragmas applied."""
+    conn = await aiosqlite.connect(path, cached_statements=STATEMENT_CACHE_SIZE)
+    for pragma in CONNECTION_PRAGMAS:
+        await conn.execute(pragma)
+    if readonly:
+        await conn.execute('PRAGMA query_only = ON')
+    return conn
+
+async def _pending_adjustments(db: aiosqlite.Connection, after_id: int) -> Deque[Tuple[int, str, int]]:
+    """aiosqlite counterpart of rating.load_adjustments."""
+    cur = await db.execute('SELECT after_match_id, discord_id, mmr FROM rating_adjustments WHERE after_match_id >= ? ORDER BY after_match_id, id', (after_id,))
+    return deque(await cur.fetchall())
+
+async def _base_state(db: aiosqlite.Connection) -> Tuple[RatingState, int]:
+    """Where a full replay starts: (state, match id) of the latest base checkpoint, or empty."""
+    cur = await db.execute('SELECT discord_id, mmr_before, MIN(match_id) FROM match_participants GROUP BY discord_id')
+    seeds = {pid: before for pid, before, _ in await cur.fetchall() if before is not None}
+    cur = await db.execute('SELECT match_id, state FROM rating_checkpoints WHERE base = 1 ORDER BY match_id DESC LIMIT 1')
+    base = await cur.fetchone()
+    return (RatingState.from_blob(base[1], seeds), base[0]) if base else (RatingState(seeds), 0)
+
+async def _record_adjustment(db: aiosqlite.Connection, discord_id: str, mmr: int):
+    await db.execute('INSERT INTO rating_adjustments(after_match_id, discord_id, mmr) VALUES((SELECT COALESCE(MAX(id), 0) FROM matches),?,?)', (discord_id, mmr))
+
+def _chunks(rows: Iterable, size: int):
+    it = iter(rows)
+    while True:
+        batch = list(itertools.islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+async def _refresh_team_ratings(db: aiosqlite.Connection, aggregate: Callable, player_ids: Optional[List[str]] = None) -> int:
+    """Recompute teams.rating for every team with a member in ``player_ids`` (all teams if None).
+
+    Runs in the caller's transaction; returns the number of teams updated.
+    """
+    sql = 'SELECT tm.team_id, COALESCE(p.mmr_general, ?) FROM team_members tm LEFT JOIN players p ON p.discord_id = tm.discord_id'
+    params = [DEFAULT_MMR]
+    if player_ids is not None:
+        if not player_ids:
+            return 0
+        sql += f' WHERE tm.team_id IN (SELECT team_id FROM team_members WHERE discord_id IN ({",".join("?" for _ in player_ids)}))'
+        params.extend(player_ids)
+    cur = await db.execute(sql, params)
+    members: Dict[int, List[int]] = {}
+    for team_id, mmr in await cur.fetchall():
+        members.setdefault(team_id, []).append(mmr)
+    await db.executemany('UPDATE teams SET rating = ? WHERE id = ?', [(round(aggregate(mmrs)), team_id) for team_id, mmrs in members.items()])
+    return len(members)
 
 class DB:
-    def __init__(self, path: str = DB_PATH):
+    """SQLite access layer.
+
+    Call ``connect()`` once at startup to switch to pooled mode: one writer
+    connection plus ``readers`` read-only connections. In pooled mode the
+    player/team/match writes are queued to a single writer task that
+    group-commits them (see ``_writer_loop``); other writes take the writer
+    lock directly. Without ``connect()`` every method falls back to opening a
+    short-lived connection.
+    """
+
+    def __init__(self, path: str = DB_PATH, readers: int = READER_POOL_SIZE):
         self.path = path
+        # an in-memory database is private to its connection, so it can't have readers
+        self.readers = 0 if path == ':memory:' else readers
+        self.db: Optional[aiosqlite.Connection] = None
+        self._reader_conns: List[aiosqlite.Connection] = []
+        self._reader_pool: Optional[asyncio.Queue] = None
+        self._write_lock = asyncio.Lock()
+        self._schema_ready = False
+        self._listeners: List[Callable[[List[dict]], None]] = []
+        self._write_queue: Optional[asyncio.Queue] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        # bumped whenever recorded history changes in place (corrections, imports, season end)
+        self._history_rewrites = 0
+        # when set, record_match also queues the match in the outbox table
+        self.outbox_enabled = False
+        self.set_rating_formula(DEFAULT_RATING_FORMULA)
+        self.team_aggregate = get_team_aggregation(DEFAULT_TEAM_AGGREGATION)
+        self.team_aggregation_name = DEFAULT_TEAM_AGGREGATION
+
+    @property
+    def pooled(self) -> bool:
+        return self.db is not None
 
     async def connect(self):
-        self.db = await aiosqlite.connect(self.path)
-        await self.db.execute('PRAGMA foreign_keys = ON')
+        if self.db is not None:
+            return
+        self.db = await open_connection(self.path)
+        self._reader_pool = asyncio.Queue()
+        for _ in range(self.readers):
+            conn = await open_connection(self.path, readonly=True)
+            self._reader_conns.append(conn)
+            self._reader_pool.put_nowait(conn)
+        self._write_queue = asyncio.Queue()
+        self._writer_task = asyncio.create_task(self._writer_loop())
 
     async def close(self):
-        await self.db.close()
+        if self.db is None:
+            return
+        if self._writer_task is not None:
+            # let queued writes finish, then stop the writer
+            self._write_queue.put_nowait(None)
+            await self._writer_task
+            self._writer_task = None
+            self._write_queue = None
+        for conn in self._reader_conns:
+            await conn.close()
+        self._reader_conns = []
+        self._reader_pool = None
+        db, self.db = self.db, None
+        await db.close()
+
+    @asynccontextmanager
+    async def _read(self):
+        """Yield a connection for SELECTs: a pooled reader, the writer, or a fresh one."""
+        if self.db is None:
+            async with aiosqlite.connect(self.path) as db:
+                yield db
+        elif self._reader_conns:
+            conn = await self._reader_pool.get()
+            try:
+                yield conn
+            finally:
+                self._reader_pool.put_nowait(conn)
+        else:
+            async with self._write_lock:
+                yield self.db
+
+    @asynccontextmanager
+    async def _write(self):
+        """Yield a connection for writes and commit on exit (rollback on error)."""
+        if self.db is None:
+            async with aiosqlite.connect(self.path) as db:
+                yield db
+                await db.commit()
+            return
+        async with self._write_lock:
+            try:
+                yield self.db
+            except BaseException:
+                await self.db.rollback()
+                raise
+            await self.db.commit()
+
+    async def _submit(self, op):
+        """Run ``op(db) -> (result, changed_rows)`` in a write transaction and return ``result``.
+
+        In pooled mode the op is queued to the writer task and may share its
+        commit with other ops; the future resolves once that commit is durable.
+        """
+        if self._writer_task is None:
+            async with self._write() as db:
+                result, changed = await op(db)
+            self._notify(changed)
+            return result
+        fut = asyncio.get_running_loop().create_future()
+        self._write_queue.put_nowait((op, fut))
+        return await fut
+
+    async def _writer_loop(self, window: float = GROUP_COMMIT_WINDOW, max_batch: int = GROUP_COMMIT_MAX):
+        """Single writer: drain queued ops and group-commit each batch.
+
+        Every op runs inside its own SAVEPOINT so one failing command is
+        rolled back and reported to its caller without aborting the others.
+        """
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._write_queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + window
+            while len(batch) < max_batch:
+                try:
+                    item = self._write_queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    # a lone write commits immediately; only wait for more under load
+                    if len(batch) == 1 or timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._write_queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            outcomes = []
+            changed = {}
+            async with self._write_lock:
+                try:
+                    await self.db.execute('BEGIN')
+                    for op, fut in batch:
+                        await self.db.execute('SAVEPOINT write_op')
+                        try:
+                            result, rows = await op(self.db)
+                        except Exception as e:
+                            await self.db.execute('ROLLBACK TO write_op')
+                            await self.db.execute('RELEASE write_op')
+                            outcomes.append((fut, None, e))
+                            continue
+                        await self.db.execute('RELEASE write_op')
+                        changed.update((r['discord_id'], r) for r in rows)
+                        outcomes.append((fut, result, None))
+                    await self.db.commit()
+                except Exception as e:
+                    logging.exception('group commit failed')
+                    await self.db.rollback()
+                    outcomes = [(fut, None, e) for _, fut in batch]
+                    changed = {}
+            self._notify(list(changed.values()))
+            for fut, result, error in outcomes:
+                if fut.done():
+                    continue
+                if error is not None:
+                    fut.set_exception(error)
+                else:
+                    fut.set_result(result)
+
+    def subscribe(self, callback: Callable[[List[dict]], None]):
+        """Register ``callback(rows)`` to receive full player rows after every committed change."""
+        self._listeners.append(callback)
+
+    def _notify(self, rows: List[dict]):
+        for callback in self._listeners:
+            try:
+                callback(rows)
+            except Exception:
+                logging.exception('player change listener failed')
+
+    async def _fetch_players(self, db: aiosqlite.Connection, discord_ids: List[str]) -> List[dict]:
+        qmarks = ','.join('?' for _ in discord_ids)
+        cur = await db.execute(f'SELECT {PLAYER_SELECT} FROM players WHERE discord_id IN ({qmarks})', tuple(discord_ids))
+        return [dict(zip(PLAYER_COLUMNS, r)) for r in await cur.fetchall()]
 
     async def ensure(self):
-        await init_db(self.path)
+        """Bring the schema up to date. Only the first call per process does any work."""
+        if self._schema_ready:
+            return
+        if self.db is None:
+            await init_db(self.path)
+        else:
+            async with self._write_lock:
+                await migrate(self.db)
+        self._schema_ready = True
 
     async def get_player(self, discord_id: str) -> Optional[dict]:
-        async with aiosqlite.connect(self.path) as db:
-            cur = await db.execute('SELECT discord_id, name, mmr_regular, mmr_general, games_played, max_mmr, wins, losses FROM players WHERE discord_id = ?', (discord_id,))
+        async with self._read() as db:
+            cur = await db.execute(f'SELECT {PLAYER_SELECT} FROM players WHERE discord_id = ?', (discord_id,))
             row = await cur.fetchone()
             if not row:
                 return None
-            keys = ['discord_id', 'name', 'mmr_regular', 'mmr_general', 'games_played', 'max_mmr', 'wins', 'losses']
-            return dict(zip(keys, row))
+            return dict(zip(PLAYER_COLUMNS, row))
+
+    async def get_players(self, discord_ids: List[str]) -> Dict[str, dict]:
+        """Player rows for ``discord_ids`` in one ``IN (...)`` query; unknown ids are left out."""
+        if not discord_ids:
+            return {}
+        async with self._read() as db:
+            return {p['discord_id']: p for p in await self._fetch_players(db, discord_ids)}
+
+    async def recent_results(self, discord_ids: List[str], limit: int = 5) -> Dict[str, str]:
+        """Last ``limit`` results per player as a 'W'/'L' string, newest first, in one query."""
+        if not discord_ids:
+            return {}
+        qmarks = ','.join('?' for _ in discord_ids)
+        async with self._read() as db:
+            cur = await db.execute(
+                'SELECT discord_id, won FROM ('
+                ' SELECT mp.discord_id, mp.side = m.winner AS won,'
+                ' ROW_NUMBER() OVER (PARTITION BY mp.discord_id ORDER BY mp.match_id DESC) AS n'
+                f' FROM match_participants mp JOIN matches m ON m.id = mp.match_id WHERE mp.discord_id IN ({qmarks})'
+                ') WHERE n <= ? ORDER BY discord_id, n',
+                (*discord_ids, limit))
+            rows = await cur.fetchall()
+        form: Dict[str, str] = {}
+        for pid, won in rows:
+            form[pid] = form.get(pid, '') + ('W' if won else 'L')
+        return form
+
+    async def list_players(self) -> List[dict]:
+        """Return every player row (used to warm in-memory views at startup)."""
+        async with self._read() as db:
+            cur = await db.execute(f'SELECT {PLAYER_SELECT} FROM players')
+            return [dict(zip(PLAYER_COLUMNS, r)) for r in await cur.fetchall()]
 
     async def upsert_player(self, discord_id: str, name: str, regular: int = 1200, general: int = 1200, wins: int = 0, losses: int = 0):
-        async with aiosqlite.connect(self.path) as db:
+        async def op(db):
             # Use INSERT OR IGNORE then UPDATE to preserve existing wins/losses/games_played if present
             await db.execute('INSERT OR IGNORE INTO players(discord_id, name, mmr_regular, mmr_general, games_played, max_mmr, wins, losses) VALUES(?,?,?,?,?,?,?,?)', (discord_id, name, regular, general, 0, max(regular, general), wins, losses))
             await db.execute('UPDATE players SET name = ?, mmr_regular = ?, mmr_general = ? WHERE discord_id = ?', (name, regular, general, discord_id))
-            await db.commit()
+            await _record_adjustment(db, discord_id, general)
+            await _refresh_team_ratings(db, self.team_aggregate, [discord_id])
+            return None, await self._fetch_players(db, [discord_id]) if self._listeners else []
+        await self._submit(op)
 
     async def set_player_mmr(self, discord_id: str, regular: Optional[int] = None, general: Optional[int] = None):
-        async with aiosqlite.connect(self.path) as db:
+        async def op(db):
             if regular is not None:
                 await db.execute('UPDATE players SET mmr_regular = ?, games_played = games_played + 1, max_mmr = CASE WHEN ? > max_mmr THEN ? ELSE max_mmr END WHERE discord_id = ?', (regular, regular, regular, discord_id))
             if general is not None:
                 await db.execute('UPDATE players SET mmr_general = ?, games_played = games_played + 1, max_mmr = CASE WHEN ? > max_mmr THEN ? ELSE max_mmr END WHERE discord_id = ?', (general, general, general, discord_id))
-            await db.commit()
+                await _record_adjustment(db, discord_id, general)
+                await _refresh_team_ratings(db, self.team_aggregate, [discord_id])
+            return None, await self._fetch_players(db, [discord_id]) if self._listeners else []
+        await self._submit(op)
 
-    async def register_team(self, name: str, member_ids: List[str], seed_mmr: int = 0):
+    async def set_player_names(self, names: Dict[str, str]) -> int:
+        """Bulk-update ``players.name`` from an id -> name mapping; returns the number of rows changed."""
+        async def op(db):
+            cur = await db.executemany('UPDATE players SET name = ? WHERE discord_id = ? AND name IS NOT ?', [(name, pid, name) for pid, name in names.items()])
+            changed = cur.rowcount
+            return changed, await self._fetch_players(db, list(names)) if changed and self._listeners else []
+        return await self._submit(op)
+
+    async def register_team(self, name: str, member_ids: List[str], seed_mmr: int = 0) -> int:
         members_serial = ','.join(member_ids)
-        async with aiosqlite.connect(self.path) as db:
-            await db.execute('INSERT INTO teams(name, member_ids, seed_mmr) VALUES(?,?,?)', (name, members_serial, seed_mmr))
-            await db.commit()
+        async def op(db):
+            cur = await db.execute('INSERT INTO teams(name, member_ids, seed_mmr) VALUES(?,?,?)', (name, members_serial, seed_mmr))
+            team_id = cur.lastrowid
+            await db.executemany('INSERT OR IGNORE INTO team_members(discord_id, team_id) VALUES(?,?)', [(pid, team_id) for pid in member_ids])
+            await _refresh_team_ratings(db, self.team_aggregate, list(member_ids))
+            return team_id, []
+        return await self._submit(op)
 
     async def list_top_players(self, limit: int = 10, use_regular: bool = False):
         col = 'mmr_regular' if use_regular else 'mmr_general'
-        async with aiosqlite.connect(self.path) as db:
+        async with self._read() as db:
             cur = await db.execute(f'SELECT discord_id, name, {col}, games_played, wins, losses, max_mmr FROM players ORDER BY {col} DESC LIMIT ?', (limit,))
             rows = await cur.fetchall()
             return [{'discord_id': r[0], 'name': r[1], 'mmr': r[2], 'games_played': r[3], 'wins': r[4], 'losses': r[5], 'max_mmr': r[6]} for r in rows]
 
+    async def table_counts(self) -> dict:
+        """Row count per main table (None if the table is missing)."""
+        counts = {}
+        async with self._read() as db:
+            for t in ('players', 'teams', 'matches'):
+                try:
+                    cur = await db.execute(f'SELECT COUNT(*) FROM {t}')
+                    counts[t] = (await cur.fetchone())[0]
+                except aiosqlite.OperationalError:
+                    counts[t] = None
+        return counts
+
     async def get_team(self, team_id: int):
-        async with aiosqlite.connect(self.path) as db:
-            cur = await db.execute('SELECT id, name, member_ids, seed_mmr FROM teams WHERE id = ?', (team_id,))
+        async with self._read() as db:
+            cur = await db.execute('SELECT id, name, member_ids, seed_mmr, rating FROM teams WHERE id = ?', (team_id,))
             row = await cur.fetchone()
             if not row:
                 return None
-            return {'id': row[0], 'name': row[1], 'member_ids': row[2].split(',') if row[2] else [], 'seed_mmr': row[3]}
+            return {'id': row[0], 'name': row[1], 'member_ids': row[2].split(',') if row[2] else [], 'seed_mmr': row[3], 'rating': row[4]}
+
+    async def list_top_teams(self, limit: int = 10, offset: int = 0) -> List[dict]:
+        """Teams by materialised rating (highest first), read straight off idx_teams_rating."""
+        async with self._read() as db:
+            cur = await db.execute('SELECT id, name, member_ids, seed_mmr, rating FROM teams WHERE rating IS NOT NULL ORDER BY rating DESC LIMIT ? OFFSET ?', (limit, offset))
+            rows = await cur.fetchall()
+        return [{'id': r[0], 'name': r[1], 'member_ids': r[2].split(',') if r[2] else [], 'seed_mmr': r[3], 'rating': r[4]} for r in rows]
+
+    async def get_teams(self, team_ids: List[int]) -> Dict[int, dict]:
+        """Teams by id (same shape as get_team) in one query; unknown ids are left out."""
+        if not team_ids:
+            return {}
+        qmarks = ','.join('?' for _ in team_ids)
+        async with self._read() as db:
+            cur = await db.execute(f'SELECT id, name, member_ids, seed_mmr, rating FROM teams WHERE id IN ({qmarks})', tuple(team_ids))
+            rows = await cur.fetchall()
+        return {r[0]: {'id': r[0], 'name': r[1], 'member_ids': r[2].split(',') if r[2] else [], 'seed_mmr': r[3], 'rating': r[4]} for r in rows}
+
+    async def set_team_aggregation(self, name: str) -> int:
+        """Select how member ratings combine into teams.rating (see rating.TEAM_AGGREGATIONS) and recompute every team."""
+        aggregate = get_team_aggregation(name)
+        async def op(db):
+            return await _refresh_team_ratings(db, aggregate), []
+        updated = await self._submit(op)
+        self.team_aggregate = aggregate
+        self.team_aggregation_name = name
+        return updated
 
     async def get_team_members_mmrs(self, member_ids: List[str], use_regular: bool = False) -> List[int]:
         col = 'mmr_regular' if use_regular else 'mmr_general'
         if not member_ids:
             return []
         qmarks = ','.join('?' for _ in member_ids)
-        async with aiosqlite.connect(self.path) as db:
-            # If some players don't exist, auto-create them with default MMR
+        async with self._read() as db:
             cur = await db.execute(f'SELECT discord_id, {col} FROM players WHERE discord_id IN ({qmarks})', tuple(member_ids))
             rows = await cur.fetchall()
-            found = {r[0]: r[1] for r in rows}
-            results = []
-            for pid in member_ids:
-                if pid in found:
-                    results.append(found[pid])
-                else:
-                    # create player with default MMR 1200
-                    await self.upsert_player(pid, pid, regular=1200, general=1200)
-                    results.append(1200)
-            return results
+        found = {r[0]: r[1] for r in rows}
+        # If some players don't exist, auto-create them with default MMR
+        # (outside the read block: the upsert needs the writer connection)
+        results = []
+        for pid in member_ids:
+            if pid in found:
+                results.append(found[pid])
+            else:
+                # create player with default MMR 1200
+                await self.upsert_player(pid, pid, regular=1200, general=1200)
+                results.append(1200)
+        return results
 
-    async def record_match(self, team_a_ids: List[str], team_b_ids: List[str], winner: str, use_regular: bool = False):
+    async def record_match(self, team_a_ids: List[str], team_b_ids: List[str], winner: str) -> int:
         """Record a match using simple +/-25 per player. Winner is 'A' or 'B'.
-        Also updates wins/losses, games_played, max_mmr.
-        """
-        # Ensure players exist and fetch current mmrs
-        a_mmrs = await self.get_team_members_mmrs(team_a_ids, use_regular)
-        b_mmrs = await self.get_team_members_mmrs(team_b_ids, use_regular)
-
-        # simple delta
-        delta_win = 25
-        delta_lose = -25
-
-        async with aiosqlite.connect(self.path) as db:
-            # Update team A
-            for i, pid in enumerate(team_a_ids):
-                # fetch current mmr
-                cur = await db.execute('SELECT mmr_general, wins, losses, max_mmr FROM players WHERE discord_id = ?', (pid,))
-                row = await cur.fetchone()
-                if not row:
-                    # should not happen because get_team_members_mmrs upserts, but guard
-                    mmr = 1200
-                    wins = 0
-                    losses = 0
-                    max_mmr = 1200
-                else:
-                    mmr, wins, losses, max_mmr = row
-                if winner == 'A':
-                    mmr = max(0, mmr + delta_win)
-                    wins = wins + 1
-                else:
-                    mmr = max(0, mmr + delta_lose)
-                    losses = losses + 1
-                max_mmr = max(max_mmr, mmr)
-                await db.execute('UPDATE players SET mmr_general = ?, games_played = games_played + 1, wins = ?, losses = ?, max_mmr = ? WHERE discord_id = ?', (mmr, wins, losses, max_mmr, pid))
-
-            # Update team B
-            for i, pid in enumerate(team_b_ids):
-                cur = await db.execute('SELECT mmr_general, wins, losses, max_mmr FROM players WHERE discord_id = ?', (pid,))
-                row = await cur.fetchone()
-                if not row:
-                    mmr = 1200
-                    wins = 0
-                    losses = 0
-                    max_mmr = 1200
+        Also updates wins/losses, games_played, max_mmr. Returns the new match id.
+
+        Matches always move mmr_general: it is the rating the match history,
+        its replays and checkpoints are kept for.
+        """
+        return await self._submit(lambda db: self._record_match(db, team_a_ids, team_b_ids, winner))
+
+    async def record_matches_bulk(self, matches: Iterable[Tuple[List[str], List[str], str]]) -> List[int]:
+        """Record many (team_a_ids, team_b_ids, winner) results in one transaction, in order."""
+        async def op(db):
+            match_ids = []
+            changed = {}
+            for a_ids, b_ids, winner in matches:
+                match_id, rows = await self._record_match(db, a_ids, b_ids, winner)
+                match_ids.append(match_id)
+                changed.update((r['discord_id'], r) for r in rows)
+            return match_ids, list(changed.values())
+        return await self._submit(op)
+
+    async def _record_match(self, db: aiosqlite.Connection, team_a_ids: List[str], team_b_ids: List[str], winner: str) -> Tuple[int, List[dict]]:
+        """Apply one match inside the caller's transaction; returns (match_id, updated player rows)."""
+        all_ids = list(team_a_ids) + list(team_b_ids)
+        # auto-create unknown players with default MMR 1200, named by their ID
+        await db.executemany('INSERT OR IGNORE INTO players(discord_id, name) VALUES(?,?)', [(pid, pid) for pid in all_ids])
+        current = {p['discord_id']: p for p in await self._fetch_players(db, all_ids)}
+        a_rows = [current[pid] for pid in team_a_ids]
+        b_rows = [current[pid] for pid in team_b_ids]
+        a_deltas, b_deltas = self.rating_formula(
+            [p['mmr_general'] for p in a_rows], [p['mmr_general'] for p in b_rows],
+            [p['games_played'] for p in a_rows], [p['games_played'] for p in b_rows],
+            1.0 if winner == 'A' else 0.0)
+
+        updates = []
+        changed = []
+        participants = []
+        for side, rows, deltas in (('A', a_rows, a_deltas), ('B', b_rows, b_deltas)):
+            for row, delta in zip(rows, deltas):
+                p = dict(row)
+                mmr_before = p['mmr_general']
+                p['mmr_general'] = max(0, mmr_before + delta)
+                if side == winner:
+                    p['wins'] += 1
                 else:
-                    mmr, wins, losses, max_mmr = row
-                if winner == 'B':
-                    mmr = max(0, mmr + delta_win)
-                    wins = wins + 1
+                    p['losses'] += 1
+                p['games_played'] += 1
+                p['max_mmr'] = max(p['max_mmr'], p['mmr_general'])
+                updates.append((p['mmr_general'], p['wins'], p['losses'], p['max_mmr'], p['discord_id']))
+                participants.append((p['discord_id'], side, mmr_before, p['mmr_general']))
+                changed.append(p)
+        await db.executemany('UPDATE players SET mmr_general = ?, games_played = games_played + 1, wins = ?, losses = ?, max_mmr = ? WHERE discord_id = ?', updates)
+        await _refresh_team_ratings(db, self.team_aggregate, all_ids)
+
+        # record match summary (store mmr_delta as the winners' average gain)
+        win_deltas = a_deltas if winner == 'A' else b_deltas
+        mmr_delta = round(sum(win_deltas) / len(win_deltas)) if win_deltas else 0
+        cur = await db.execute('INSERT INTO matches(team_a, team_b, winner, mmr_delta) VALUES(?,?,?,?)', (','.join(team_a_ids), ','.join(team_b_ids), winner, mmr_delta))
+        match_id = cur.lastrowid
+        await db.executemany('INSERT INTO match_participants(match_id, discord_id, side, mmr_before, mmr_after) VALUES(?,?,?,?,?)', [(match_id,) + row for row in participants])
+        if self.outbox_enabled:
+            entry = self._outbox_entry('record', match_id, team_a=list(team_a_ids), team_b=list(team_b_ids), winner=winner, mmr_delta=mmr_delta,
+                                       participants=[{'discord_id': pid, 'side': side, 'mmr_before': before, 'mmr_after': after} for pid, side, before, after in participants])
+            await db.execute('INSERT INTO outbox(idempotency_key, payload) VALUES(?,?)', entry)
+        if match_id % CHECKPOINT_INTERVAL == 0:
+            cur = await db.execute('SELECT discord_id, mmr_general, games_played, wins, losses, max_mmr FROM players')
+            state = RatingState.from_rows(await cur.fetchall())
+            await db.execute('INSERT OR REPLACE INTO rating_checkpoints(match_id, state) VALUES(?,?)', (match_id, state.to_blob()))
+        return match_id, changed
+
+    def _outbox_entry(self, op: str, match_id: int, **fields) -> Tuple[str, str]:
+        """An outbox row (idempotency key, JSON payload) for lol-balancer-api.
+
+        ``op`` is ``record`` for a new match, ``update`` when its teams or
+        replayed ratings changed and ``delete`` when it was removed; the API
+        keeps the payload with the highest ``revision`` per match, so a retried
+        older entry can't overwrite a newer one.
+        """
+        key = uuid.uuid4().hex
+        payload = {
+            'idempotency_key': key,
+            'op': op,
+            'source': os.path.basename(self.path),
+            'match_id': match_id,
+            'revision': time.time_ns(),
+            'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            **fields,
+        }
+        return key, json.dumps(payload, ensure_ascii=False)
+
+    async def _queue_resync(self, db: aiosqlite.Connection, first_id: int, op: str = 'update', deleted: Optional[int] = None):
+        """Queue every match from ``first_id`` on (as stored now) in the outbox, after a delete for ``deleted``.
+
+        Called in the transaction that rewrote them, so the API sees
+        corrections, deletions, replays and imports, not only new matches.
+        """
+        entries = [self._outbox_entry('delete', deleted)] if deleted is not None else []
+        last_id = first_id - 1
+        while True:
+            cur = await db.execute('SELECT id, team_a, team_b, winner, mmr_delta FROM matches WHERE id > ? ORDER BY id LIMIT ?', (last_id, REPLAY_BATCH_SIZE))
+            rows = await cur.fetchall()
+            if not rows:
+                break
+            cur = await db.execute('SELECT match_id, discord_id, side, mmr_before, mmr_after FROM match_participants WHERE match_id BETWEEN ? AND ?', (rows[0][0], rows[-1][0]))
+            ratings = {(mid, pid): {'discord_id': pid, 'side': side, 'mmr_before': before, 'mmr_after': after} for mid, pid, side, before, after in await cur.fetchall()}
+            deltas = {r[0]: r[4] for r in rows}
+            for mid, a_ids, b_ids, winner in parse_match_rows(r[:4] for r in rows):
+                entries.append(self._outbox_entry(op, mid, team_a=a_ids, team_b=b_ids, winner=winner, mmr_delta=deltas[mid],
+                                                  participants=[ratings[(mid, pid)] for pid in a_ids + b_ids if (mid, pid) in ratings]))
+            last_id = rows[-1][0]
+            await db.executemany('INSERT INTO outbox(idempotency_key, payload) VALUES(?,?)', entries)
+            entries = []
+        if entries:
+            await db.executemany('INSERT INTO outbox(idempotency_key, payload) VALUES(?,?)', entries)
+
+    def set_rating_formula(self, name: str, **params):
+        """Select the formula record_match uses (see rating.FORMULAS)."""
+        self.rating_formula = get_formula(name, **params)
+        self.rating_formula_name = name
+
+    async def recompute_ratings(self, formula_name: Optional[str] = None, **params) -> int:
+        """Rebuild every player's rating by replaying all matches after the base checkpoint, without stopping the bot.
+
+        The bulk of the replay runs in a worker thread on its own read
+        snapshot. Matches recorded meanwhile are replayed under the write lock,
+        then all players, participant mmr_before/mmr_after, mmr_delta and
+        checkpoints are written in one transaction. If ``formula_name``
+        is given it also becomes the formula for new matches.
+        Returns the number of players rewritten.
+        """
+        formula = get_formula(formula_name, **params) if formula_name else self.rating_formula
+        # old checkpoints and participant ratings are only valid for the old formula; collect fresh ones
+        checkpoints = []
+        log = ReplayLog()
+        rewrites = self._history_rewrites
+        state = None
+        if self.path != ':memory:':
+            # an in-memory database has nothing to snapshot from another thread
+            state, last_id = await asyncio.to_thread(replay_database, self.path, formula, checkpoints, log)
+        async with self._write() as db:
+            if state is None or self._history_rewrites != rewrites:
+                # replay everything under the lock (the snapshot predates a correction)
+                state, last_id = await _base_state(db)
+                checkpoints = []
+                log = ReplayLog()
+            # re-seeds the snapshot replay hasn't applied yet: those after its last match
+            pending = await _pending_adjustments(db, last_id)
+            # catch up on matches committed after the snapshot was taken
+            while True:
+                cur = await db.execute('SELECT id, team_a, team_b, winner FROM matches WHERE id > ? ORDER BY id LIMIT ?', (last_id, REPLAY_BATCH_SIZE))
+                rows = await cur.fetchall()
+                if not rows:
+                    break
+                _, last_id = replay(parse_match_rows(rows), formula, state, checkpoints, pending, log)
+            apply_adjustments(state, pending)
+            for participant_rows, delta_rows in log.batches(state):
+                await db.executemany('UPDATE match_participants SET mmr_before = ?, mmr_after = ? WHERE match_id = ? AND discord_id = ?', participant_rows)
+                await db.executemany('UPDATE matches SET mmr_delta = ? WHERE id = ?', delta_rows)
+            await db.executemany('UPDATE players SET mmr_general = ?, games_played = ?, wins = ?, losses = ?, max_mmr = ? WHERE discord_id = ?', state.rows())
+            await _refresh_team_ratings(db, self.team_aggregate)
+            await db.execute('DELETE FROM rating_checkpoints WHERE base = 0')
+            await db.executemany('INSERT INTO rating_checkpoints(match_id, state) VALUES(?,?)', checkpoints)
+            if self.outbox_enabled:
+                await self._queue_resync(db, 1)
+        if formula_name:
+            self.set_rating_formula(formula_name, **params)
+        if self._listeners:
+            self._notify(await self.list_players())
+        return len(state)
+
+    async def get_match(self, match_id: int) -> Optional[dict]:
+        async with self._read() as db:
+            cur = await db.execute('SELECT id, team_a, team_b, winner, mmr_delta, ts FROM matches WHERE id = ?', (match_id,))
+            row = await cur.fetchone()
+        if not row:
+            return None
+        return {'id': row[0], 'team_a': row[1].split(',') if row[1] else [], 'team_b': row[2].split(',') if row[2] else [], 'winner': row[3], 'mmr_delta': row[4], 'ts': row[5]}
+
+    async def correct_match(self, match_id: int, team_a_ids: List[str], team_b_ids: List[str], winner: str) -> int:
+        """Replace the teams/winner of a recorded match and recompute every rating it affects.
+
+        Returns the number of matches replayed. Raises KeyError if the match doesn't exist.
+        """
+        async def edit(db):
+            await db.execute('UPDATE matches SET team_a = ?, team_b = ?, winner = ? WHERE id = ?', (','.join(team_a_ids), ','.join(team_b_ids), winner, match_id))
+            await db.execute('DELETE FROM match_participants WHERE match_id = ?', (match_id,))
+            rows = [(match_id, pid, 'A') for pid in team_a_ids] + [(match_id, pid, 'B') for pid in team_b_ids]
+            await db.executemany('INSERT INTO match_participants(match_id, discord_id, side) VALUES(?,?,?)', rows)
+            await db.executemany('INSERT OR IGNORE INTO players(discord_id, name) VALUES(?,?)', [(pid, pid) for pid in list(team_a_ids) + list(team_b_ids)])
+        return await self._rewrite_history(match_id, edit)
+
+    async def delete_match(self, match_id: int) -> int:
+        """Delete a recorded match and recompute every rating it affected.
+
+        Returns the number of matches replayed. Raises KeyError if the match doesn't exist.
+        """
+        async def edit(db):
+            await db.execute('DELETE FROM match_participants WHERE match_id = ?', (match_id,))
+            await db.execute('DELETE FROM matches WHERE id = ?', (match_id,))
+        return await self._rewrite_history(match_id, edit, deletes=True)
+
+    async def replay_from(self, match_id: int) -> int:
+        """Recompute ratings, participant mmr_before/mmr_after and checkpoints from ``match_id`` on."""
+        return await self._rewrite_history(match_id, None)
+
+    async def _rewrite_history(self, match_id: int, edit, deletes: bool = False) -> int:
+        """Apply ``edit(db)`` (if given) to one match and replay from the nearest earlier checkpoint.
+
+        Matches up to the latest base checkpoint can't be edited (ValueError);
+        a plain replay from one of them starts at the base instead.
+
+        Everything happens in one write transaction: the edit, the replay of
+        the matches after the checkpoint (refreshing their participant
+        mmr_before/mmr_after and mmr_delta), new checkpoints and the player rows,
+        plus (with the outbox on) an update for every replayed match and, if
+        ``deletes``, a delete for the match itself.
+        """
+        async with self._write() as db:
+            self._history_rewrites += 1
+            cur = await db.execute('SELECT discord_id FROM match_participants WHERE match_id = ?', (match_id,))
+            old_participants = [r[0] for r in await cur.fetchall()]
+            cur = await db.execute('SELECT 1 FROM matches WHERE id = ?', (match_id,))
+            if await cur.fetchone() is None:
+                raise KeyError(match_id)
+            cur = await db.execute('SELECT MAX(match_id) FROM rating_checkpoints WHERE base = 1')
+            base_id = (await cur.fetchone())[0]
+            if base_id is not None and match_id <= base_id:
+                if edit is not None:
+                    raise ValueError(f'#{match_id} 경기는 기준 시점(#{base_id}) 이전 기록이라 수정할 수 없습니다.')
+                match_id = base_id + 1
+            # seeds: each player's rating before their first match, read before the edit
+            cur = await db.execute('SELECT discord_id, mmr_before, MIN(match_id) FROM match_participants GROUP BY discord_id')
+            seeds = {pid: before for pid, before, _ in await cur.fetchall() if before is not None}
+            if edit is not None:
+                await edit(db)
+
+            cur = await db.execute('SELECT match_id, state FROM rating_checkpoints WHERE match_id < ? ORDER BY match_id DESC LIMIT 1', (match_id,))
+            checkpoint = await cur.fetchone()
+            if checkpoint:
+                last_id, blob = checkpoint
+                state = RatingState.from_blob(blob, seeds)
+            else:
+                last_id, state = 0, RatingState(seeds)
+            await db.execute('DELETE FROM rating_checkpoints WHERE match_id > ?', (last_id,))
+            pending = await _pending_adjustments(db, last_id)
+            first_replayed = last_id + 1
+
+            replayed = 0
+            formula = self.rating_formula
+            while True:
+                cur = await db.execute('SELECT id, team_a, team_b, winner FROM matches WHERE id > ? ORDER BY id LIMIT ?', (last_id, REPLAY_BATCH_SIZE))
+                rows = await cur.fetchall()
+                if not rows:
+                    break
+                participant_rows = []
+                delta_rows = []
+                checkpoints = []
+                for mid, a_ids, b_ids, winner in parse_match_rows(rows):
+                    apply_adjustments(state, pending, mid)
+                    before = {pid: state.mmr[state.slot(pid)] for pid in a_ids + b_ids}
+                    state.apply_match(a_ids, b_ids, winner, formula)
+                    participant_rows.extend((before[pid], state.mmr[state.index[pid]], mid, pid) for pid in before)
+                    win_ids = a_ids if winner == 'A' else b_ids
+                    gains = [state.mmr[state.index[pid]] - before[pid] for pid in win_ids]
+                    delta_rows.append((round(sum(gains) / len(gains)) if gains else 0, mid))
+                    if mid % CHECKPOINT_INTERVAL == 0:
+                        checkpoints.append((mid, state.to_blob()))
+                    last_id = mid
+                    replayed += 1
+                await db.executemany('UPDATE match_participants SET mmr_before = ?, mmr_after = ? WHERE match_id = ? AND discord_id = ?', participant_rows)
+                await db.executemany('UPDATE matches SET mmr_delta = ? WHERE id = ?', delta_rows)
+                await db.executemany('INSERT OR REPLACE INTO rating_checkpoints(match_id, state) VALUES(?,?)', checkpoints)
+            apply_adjustments(state, pending)
+
+            await db.executemany('UPDATE players SET mmr_general = ?, games_played = ?, wins = ?, losses = ?, max_mmr = ? WHERE discord_id = ?', state.rows())
+            # players dropped from the edited match who have no other games go back to their seed
+            orphans = [pid for pid in old_participants if pid not in state.index]
+            await db.executemany('UPDATE players SET mmr_general = ?, games_played = 0, wins = 0, losses = 0, max_mmr = ? WHERE discord_id = ?',
+                                 [(seeds.get(pid, 1200), seeds.get(pid, 1200), pid) for pid in orphans])
+            await _refresh_team_ratings(db, self.team_aggregate)
+            if self.outbox_enabled:
+                await self._queue_resync(db, first_replayed, deleted=match_id if deletes else None)
+        if self._listeners:
+            # corrections are rare and may touch many players; just resend everyone
+            self._notify(await self.list_players())
+        return replayed
+
+    async def _drop_indexes(self, db: aiosqlite.Connection, names=BULK_DEFERRED_INDEXES) -> List[str]:
+        qmarks = ','.join('?' for _ in names)
+        cur = await db.execute(f"SELECT name, sql FROM sqlite_master WHERE type = 'index' AND name IN ({qmarks})", tuple(names))
+        saved = await cur.fetchall()
+        for name, _ in saved:
+            await db.execute(f'DROP INDEX {name}')
+        return [sql for _, sql in saved]
+
+    async def import_players(self, rows: Iterable[dict], batch_size: int = IMPORT_BATCH_SIZE, defer_indexes: bool = True) -> int:
+        """Insert or overwrite players from dicts with PLAYER_COLUMNS keys, in one transaction.
+
+        ``rows`` is consumed lazily in ``batch_size`` chunks, so a generator
+        over a large file keeps memory flat. The result becomes a base
+        checkpoint, so earlier matches can no longer be corrected.
+        Returns the number of rows written.
+        """
+        updates = ', '.join(f'{c} = excluded.{c}' for c in PLAYER_COLUMNS[1:])
+        sql = f'INSERT INTO players({PLAYER_SELECT}) VALUES({",".join("?" for _ in PLAYER_COLUMNS)}) ON CONFLICT(discord_id) DO UPDATE SET {updates}'
+        count = 0
+        async with self._write() as db:
+            self._history_rewrites += 1
+            await db.execute('BEGIN')
+            rebuild = await self._drop_indexes(db) if defer_indexes else []
+            for batch in _chunks(rows, batch_size):
+                await db.executemany(sql, [tuple(r[c] for c in PLAYER_COLUMNS) for r in batch])
+                count += len(batch)
+            for stmt in rebuild:
+                await db.execute(stmt)
+            # the imported rows can't be derived from the match history: replays start from them
+            cur = await db.execute('SELECT COALESCE(MAX(id), 0) FROM matches')
+            base_id = (await cur.fetchone())[0]
+            cur = await db.execute('SELECT discord_id, mmr_general, games_played, wins, losses, max_mmr FROM players')
+            state = RatingState.from_rows(await cur.fetchall())
+            await db.execute('INSERT OR REPLACE INTO rating_checkpoints(match_id, state, base) VALUES(?,?,1)', (base_id, state.to_blob()))
+            await db.execute('DELETE FROM rating_adjustments WHERE after_match_id <= ?', (base_id,))
+            await _refresh_team_ratings(db, self.team_aggregate)
+        if self._listeners:
+            self._notify(await self.list_players())
+        return count
+
+    async def import_matches(self, rows: Iterable[dict], batch_size: int = IMPORT_BATCH_SIZE, defer_indexes: bool = True,
+                             recompute: bool = False) -> Tuple[int, Optional[int]]:
+        """Append matches (dicts with team_a/team_b id lists, winner and optional ts/mmr_delta) in one transaction.
+
+        Imported matches get new ids after the existing ones, in input order;
+        their participants are added and unknown players are created. Ratings
+        aren't touched unless ``recompute`` is set, which replays history from
+        the first imported match afterwards. Returns (count, first new id).
+        """
+        count = 0
+        first_id = None
+        async with self._write() as db:
+            await db.execute('BEGIN')
+            cur = await db.execute("SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'matches'), 0), COALESCE((SELECT MAX(id) FROM matches), 0))")
+            next_id = (await cur.fetchone())[0] + 1
+            first_id = next_id
+            rebuild = await self._drop_indexes(db) if defer_indexes else []
+            for batch in _chunks(rows, batch_size):
+                match_rows = []
+                participant_rows = []
+                player_ids = {}
+                for r in batch:
+                    match_rows.append((next_id, ','.join(r['team_a']), ','.join(r['team_b']), r['winner'], r.get('mmr_delta'), r.get('ts')))
+                    for side, members in (('A', r['team_a']), ('B', r['team_b'])):
+                        participant_rows.extend((next_id, pid, side) for pid in members)
+                        player_ids.update(dict.fromkeys(members))
+                    next_id += 1
+                await db.executemany('INSERT OR IGNORE INTO players(discord_id, name) VALUES(?,?)', [(pid, pid) for pid in player_ids])
+                await db.executemany('INSERT INTO matches(id, team_a, team_b, winner, mmr_delta, ts) VALUES(?,?,?,?,?,COALESCE(?, CURRENT_TIMESTAMP))', match_rows)
+                await db.executemany('INSERT INTO match_participants(match_id, discord_id, side) VALUES(?,?,?)', participant_rows)
+                count += len(batch)
+            for stmt in rebuild:
+                await db.execute(stmt)
+            if count and self.outbox_enabled and not recompute:
+                # with recompute, replay_from() queues them with their ratings instead
+                await self._queue_resync(db, first_id, op='record')
+        if not count:
+            return 0, None
+        if recompute:
+            await self.replay_from(first_id)
+        elif self._listeners:
+            self._notify(await self.list_players())
+        return count, first_id
+
+    async def export_players(self, batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[dict]:
+        """Stream every player row as a dict, ``batch_size`` rows per fetch."""
+        async with self._read() as db:
+            cur = await db.execute(f'SELECT {PLAYER_SELECT} FROM players ORDER BY discord_id')
+            while True:
+                rows = await cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                for r in rows:
+                    yield dict(zip(PLAYER_COLUMNS, r))
+
+    async def export_matches(self, batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[dict]:
+        """Stream every match in id order, ``batch_size`` rows per fetch."""
+        async with self._read() as db:
+            cur = await db.execute('SELECT id, team_a, team_b, winner, mmr_delta, ts FROM matches ORDER BY id')
+            while True:
+                rows = await cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                for r in rows:
+                    yield {'id': r[0], 'team_a': r[1].split(',') if r[1] else [], 'team_b': r[2].split(',') if r[2] else [], 'winner': r[3], 'mmr_delta': r[4], 'ts': r[5]}
+
+    async def end_season(self, name: str, carryover: float = SEASON_CARRYOVER) -> dict:
+        """Archive the current season and soft-reset every rating, in one transaction.
+
+        Matches, their participants and a snapshot of every player who played
+        are copied into the season_* tables; the live match history and
+        checkpoints are cleared; each rating moves to
+        ``DEFAULT_MMR + (mmr - DEFAULT_MMR) * carryover`` with a fresh record.
+        Take a backup first (see backup.py); nothing here is irreversible,
+        but the live tables no longer hold the old season.
+        """
+        async with self._write() as db:
+            self._history_rewrites += 1
+            cur = await db.execute('SELECT COUNT(*) FROM matches')
+            matches = (await cur.fetchone())[0]
+            cur = await db.execute('SELECT COUNT(*) FROM players WHERE games_played > 0')
+            players = (await cur.fetchone())[0]
+            cur = await db.execute('INSERT INTO seasons(name, matches, players) VALUES(?,?,?)', (name, matches, players))
+            season_id = cur.lastrowid
+            await db.execute(f'INSERT INTO season_players(season_id, {PLAYER_SELECT}) SELECT ?, {PLAYER_SELECT} FROM players WHERE games_played > 0', (season_id,))
+            await db.execute('INSERT INTO season_matches(season_id, id, team_a, team_b, winner, mmr_delta, ts) '
+                             'SELECT ?, id, team_a, team_b, winner, mmr_delta, ts FROM matches', (season_id,))
+            await db.execute('INSERT INTO season_match_participants(season_id, match_id, discord_id, side, mmr_before, mmr_after) '
+                             'SELECT ?, match_id, discord_id, side, mmr_before, mmr_after FROM match_participants', (season_id,))
+            await db.execute('DELETE FROM match_participants')
+            await db.execute('DELETE FROM matches')
+            await db.execute('DELETE FROM rating_checkpoints')
+            await db.execute('DELETE FROM rating_adjustments')
+            # every right-hand side reads the pre-update row, so max_mmr gets the new general rating
+            soft = 'CAST(ROUND(:base + ({col} - :base) * :carry) AS INTEGER)'
+            await db.execute(
+                f"UPDATE players SET mmr_general = {soft.format(col='mmr_general')}, mmr_regular = {soft.format(col='mmr_regular')}, "
+                f"max_mmr = {soft.format(col='mmr_general')}, games_played = 0, wins = 0, losses = 0",
+                {'base': DEFAULT_MMR, 'carry': carryover})
+            await _refresh_team_ratings(db, self.team_aggregate)
+        if self._listeners:
+            self._notify(await self.list_players())
+        return {'season_id': season_id, 'name': name, 'matches': matches, 'players': players}
+
+    async def season_standings(self, season_id: int, limit: int = 10) -> List[dict]:
+        """Final mmr_general ranking of an archived season."""
+        async with self._read() as db:
+            cur = await db.execute('SELECT discord_id, name, mmr_general, games_played, wins, losses, max_mmr FROM season_players '
+                                   'WHERE season_id = ? ORDER BY mmr_general DESC LIMIT ?', (season_id, limit))
+            rows = await cur.fetchall()
+        return [{'discord_id': r[0], 'name': r[1], 'mmr': r[2], 'games_played': r[3], 'wins': r[4], 'losses': r[5], 'max_mmr': r[6]} for r in rows]
+
+    async def create_tournament(self, name: str, fmt: str, team_ids: List[int], rounds: int,
+                                games: List[Tuple[int, int, int, Optional[int]]]) -> int:
+        """Store a tournament with its teams (``team_ids`` in seed order) and first games.
+
+        ``games`` are (round, slot, team_a, team_b) tuples; a game without
+        team_b is a bye and is stored as already won by team_a.
+        """
+        async def op(db):
+            cur = await db.execute('INSERT INTO tournaments(name, format, rounds) VALUES(?,?,?)', (name, fmt, rounds))
+            tournament_id = cur.lastrowid
+            await db.executemany('INSERT INTO tournament_teams(tournament_id, seed, team_id) VALUES(?,?,?)',
+                                 [(tournament_id, seed, team_id) for seed, team_id in enumerate(team_ids, start=1)])
+            await self._insert_tournament_games(db, tournament_id, games)
+            return tournament_id, []
+        return await self._submit(op)
+
+    async def _insert_tournament_games(self, db: aiosqlite.Connection, tournament_id: int, games) -> int:
+        # OR IGNORE: a round that already exists is left as it is
+        cur = await db.executemany('INSERT OR IGNORE INTO tournament_games(tournament_id, round, slot, team_a, team_b, winner) VALUES(?,?,?,?,?,?)',
+                                   [(tournament_id, rnd, slot, a, b, None if b is not None else 'A') for rnd, slot, a, b in games])
+        return cur.rowcount
+
+    async def _load_tournament(self, db: aiosqlite.Connection, tournament_id: int) -> Optional[dict]:
+        cur = await db.execute('SELECT id, name, format, rounds, status, champion_team_id, created_at FROM tournaments WHERE id = ?', (tournament_id,))
+        row = await cur.fetchone()
+        if row is None:
+            return None
+        cur = await db.execute('SELECT team_id FROM tournament_teams WHERE tournament_id = ? ORDER BY seed', (tournament_id,))
+        team_ids = [r[0] for r in await cur.fetchall()]
+        cur = await db.execute('SELECT id, round, slot, team_a, team_b, winner, match_id FROM tournament_games WHERE tournament_id = ? ORDER BY round, slot', (tournament_id,))
+        games = [{'id': r[0], 'round': r[1], 'slot': r[2], 'team_a': r[3], 'team_b': r[4], 'winner': r[5], 'match_id': r[6]} for r in await cur.fetchall()]
+        return {'id': row[0], 'name': row[1], 'format': row[2], 'rounds': row[3], 'status': row[4], 'champion_team_id': row[5],
+                'created_at': row[6], 'team_ids': team_ids, 'games': games}
+
+    async def get_tournament(self, tournament_id: int) -> Optional[dict]:
+        """The tournament row with ``team_ids`` in seed order and every game, in round/slot order."""
+        async with self._read() as db:
+            return await self._load_tournament(db, tournament_id)
+
+    async def list_tournaments(self, limit: int = 10) -> List[dict]:
+        async with self._read() as db:
+            cur = await db.execute('SELECT id, name, format, status FROM tournaments ORDER BY id DESC LIMIT ?', (limit,))
+            rows = await cur.fetchall()
+        return [{'id': r[0], 'name': r[1], 'format': r[2], 'status': r[3]} for r in rows]
+
+    async def record_tournament_game(self, game_id: int, winner: str, advance: Optional[Callable[[dict], Optional[Tuple[list, Optional[int]]]]] = None) -> Tuple[int, int]:
+        """Record a tournament game through record_match, in one transaction; returns (tournament_id, match_id).
+
+        ``advance(tournament)`` (see tournament.next_step) is then called on
+        the updated tournament in the same transaction; it returns None, the
+        next round's (round, slot, team_a, team_b) games, or ([], champion
+        team id) to finish the tournament.
+        Raises KeyError if the game doesn't exist and ValueError if it is already decided.
+        """
+        async def op(db):
+            cur = await db.execute('SELECT tournament_id, team_a, team_b, winner FROM tournament_games WHERE id = ?', (game_id,))
+            row = await cur.fetchone()
+            if row is None:
+                raise KeyError(game_id)
+            tournament_id, team_a, team_b, decided = row
+            if decided is not None:
+                raise ValueError('이미 결과가 기록된 경기입니다')
+            cur = await db.execute('SELECT id, member_ids FROM teams WHERE id IN (?,?)', (team_a, team_b))
+            members = {r[0]: r[1].split(',') if r[1] else [] for r in await cur.fetchall()}
+            match_id, rows = await self._record_match(db, members[team_a], members[team_b], winner)
+            await db.execute('UPDATE tournament_games SET winner = ?, match_id = ? WHERE id = ?', (winner, match_id, game_id))
+            step = advance(await self._load_tournament(db, tournament_id)) if advance is not None else None
+            if step is not None:
+                games, champion_team_id = step
+                if games:
+                    await self._insert_tournament_games(db, tournament_id, games)
                 else:
-                    mmr = max(0, mmr + delta_lose)
-                    losses = losses + 1
-                max_mmr = max(max_mmr, mmr)
-                await db.execute('UPDATE players SET mmr_general = ?, games_played = games_played + 1, wins = ?, losses = ?, max_mmr = ? WHERE discord_id = ?', (mmr, wins, losses, max_mmr, pid))
-
-            # record match summary (store mmr_delta as positive int for winner)
-            mmr_delta = delta_win if winner == 'A' else delta_win
-            await db.execute('INSERT INTO matches(team_a, team_b, winner, mmr_delta) VALUES(?,?,?,?)', (','.join(team_a_ids), ','.join(team_b_ids), winner, mmr_delta))
-            await db.commit()
+                    await db.execute("UPDATE tournaments SET status = 'finished', champion_team_id = ? WHERE id = ?", (champion_team_id, tournament_id))
+            return (tournament_id, match_id), rows
+        return await self._submit(op)
+
+    async def outbox_due(self, limit: int, now: Optional[float] = None) -> List[dict]:
+        """Oldest outbox entries whose next attempt is due (``now`` is a time.time() value)."""
+        async with self._read() as db:
+            cur = await db.execute('SELECT id, idempotency_key, payload, attempts FROM outbox WHERE next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT ?',
+                                   (time.time() if now is None else now, limit))
+            rows = await cur.fetchall()
+        return [{'id': r[0], 'idempotency_key': r[1], 'payload': r[2], 'attempts': r[3]} for r in rows]
+
+    async def outbox_next_due(self) -> Optional[float]:
+        """When the earliest pending entry becomes due, or None if the outbox is empty."""
+        async with self._read() as db:
+            cur = await db.execute('SELECT MIN(next_attempt_at) FROM outbox')
+            return (await cur.fetchone())[0]
+
+    async def outbox_size(self) -> int:
+        async with self._read() as db:
+            cur = await db.execute('SELECT COUNT(*) FROM outbox')
+            return (await cur.fetchone())[0]
+
+    async def outbox_delivered(self, ids: List[int]):
+        async def op(db):
+            await db.executemany('DELETE FROM outbox WHERE id = ?', [(i,) for i in ids])
+            return None, []
+        await self._submit(op)
+
+    async def outbox_retry_later(self, retries: List[Tuple[int, float, str]]):
+        """Record failed attempts as (id, next_attempt_at, error)."""
+        async def op(db):
+            await db.executemany('UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ? WHERE id = ?',
+                                 [(when, error, i) for i, when, error in retries])
+            return None, []
+        await self._submit(op)
+
+    async def outbox_fail(self, failures: List[Tuple[int, str]]):
+        """Move entries that won't be retried, given as (id, error), to outbox_failed."""
+        async def op(db):
+            await db.executemany('INSERT OR REPLACE INTO outbox_failed(id, idempotency_key, payload, attempts, last_error, created_at) '
+                                 'SELECT id, idempotency_key, payload, attempts + 1, ?, created_at FROM outbox WHERE id = ?',
+                                 [(error, i) for i, error in failures])
+            await db.executemany('DELETE FROM outbox WHERE id = ?', [(i,) for i, _ in failures])
+            return None, []
+        await self._submit(op)
+
+    async def outbox_failed_count(self) -> int:
+        async with self._read() as db:
+            cur = await db.execute('SELECT COUNT(*) FROM outbox_failed')
+            return (await cur.fetchone())[0]
+
+    async def player_history(self, discord_id: str, limit: int = 20, before_match_id: Optional[int] = None) -> List[dict]:
+        """Most recent matches of a player, newest first.
+
+        Pass the last ``match_id`` seen as ``before_match_id`` to page further back.
+        """
+        cursor_id = before_match_id if before_match_id is not None else -1
+        async with self._read() as db:
+            cur = await db.execute(
+                'SELECT mp.match_id, m.ts, mp.side, m.winner, mp.mmr_before, mp.mmr_after '
+                'FROM match_participants mp JOIN matches m ON m.id = mp.match_id '
+                'WHERE mp.discord_id = ? AND (? < 0 OR mp.match_id < ?) '
+                'ORDER BY mp.match_id DESC LIMIT ?',
+                (discord_id, cursor_id, cursor_id, limit))
+            rows = await cur.fetchall()
+        return [{'match_id': r[0], 'ts': r[1], 'side': r[2], 'won': r[2] == r[3], 'mmr_before': r[4], 'mmr_after': r[5]} for r in rows]
+
+    async def mmr_series(self, discord_id: str, days: Optional[int] = None, resolution: str = 'day') -> List[dict]:
+        """A player's mmr_general over time, oldest first, one point per ``resolution`` bucket.
+
+        Reads the per-player rows of match_participants through its covering
+        index (joining matches by primary key only for ``ts``), so it costs
+        O(games of this player in range) regardless of table size. Each
+        point carries the bucket start, the rating entering the bucket
+        (open), after its last match (close), its low/high and game count.
+        Backfilled rows without recorded ratings are skipped.
+        """
+        bucket = SERIES_RESOLUTIONS.get(resolution)
+        if bucket is None:
+            raise ValueError(f'unknown resolution: {resolution}')
+        async with self._read() as db:
+            cur = await db.execute(
+                f'SELECT {bucket}, mp.match_id, mp.mmr_before, mp.mmr_after '
+                'FROM match_participants mp JOIN matches m ON m.id = mp.match_id '
+                "WHERE mp.discord_id = ? AND mp.mmr_after IS NOT NULL AND (? IS NULL OR m.ts >= datetime('now', ?)) "
+                'ORDER BY m.ts, mp.match_id',
+                (discord_id, days, f'-{days or 0} days'))
+            rows = await cur.fetchall()
+        points = []
+        for ts, match_id, before, after in rows:
+            if points and points[-1]['ts'] == ts:
+                p = points[-1]
+                p['close'] = after
+                p['low'] = min(p['low'], after)
+                p['high'] = max(p['high'], after)
+                p['games'] += 1
+                p['match_id'] = match_id
+            else:
+                start = after if before is None else before
+                points.append({'ts': ts, 'match_id': match_id, 'open': start, 'close': after,
+                               'low': min(start, after), 'high': max(start, after), 'games': 1})
+        return points
+
+    async def head_to_head(self, player_a: str, player_b: str) -> dict:
+        """Record of ``player_a`` against ``player_b`` in matches where they were on opposite sides."""
+        async with self._read() as db:
+            cur = await db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(m.winner = pa.side), 0) '
+                'FROM match_participants pa '
+                'JOIN match_participants pb ON pb.match_id = pa.match_id AND pb.discord_id = ? AND pb.side != pa.side '
+                'JOIN matches m ON m.id = pa.match_id '
+                'WHERE pa.discord_id = ?',
+                (player_b, player_a))
+            games, a_wins = await cur.fetchone()
+        return {'games': games, 'a_wins': a_wins, 'b_wins': games - a_wins}
+
+    async def teammate_synergy(self, discord_id: str, min_games: int = 3, limit: int = 10) -> List[dict]:
+        """Teammates of a player with games played together and win rate, best first."""
+        async with self._read() as db:
+            cur = await db.execute(
+                'SELECT pt.discord_id, COUNT(*) AS games, SUM(m.winner = pp.side) AS wins '
+                'FROM match_participants pp '
+                'JOIN match_participants pt ON pt.match_id = pp.match_id AND pt.side = pp.side AND pt.discord_id != pp.discord_id '
+                'JOIN matches m ON m.id = pp.match_id '
+                'WHERE pp.discord_id = ? '
+                'GROUP BY pt.discord_id HAVING games >= ? '
+                'ORDER BY CAST(wins AS REAL) / games DESC, games DESC LIMIT ?',
+                (discord_id, min_games, limit))
+            rows = await cur.fetchall()
+        return [{'discord_id': r[0], 'games': r[1], 'wins': r[2], 'winrate': r[2] / r[1]} for r in rows]
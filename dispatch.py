@@ -0,0 +1,249 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+import discord
+
+from metrics import metrics
+
+# Proactive limits per route, (requests, seconds), kept slightly under Discord's
+# published buckets so a burst waits here instead of in a 429 retry loop.
+CHANNEL_CREATE_RATE = (5, 5.0)
+CHANNEL_EDIT_RATE = (5, 5.0)
+GLOBAL_RATE = (45, 1.0)
+# a 429 that still gets through is retried this many times before giving up
+DISPATCH_MAX_RETRIES = 3
+# record confirmations within this long of a summary's creation are merged into it
+SUMMARY_WINDOW = 60.0
+SUMMARY_MAX_LINES = 20
+# idle route buckets and closed summaries are dropped at most this often
+DISPATCH_SWEEP_INTERVAL = 300.0
+
+class RouteBucket:
+    """Sliding-window limiter: at most ``limit`` sends in any ``per`` seconds."""
+
+    __slots__ = ('limit', 'per', 'sent')
+
+    def __init__(self, limit: int, per: float):
+        self.limit = limit
+        self.per = per
+        self.sent: Deque[float] = deque()
+
+    def delay(self, now: float) -> float:
+        """Seconds to wait before the next send is allowed."""
+        while self.sent and now - self.sent[0] >= self.per:
+            self.sent.popleft()
+        if len(self.sent) < self.limit:
+            return 0.0
+        return self.per - (now - self.sent[0])
+
+    def take(self, now: float):
+        self.sent.append(now)
+
+    def block(self, seconds: float, now: float):
+        """Treat the bucket as exhausted for ``seconds`` (after a 429)."""
+        self.sent = deque([now + seconds - self.per] * self.limit)
+
+class _Item:
+    __slots__ = ('route', 'send', 'future', 'attempts')
+
+    def __init__(self, route: Optional[str], send: Callable, future: asyncio.Future):
+        self.route = route
+        self.send = send
+        self.future = future
+        self.attempts = 0
+
+class _Summary:
+    __slots__ = ('title', 'lines', 'opened', 'message', 'dirty')
+
+    def __init__(self, title: str, now: float):
+        self.title = title
+        self.lines: List[str] = []
+        self.opened = now
+        self.message: Optional[discord.Message] = None
+        self.dirty = False
+
+    def render(self) -> str:
+        body = '\n'.join(self.lines)
+        # Discord rejects messages over 2000 characters
+        return f'{self.title} ({len(self.lines)}건)\n{body}'[:2000]
+
+class Dispatcher:
+    """Outbound message queue: handlers enqueue and return, one worker per channel sends.
+
+    Each channel has two queues, each sent in order: channel messages
+    (create/edit, paced proactively by RouteBucket along with the global
+    limit) and interaction followups (no bucket: their webhook routes are
+    per interaction token and exempt from the global limit, so they never
+    wait behind a throttled channel message). There is no order between
+    the two queues: a followup may overtake a channel message queued
+    before it, including a summary that falls back to a followup because
+    the bot can't post in the channel.
+
+    ``summary()`` merges bursts of short notices (e.g. match confirmations)
+    into one channel message that is edited as lines arrive: lines added
+    while an edit is still waiting for its bucket ride along with that
+    edit. Buckets of quiet channels and summaries past their window are
+    swept every DISPATCH_SWEEP_INTERVAL seconds.
+    """
+
+    def __init__(self, summary_window: float = SUMMARY_WINDOW):
+        self.summary_window = summary_window
+        # keyed by (kind, channel_id), kind being 'channel' or 'followup'
+        self._queues: Dict[Tuple[str, int], Deque[_Item]] = {}
+        self._workers: Dict[Tuple[str, int], asyncio.Task] = {}
+        self._buckets: Dict[Tuple[str, int], RouteBucket] = {}
+        self._global = RouteBucket(*GLOBAL_RATE)
+        self._summaries: Dict[Tuple[int, str], _Summary] = {}
+        self._swept = time.monotonic()
+
+    def _enqueue(self, channel_id: int, route: Optional[str], send: Callable) -> asyncio.Future:
+        key = ('followup' if route is None else 'channel', channel_id)
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(key, deque()).append(_Item(route, send, future))
+        if key not in self._workers:
+            self._workers[key] = asyncio.ensure_future(self._drain(key))
+        now = time.monotonic()
+        if now - self._swept >= DISPATCH_SWEEP_INTERVAL:
+            self._sweep(now)
+        metrics.set_gauge('dispatch_queued', sum(len(q) for q in self._queues.values()))
+        return future
+
+    def followup(self, interaction: discord.Interaction, content: Optional[str] = None, **kwargs) -> asyncio.Future:
+        """Queue ``interaction.followup.send``; the future resolves to the message (or None if it failed)."""
+        return self._enqueue(interaction.channel_id or 0, None, lambda: interaction.followup.send(content, **kwargs))
+
+    def send(self, channel: discord.abc.Messageable, content: Optional[str] = None, **kwargs) -> asyncio.Future:
+        """Queue a plain channel message (prefix commands, notices)."""
+        channel_id = getattr(channel, 'id', 0)
+        return self._enqueue(channel_id, 'create', lambda: channel.send(content, **kwargs))
+
+    def _sweep(self, now: float):
+        """Forget buckets with nothing in their window and summaries that can't take more lines."""
+        self._swept = now
+        for key in [k for k, b in self._buckets.items() if not b.sent or now - b.sent[-1] >= b.per]:
+            del self._buckets[key]
+        # a queued edit keeps its own reference to the summary
+        for key in [k for k, s in self._summaries.items() if now - s.opened > self.summary_window]:
+            del self._summaries[key]
+
+    def summary(self, channel: discord.abc.Messageable, key: str, line: str, title: str,
+                interaction: Optional[discord.Interaction] = None):
+        """Add ``line`` to the open ``key`` summary in ``channel``, starting a new one if needed.
+
+        If the bot may not post in ``channel``, the summary is posted as a
+        followup of ``interaction`` instead (when given); it is still sent
+        from the channel queue, unordered with other followups.
+        """
+        channel_id = getattr(channel, 'id', 0)
+        now = time.monotonic()
+        s = self._summaries.get((channel_id, key))
+        if s is None or now - s.opened > self.summary_window or len(s.lines) >= SUMMARY_MAX_LINES:
+            s = self._summaries[(channel_id, key)] = _Summary(title, now)
+            s.lines.append(line)
+            s.dirty = True  # lines added before the create goes out are sent with it
+
+            async def create():
+                s.dirty = False
+                s.message = await _post(channel, s.render(), interaction)
+                return s.message
+            self._enqueue(channel_id, 'create', create)
+            return
+        s.lines.append(line)
+        if s.dirty:
+            return  # the queued edit will pick this line up
+        s.dirty = True
+
+        async def edit():
+            s.dirty = False
+            if s.message is None:  # the first send failed; post it afresh
+                s.message = await _post(channel, s.render(), interaction)
+            else:
+                await s.message.edit(content=s.render())
+            return s.message
+        self._enqueue(channel_id, 'edit', edit)
+
+    def _bucket(self, route: str, channel_id: int) -> RouteBucket:
+        bucket = self._buckets.get((route, channel_id))
+        if bucket is None:
+            rate = CHANNEL_EDIT_RATE if route == 'edit' else CHANNEL_CREATE_RATE
+            bucket = self._buckets[(route, channel_id)] = RouteBucket(*rate)
+        return bucket
+
+    async def _acquire(self, route: Optional[str], channel_id: int):
+        if route is None:
+            return
+        bucket = self._bucket(route, channel_id)
+        while True:
+            now = time.monotonic()
+            wait = max(bucket.delay(now), self._global.delay(now))
+            if wait <= 0:
+                bucket.take(now)
+                self._global.take(now)
+                return
+            metrics.observe('dispatch', 'bucket_wait', wait)
+            await asyncio.sleep(wait)
+
+    async def _drain(self, key: Tuple[str, int]):
+        _, channel_id = key
+        queue = self._queues[key]
+        try:
+            while queue:
+                item = queue[0]
+                await self._acquire(item.route, channel_id)
+                try:
+                    result = await item.send()
+                except (discord.RateLimited, discord.HTTPException) as e:
+                    retry_after = _retry_after(e)
+                    if retry_after is not None and item.attempts < DISPATCH_MAX_RETRIES:
+                        item.attempts += 1
+                        logging.warning('Dispatch: 429 on %s in channel %s, retrying in %.1fs', item.route or 'followup', channel_id, retry_after)
+                        if item.route is not None:
+                            self._bucket(item.route, channel_id).block(retry_after, time.monotonic())
+                        else:
+                            await asyncio.sleep(retry_after)
+                        continue
+                    logging.warning('Dispatch: send to channel %s failed: %s', channel_id, e)
+                    result = None
+                except Exception:
+                    logging.exception('Dispatch: send to channel %s failed', channel_id)
+                    result = None
+                queue.popleft()
+                if not item.future.done():
+                    item.future.set_result(result)
+        finally:
+            # cancelled (shutdown) or drained: anything left is dropped
+            for item in queue:
+                if not item.future.done():
+                    item.future.set_result(None)
+            self._queues.pop(key, None)
+            self._workers.pop(key, None)
+
+    async def close(self):
+        workers = list(self._workers.values())
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+async def _post(channel: discord.abc.Messageable, content: str, interaction: Optional[discord.Interaction]) -> discord.Message:
+    try:
+        return await channel.send(content)
+    except discord.Forbidden:
+        if interaction is None:
+            raise
+        # no Send Messages permission there; the interaction webhook doesn't need it
+        return await interaction.followup.send(content)
+
+def _retry_after(e: Exception) -> Optional[float]:
+    if isinstance(e, discord.RateLimited):
+        return e.retry_after
+    if isinstance(e, discord.HTTPException) and e.status == 429:
+        try:
+            return float(e.response.headers.get('Retry-After', 1.0))
+        except (AttributeError, TypeError, ValueError):
+            return 1.0
+    return None
+
+dispatcher = Dispatcher()
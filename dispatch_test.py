@@ -0,0 +1,186 @@
+"""Dispatcher: route pacing, 429 retries, summary merging, the sweep and the Forbidden fallback.
+
+Channels, messages and interactions are fakes that record what was sent
+and when, so nothing reaches Discord. Rates are scaled down to tenths of
+a second.
+
+usage: python dispatch_test.py
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import discord
+
+import dispatch
+from dispatch import Dispatcher, RouteBucket
+
+def http_error(cls, status: int, retry_after: str = None):
+    response = SimpleNamespace(status=status, reason='test', headers={'Retry-After': retry_after} if retry_after else {})
+    return cls(response, 'test')
+
+class FakeMessage:
+    def __init__(self, content: str):
+        self.content = content
+        self.edits = []
+
+    async def edit(self, content: str):
+        self.content = content
+        self.edits.append(content)
+
+class FakeChannel:
+    """Records sends; ``fail`` is a list of exceptions raised by the next sends, in order."""
+
+    def __init__(self, channel_id: int, fail=()):
+        self.id = channel_id
+        self.sent = []
+        self.times = []
+        self.fail = list(fail)
+
+    async def send(self, content=None, **kwargs):
+        self.times.append(time.monotonic())
+        if self.fail:
+            raise self.fail.pop(0)
+        message = FakeMessage(content)
+        self.sent.append(message)
+        return message
+
+def fake_interaction(channel_id: int, fail=()):
+    webhook = FakeChannel(channel_id, fail)
+    return SimpleNamespace(channel_id=channel_id, followup=webhook), webhook
+
+def buckets():
+    b = RouteBucket(2, 1.0)
+    assert b.delay(0.0) == 0.0
+    b.take(0.0)
+    b.take(0.1)
+    assert b.delay(0.5) == 0.5, 'full until the oldest send leaves the window'
+    assert b.delay(1.0) == 0.0
+    b.block(3.0, 2.0)
+    assert b.delay(2.0) == 3.0 and b.delay(4.5) == 0.5 and b.delay(5.0) == 0.0
+
+async def pacing():
+    d = Dispatcher()
+    channel = FakeChannel(1)
+    messages = await asyncio.gather(*[d.send(channel, f'm{i}') for i in range(7)])
+    assert [m.content for m in messages] == [f'm{i}' for i in range(7)]
+    # at most 2 sends in any 0.2 s window
+    for first, third in zip(channel.times, channel.times[2:]):
+        assert third - first >= 0.2 - 1e-3, channel.times
+    # followups don't wait behind the throttled channel route
+    other = FakeChannel(2)
+    interaction, webhook = fake_interaction(2)
+    channel_sends = [d.send(other, f'c{i}') for i in range(4)]
+    started = time.monotonic()
+    await asyncio.gather(*[d.followup(interaction, f'f{i}') for i in range(4)])
+    assert time.monotonic() - started < 0.1 and [m.content for m in webhook.sent] == ['f0', 'f1', 'f2', 'f3']
+    await asyncio.gather(*channel_sends)
+    await d.close()
+
+async def retries():
+    d = Dispatcher()
+    # RateLimited and HTTP 429 are retried after their delay, in place (order kept)
+    channel = FakeChannel(1, [discord.RateLimited(0.05), http_error(discord.HTTPException, 429, '0.05')])
+    first, second = d.send(channel, 'a'), d.send(channel, 'b')
+    assert (await first).content == 'a' and (await second).content == 'b'
+    assert [m.content for m in channel.sent] == ['a', 'b'] and channel.times[2] - channel.times[0] >= 0.1 - 1e-3
+    # past DISPATCH_MAX_RETRIES the send is given up; other errors are not retried
+    channel = FakeChannel(2, [discord.RateLimited(0.01)] * (dispatch.DISPATCH_MAX_RETRIES + 1))
+    assert await d.send(channel, 'x') is None and len(channel.times) == dispatch.DISPATCH_MAX_RETRIES + 1
+    assert await d.send(channel, 'y') is not None, 'the worker keeps going after a failure'
+    channel = FakeChannel(3, [http_error(discord.HTTPException, 500)])
+    assert await d.send(channel, 'z') is None and len(channel.times) == 1
+    interaction, webhook = fake_interaction(4, [discord.RateLimited(0.02)])
+    assert (await d.followup(interaction, 'f')).content == 'f' and len(webhook.times) == 2
+    await d.close()
+
+async def settle(d: Dispatcher):
+    while d._workers:
+        await asyncio.gather(*list(d._workers.values()))
+
+async def summaries():
+    d = Dispatcher(summary_window=0.5)
+    channel = FakeChannel(1)
+    # lines added before the create goes out are sent with it
+    for i in range(3):
+        d.summary(channel, 'record', f'#{i}', '경기 기록')
+    await settle(d)
+    assert len(channel.sent) == 1 and channel.sent[0].content == '경기 기록 (3건)\n#0\n#1\n#2'
+    message = channel.sent[0]
+    # one edit per burst; a line added while the edit waits for its bucket rides along
+    d.summary(channel, 'record', '#3', '경기 기록')
+    await settle(d)
+    d.summary(channel, 'record', '#4', '경기 기록')
+    await asyncio.sleep(0.05)
+    assert len(message.edits) == 1, 'the second edit should be waiting for its bucket'
+    d.summary(channel, 'record', '#5', '경기 기록')
+    await settle(d)
+    assert len(message.edits) == 2 and message.content.endswith('#3\n#4\n#5') and len(channel.sent) == 1
+    # other keys, and lines after the window, start a new message
+    d.summary(channel, 'other', 'x', '기타')
+    await asyncio.sleep(0.5)
+    d.summary(channel, 'record', '#6', '경기 기록')
+    await settle(d)
+    assert [m.content for m in channel.sent[1:]] == ['기타 (1건)\nx', '경기 기록 (1건)\n#6']
+    # a full summary starts a new one too
+    for i in range(dispatch.SUMMARY_MAX_LINES + 1):
+        d.summary(channel, 'full', str(i), '가득')
+    await settle(d)
+    assert [m.content.split('\n')[0] for m in channel.sent[3:]] == [f'가득 ({dispatch.SUMMARY_MAX_LINES}건)', '가득 (1건)']
+    await d.close()
+
+async def sweep():
+    d = Dispatcher(summary_window=0.5)
+    quiet, busy = FakeChannel(1), FakeChannel(2)
+    await d.send(quiet, 'q')
+    d.summary(quiet, 'record', 'line', '경기 기록')
+    await settle(d)
+    now = time.monotonic()
+    d._sweep(now)
+    assert ('create', 1) in d._buckets and (1, 'record') in d._summaries, 'recent entries are kept'
+    # once the bucket window and the summary window have passed, both are dropped
+    await asyncio.sleep(0.5)
+    d._swept = time.monotonic() - dispatch.DISPATCH_SWEEP_INTERVAL
+    await d.send(busy, 'b')
+    assert list(d._buckets) == [('create', 2)] and not d._summaries
+    # a sweep doesn't lose lines: the next one starts a fresh summary
+    d.summary(quiet, 'record', 'again', '경기 기록')
+    await settle(d)
+    assert quiet.sent[-1].content == '경기 기록 (1건)\nagain'
+    await d.close()
+
+async def forbidden():
+    d = Dispatcher()
+    forbidden = lambda: http_error(discord.Forbidden, 403)
+    channel = FakeChannel(1, [forbidden()])
+    interaction, webhook = fake_interaction(1)
+    d.summary(channel, 'record', '#0', '경기 기록', interaction)
+    await settle(d)
+    assert not channel.sent and [m.content for m in webhook.sent] == ['경기 기록 (1건)\n#0']
+    # later lines edit the followup message
+    d.summary(channel, 'record', '#1', '경기 기록', interaction)
+    await settle(d)
+    assert webhook.sent[0].edits == ['경기 기록 (2건)\n#0\n#1']
+    # without an interaction the summary is dropped; the next line tries to post it afresh
+    channel = FakeChannel(2, [forbidden()])
+    d.summary(channel, 'record', '#0', '경기 기록')
+    await settle(d)
+    assert not channel.sent
+    d.summary(channel, 'record', '#1', '경기 기록')
+    await settle(d)
+    assert [m.content for m in channel.sent] == ['경기 기록 (2건)\n#0\n#1']
+    await d.close()
+
+async def main():
+    dispatch.CHANNEL_CREATE_RATE = (2, 0.2)
+    dispatch.CHANNEL_EDIT_RATE = (1, 0.2)
+    buckets()
+    await pacing()
+    await retries()
+    await summaries()
+    await sweep()
+    await forbidden()
+    print('OK')
+
+if __name__ == '__main__':
+    asyncio.run(main())
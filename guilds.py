@@ -0,0 +1,165 @@
+import asyncio
+import glob
+import logging
+import os
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from db import DB, DB_PATH
+from leaderboard import Leaderboard
+from playercache import PlayerCache
+
+GUILD_DATA_DIR = 'guild_data'
+# open guild databases kept at once; the least recently used is closed beyond this
+# (once no command is using it any more)
+GUILD_CACHE_SIZE = 64
+
+class GuildData:
+    """Everything that is stored per guild: the database and views built on it."""
+
+    def __init__(self, guild_id: Optional[int], db: DB):
+        self.guild_id = guild_id
+        self.db = db
+        self.leaderboard = Leaderboard()
+        self.players = PlayerCache()
+        # tasks (commands) that got this handle from GuildStore.get and haven't finished yet
+        self.holders: Set[asyncio.Task] = set()
+        # set once the handle is being closed; it can't be handed out again after that
+        self.closing: Optional[asyncio.Task] = None
+
+class GuildStore:
+    """Lazily opened, LRU-evicted per-guild databases.
+
+    With ``per_guild`` off every guild shares the default handle (the
+    original single ``mmr_bot.db``). With it on, each guild gets its own
+    SQLite file under ``data_dir`` so guilds never share a leaderboard, a
+    write lock or a table scan. DMs always use the default handle.
+
+    A guild handle is leased to the task that called ``get()`` (each
+    command runs in its own task) until that task finishes. An evicted
+    handle is only closed once its last lease ends, and stays listed
+    until the close completes: a ``get()`` meanwhile either takes it back
+    (not closing yet) or waits for the close and opens the file afresh.
+    """
+
+    def __init__(self, default_path: str = DB_PATH, data_dir: str = GUILD_DATA_DIR,
+                 per_guild: bool = False, capacity: int = GUILD_CACHE_SIZE):
+        self.default = GuildData(None, DB(default_path))
+        self.data_dir = data_dir
+        self.per_guild = per_guild
+        self.capacity = capacity
+        self._open: 'OrderedDict[int, GuildData]' = OrderedDict()
+        self._opening: Dict[int, asyncio.Task] = {}
+        # evicted, not yet closed (still leased, or closing)
+        self._closing: Dict[int, GuildData] = {}
+        # called with each GuildData right after its DB object is created, before connect()
+        self.on_create: List[Callable[[GuildData], None]] = []
+        # called once it is connected and loaded, and again just before its DB is closed
+        self.on_open: List[Callable[[GuildData], None]] = []
+        self.on_close: List[Callable[[GuildData], Awaitable[None]]] = []
+
+    def path_for(self, guild_id: int) -> str:
+        return os.path.join(self.data_dir, f'guild_{guild_id}.db')
+
+    def db_paths(self) -> List[str]:
+        """Every database file this store manages, open or not."""
+        paths = [self.default.db.path]
+        if self.per_guild and os.path.isdir(self.data_dir):
+            paths.extend(sorted(glob.glob(os.path.join(self.data_dir, 'guild_*.db'))))
+        return paths
+
+    async def _start(self, data: GuildData):
+        for hook in self.on_create:
+            hook(data)
+        await data.db.connect()
+        await data.db.ensure()
+        await data.leaderboard.attach(data.db)
+        data.players.attach(data.db)
+        for hook in self.on_open:
+            hook(data)
+
+    async def _stop(self, data: GuildData):
+        for hook in self.on_close:
+            await hook(data)
+        await data.db.close()
+
+    async def open_default(self):
+        await self._start(self.default)
+
+    async def get(self, guild_id: Optional[int]) -> GuildData:
+        """The guild's handle, opened if needed and leased to the calling task until it finishes."""
+        if not self.per_guild or guild_id is None:
+            return self.default
+        while True:
+            data = self._open.get(guild_id)
+            if data is not None:
+                self._open.move_to_end(guild_id)
+                break
+            data = self._closing.get(guild_id)
+            if data is not None:
+                if data.closing is None:
+                    # evicted but still leased: take it back instead of opening the file twice
+                    del self._closing[guild_id]
+                    self._open[guild_id] = data
+                    self._evict()
+                    break
+                await asyncio.shield(data.closing)
+                continue
+            task = self._opening.get(guild_id)
+            if task is None:
+                task = self._opening[guild_id] = asyncio.ensure_future(self._open_guild(guild_id))
+            try:
+                await asyncio.shield(task)
+            finally:
+                self._opening.pop(guild_id, None)
+            # look again: it may have been evicted while this task waited
+        self._lease(data)
+        return data
+
+    async def _open_guild(self, guild_id: int) -> GuildData:
+        os.makedirs(self.data_dir, exist_ok=True)
+        data = GuildData(guild_id, DB(self.path_for(guild_id)))
+        await self._start(data)
+        logging.info('Opened guild database %s', data.db.path)
+        self._open[guild_id] = data
+        self._evict()
+        return data
+
+    def _lease(self, data: GuildData):
+        task = asyncio.current_task()
+        if task is None or task in data.holders:
+            return
+        data.holders.add(task)
+        task.add_done_callback(lambda t: self._release(data, t))
+
+    def _release(self, data: GuildData, task: asyncio.Task):
+        data.holders.discard(task)
+        if not data.holders and self._closing.get(data.guild_id) is data and data.closing is None:
+            data.closing = asyncio.ensure_future(self._close(data))
+
+    def _evict(self):
+        while len(self._open) > self.capacity:
+            guild_id, data = self._open.popitem(last=False)
+            self._closing[guild_id] = data
+            if not data.holders:
+                data.closing = asyncio.ensure_future(self._close(data))
+
+    async def _close(self, data: GuildData):
+        try:
+            await self._stop(data)
+            logging.info('Closed idle guild database %s', data.db.path)
+        finally:
+            if self._closing.get(data.guild_id) is data:
+                del self._closing[data.guild_id]
+
+    async def close(self):
+        for task in list(self._opening.values()):
+            task.cancel()
+        handles = list(self._open.values()) + [d for d in self._closing.values() if d.closing is None]
+        closing = [d.closing for d in self._closing.values() if d.closing is not None]
+        self._open.clear()
+        self._closing.clear()
+        for data in handles:
+            await self._stop(data)
+        await asyncio.gather(*closing, return_exceptions=True)
+        await self._stop(self.default)
@@ -0,0 +1,97 @@
+"""GuildStore: per-guild databases opened lazily, evicted and reopened.
+
+Each get() runs in its own task, as a command would. A handle evicted
+while a command still holds it must stay usable until that command ends;
+a get() during the close must wait for it instead of opening the file a
+second time.
+
+usage: python guilds_test.py
+"""
+import asyncio
+import shutil
+import tempfile
+
+from guilds import GuildStore
+
+async def command(store: GuildStore, guild_id: int, hold: asyncio.Event = None):
+    """get() from a task of its own; with ``hold`` the task (and its lease) lasts until the event is set."""
+    async def run():
+        g = await store.get(guild_id)
+        if hold is not None:
+            await hold.wait()
+        return g
+    task = asyncio.ensure_future(run())
+    await asyncio.sleep(0)
+    return task
+
+async def closed(store: GuildStore, guild_id: int):
+    for _ in range(100):
+        if guild_id not in store._closing:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError(f'guild {guild_id} was never closed')
+
+async def open_evict_reopen(store: GuildStore):
+    first = await (await command(store, 1))
+    await first.db.record_match(['1'], ['2'], 'A')
+    await (await command(store, 2))
+    await closed(store, 1)
+    assert not first.db.pooled and list(store._open) == [2]
+    again = await (await command(store, 1))
+    assert again is not first and again.db.pooled
+    assert (await again.db.table_counts())['matches'] == 1
+    assert again.leaderboard.mmr_of('1') is not None
+
+async def evicted_while_in_use(store: GuildStore):
+    hold = asyncio.Event()
+    busy = await command(store, 1, hold)
+    await asyncio.sleep(0.01)
+    g = store._open[1]
+    await (await command(store, 2))
+    await asyncio.sleep(0.05)
+    assert 1 in store._closing and g.db.pooled, 'closed under a running command'
+    # writes still go through the group-commit writer
+    assert g.db._writer_task is not None
+    await g.db.record_match(['3'], ['4'], 'B')
+    # requested again before the command ends: the same handle comes back
+    assert await (await command(store, 1)) is g and 1 in store._open
+    await (await command(store, 2))
+    hold.set()
+    assert await busy is g
+    await closed(store, 1)
+    assert not g.db.pooled
+
+async def get_while_closing(store: GuildStore, events: list):
+    await (await command(store, 1))
+    await (await command(store, 2))
+    # guild 1 is closing now (the on_close hook is slow); a get() must wait for it
+    await asyncio.sleep(0.01)
+    assert store._closing[1].closing is not None
+    g = await (await command(store, 1))
+    assert g.db.pooled
+    starts = [i for i, e in enumerate(events) if e[0] == 'open' and e[1] == 1]
+    ends = [i for i, e in enumerate(events) if e[0] == 'closed' and e[1] == 1]
+    assert ends[-1] < starts[-1], events
+
+async def main():
+    data_dir = tempfile.mkdtemp()
+    events = []
+    store = GuildStore(default_path=f'{data_dir}/default.db', data_dir=data_dir, per_guild=True, capacity=1)
+
+    async def slow_close(data):
+        await asyncio.sleep(0.1)
+        events.append(('closed', data.guild_id))
+    store.on_create.append(lambda data: events.append(('open', data.guild_id)))
+    store.on_close.append(slow_close)
+    await store.open_default()
+    try:
+        await open_evict_reopen(store)
+        await evicted_while_in_use(store)
+        await get_while_closing(store, events)
+        print('OK')
+    finally:
+        await store.close()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    asyncio.run(main())
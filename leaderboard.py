@@ -0,0 +1,80 @@
+from typing import Dict, List, Optional
+
+from sortedcontainers import SortedList
+
+from db import DB
+
+class Leaderboard:
+    """In-memory ranking kept in sync with the ``players`` table.
+
+    Entries are ordered by (-mmr, discord_id) in a SortedList, so top-N,
+    rank lookups and "players around X" are O(log n) (plus the slice length)
+    and never touch SQLite. ``attach()`` loads the table once and subscribes
+    to DB change notifications to apply every later update incrementally.
+    """
+
+    def __init__(self, use_regular: bool = False):
+        self.col = 'mmr_regular' if use_regular else 'mmr_general'
+        self._order = SortedList()
+        self._players: Dict[str, dict] = {}
+        self.loaded = False
+        # bumped on every change so callers can cache rendered views
+        self.version = 0
+
+    async def attach(self, db: DB):
+        self.load(await db.list_players())
+        db.subscribe(self.update)
+
+    def load(self, rows: List[dict]):
+        self._players = {}
+        self._order = SortedList()
+        self.update(rows)
+        self.loaded = True
+
+    def update(self, rows: List[dict]):
+        for row in rows:
+            pid = row['discord_id']
+            old = self._players.get(pid)
+            if old is not None:
+                self._order.remove((-(old[self.col] or 0), pid))
+            self._players[pid] = row
+            self._order.add((-(row[self.col] or 0), pid))
+        if rows:
+            self.version += 1
+
+    def __len__(self):
+        return len(self._order)
+
+    def _entry(self, pid: str) -> dict:
+        # same shape as DB.list_top_players
+        p = self._players[pid]
+        return {'discord_id': pid, 'name': p['name'], 'mmr': p[self.col], 'games_played': p['games_played'], 'wins': p['wins'], 'losses': p['losses'], 'max_mmr': p['max_mmr']}
+
+    def top(self, limit: int = 10, offset: int = 0) -> List[dict]:
+        return [self._entry(pid) for _, pid in self._order.islice(offset, offset + limit)]
+
+    def page(self, page: int, per_page: int = 10) -> List[dict]:
+        """1-based page of the ranking."""
+        return self.top(per_page, (max(page, 1) - 1) * per_page)
+
+    def page_count(self, per_page: int = 10) -> int:
+        return max(1, -(-len(self._order) // per_page))
+
+    def mmr_of(self, discord_id: str) -> Optional[int]:
+        p = self._players.get(discord_id)
+        return None if p is None else p[self.col]
+
+    def rank_of(self, discord_id: str) -> Optional[int]:
+        """1-based rank of a player, or None if unknown."""
+        p = self._players.get(discord_id)
+        if p is None:
+            return None
+        return self._order.index((-(p[self.col] or 0), discord_id)) + 1
+
+    def around(self, discord_id: str, radius: int = 2) -> List[dict]:
+        """The player plus up to ``radius`` neighbours above and below."""
+        rank = self.rank_of(discord_id)
+        if rank is None:
+            return []
+        start = max(0, rank - 1 - radius)
+        return self.top(rank + radius - start, start)
@@ -1,46 +1,83 @@
-﻿
-const express = require(''express'');
-
-const cors = require(''cors'');
+const express = require('express');
+const cors = require('cors');
 
 const app = express();
-
 const port = process.env.PORT || 8080;
-
-const matches = [];
+// source:match_id (or idempotency key) -> latest payload for that match
+const matches = new Map();
+// idempotency keys already applied, so retried deliveries are applied once
+const seenKeys = new Set();
+const MAX_BATCH = 500;
+let anonymous = 0;
 
 app.use(cors());
-
-app.use(express.json());
-
-app.options(''/saveMatch'', (req, res) => {
-
+app.use(express.json({ limit: '5mb' }));
+
+// op: 'record' (default) or 'update' store the payload, 'delete' removes the match.
+// Per match only the highest revision wins, so a retried older entry that
+// arrives after a newer one (or after the delete) is acknowledged but ignored.
+function storeMatch(matchData, key) {
+  if (key && seenKeys.has(key)) {
+    return { key, status: 'duplicate' };
+  }
+  if (key) {
+    seenKeys.add(key);
+  }
+  const id = matchData.match_id != null ? `${matchData.source || ''}:${matchData.match_id}` : key || `anonymous:${anonymous++}`;
+  const current = matches.get(id);
+  if (current && (current.revision || 0) > (matchData.revision || 0)) {
+    return { key, status: 'stored' };
+  }
+  matches.set(id, matchData);
+  return { key, status: 'stored' };
+}
+
+function storedCount() {
+  let count = 0;
+  for (const m of matches.values()) {
+    if (m.op !== 'delete') count += 1;
+  }
+  return count;
+}
+
+app.options('/saveMatch', (req, res) => {
   res.set({
-
-    ''Access-Control-Allow-Origin'': ''*'',
-
-    ''Access-Control-Allow-Methods'': ''POST, OPTIONS'',
-
-    ''Access-Control-Allow-Headers'': ''Content-Type'',
-
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, Idempotency-Key',
   });
-
   res.status(204).send();
-
 });
 
-app.post(''/saveMatch'', (req, res) => {
-
+app.post('/saveMatch', (req, res) => {
   const matchData = req.body;
+  console.log('Received match data:', JSON.stringify(matchData, null, 2));
+  const result = storeMatch(matchData, req.get('Idempotency-Key') || matchData.idempotency_key);
+  res.set({ 'Access-Control-Allow-Origin': '*' });
+  res.status(200).json({ ok: true, status: result.status, stored: matchData, count: storedCount() });
+});
 
-  console.log(''Received match data:'', JSON.stringify(matchData, null, 2));
-
-  matches.push(matchData);
-
-  res.set({''Access-Control-Allow-Origin'': ''*''});
-
-  res.status(200).json({ ok: true, stored: matchData, count: matches.length });
-
+// Batch delivery from the bot's outbox: { matches: [{ idempotency_key, op, match_id, revision, ... }, ...] }
+// Every item gets a result; duplicates (already stored keys) count as delivered.
+app.post('/saveMatches', (req, res) => {
+  const batch = req.body && req.body.matches;
+  if (!Array.isArray(batch)) {
+    res.status(400).json({ ok: false, error: 'body must be { matches: [...] }' });
+    return;
+  }
+  if (batch.length > MAX_BATCH) {
+    res.status(413).json({ ok: false, error: `at most ${MAX_BATCH} matches per request` });
+    return;
+  }
+  const results = batch.map((matchData) => {
+    if (!matchData || typeof matchData !== 'object' || !matchData.idempotency_key) {
+      return { key: matchData && matchData.idempotency_key, status: 'error', error: 'idempotency_key required' };
+    }
+    return storeMatch(matchData, matchData.idempotency_key);
+  });
+  const stored = results.filter((r) => r.status === 'stored').length;
+  console.log(`Received batch of ${batch.length} matches (${stored} new)`);
+  res.status(200).json({ ok: true, results, count: storedCount() });
 });
 
 app.listen(port, () => console.log(`Server listening on port ${port}`));
@@ -0,0 +1,93 @@
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from balancer import balance_players
+
+QUEUE_SIZE = 10
+
+class MatchQueue:
+    """Players waiting in one channel, in join order, with their current rating (see QueueManager.track)."""
+
+    __slots__ = ('key', 'size', 'entries')
+
+    def __init__(self, key: Hashable, size: int = QUEUE_SIZE):
+        self.key = key
+        self.size = size
+        # dicts keep insertion order, so this is an O(1) join/leave FIFO
+        self.entries: Dict[str, int] = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, discord_id: str):
+        return discord_id in self.entries
+
+class QueueManager:
+    """All open queues, keyed by (guild_id, channel_id).
+
+    Every operation is synchronous and O(1) (a pop is O(size)), so on the
+    asyncio loop each join/leave/pop is atomic without locks. A player can
+    wait in only one queue at a time.
+    """
+
+    def __init__(self, size: int = QUEUE_SIZE):
+        self.size = size
+        self.queues: Dict[Hashable, MatchQueue] = {}
+        self._where: Dict[str, Hashable] = {}
+
+    def get(self, key: Hashable) -> Optional[MatchQueue]:
+        return self.queues.get(key)
+
+    def queue_of(self, discord_id: str) -> Optional[Hashable]:
+        return self._where.get(discord_id)
+
+    def join(self, key: Hashable, discord_id: str, mmr: int) -> MatchQueue:
+        """Add a player with their prefetched rating. Raises ValueError if they're already queued."""
+        if discord_id in self._where:
+            raise ValueError('already queued')
+        q = self.queues.get(key)
+        if q is None:
+            q = self.queues[key] = MatchQueue(key, self.size)
+        q.entries[discord_id] = mmr
+        self._where[discord_id] = key
+        return q
+
+    def leave(self, discord_id: str) -> Optional[Hashable]:
+        """Remove a player from whatever queue they are in; returns that queue's key."""
+        key = self._where.pop(discord_id, None)
+        if key is None:
+            return None
+        q = self.queues[key]
+        del q.entries[discord_id]
+        if not q.entries:
+            del self.queues[key]
+        return key
+
+    def pop_ready(self, key: Hashable) -> Optional[List[Tuple[str, int]]]:
+        """Take the first ``size`` players out of a full queue, or None if it isn't full."""
+        q = self.queues.get(key)
+        if q is None or len(q) < q.size:
+            return None
+        popped = []
+        for discord_id in list(q.entries)[:q.size]:
+            popped.append((discord_id, q.entries.pop(discord_id)))
+            del self._where[discord_id]
+        if not q.entries:
+            del self.queues[key]
+        return popped
+
+    def update(self, rows: List[dict], guild_id: Optional[int] = None):
+        """Take new ratings from changed player rows, optionally for one guild's queues only."""
+        for row in rows:
+            key = self._where.get(row['discord_id'])
+            if key is not None and (guild_id is None or key[0] == guild_id):
+                self.queues[key].entries[row['discord_id']] = row['mmr_general']
+
+    def track(self, db, guild_id: Optional[int] = None):
+        """Keep queued ratings current from ``db``'s change notifications (matches, corrections, season resets)."""
+        db.subscribe(lambda rows: self.update(rows, guild_id))
+
+def balance_popped(popped: List[Tuple[str, int]], top_k: int = 1):
+    """Balanced split of a popped lobby from the queued ratings (no DB reads)."""
+    ids = [pid for pid, _ in popped]
+    mmrs = [mmr for _, mmr in popped]
+    return balance_players(ids, mmrs, top_k=top_k)
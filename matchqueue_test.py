@@ -0,0 +1,77 @@
+"""Matchmaking queue: join through the player cache, re-rating while queued, pop and balance.
+
+Joining must not create player rows; a match recorded by a queued player
+must change the rating the pop balances with.
+
+usage: python matchqueue_test.py
+"""
+import asyncio
+import os
+import tempfile
+
+from balancer import balance_teams
+from db import DB
+from matchqueue import QueueManager, balance_popped
+from playercache import PlayerCache
+from rating import DEFAULT_MMR
+
+KEY = (1, 100)
+
+async def main():
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    db = DB(path)
+    await db.connect()
+    await db.ensure()
+    try:
+        for i in range(1, 7):
+            await db.upsert_player(str(i), f'p{i}', regular=1000 + 100 * i, general=1000 + 100 * i)
+        players = PlayerCache()
+        players.attach(db)
+        queues = QueueManager()
+        queues.track(db, guild_id=1)
+        other = queues.join((2, 200), '12', 1234)
+
+        # join: ratings read through the cache, new players at DEFAULT_MMR, nothing written
+        for i in range(1, 10):
+            pid = str(i)
+            queues.join(KEY, pid, (await players.mmrs([pid]))[0])
+        q = queues.get(KEY)
+        assert list(q.entries.values()) == [1100, 1200, 1300, 1400, 1500, 1600] + [DEFAULT_MMR] * 3
+        assert (await db.table_counts())['players'] == 6, 'joining created players'
+        try:
+            queues.join((1, 101), '1', 1100)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('a player joined two queues')
+        assert queues.pop_ready(KEY) is None
+
+        # a match recorded while queued re-rates the player (only in this guild's queues)
+        await db.record_match(['6'], ['12'], 'B')
+        now = (await db.get_player('6'))['mmr_general']
+        assert now < 1600 and q.entries['6'] == now, q.entries
+        assert other.entries['12'] == 1234
+
+        assert queues.leave('9') == KEY and '9' not in q
+        for pid in ('9', '10'):
+            queues.join(KEY, pid, (await players.mmrs([pid]))[0])
+        popped = queues.pop_ready(KEY)
+        assert [pid for pid, _ in popped] == [str(i) for i in range(1, 11)]
+        assert queues.get(KEY) is None and queues.queue_of('1') is None
+
+        # pop: balanced on the current ratings
+        results = balance_popped(popped)
+        team_a, team_b, split = results[0]
+        assert len(team_a) == len(team_b) == 5 and sorted(team_a + team_b, key=int) == [pid for pid, _ in popped]
+        assert split.gap == balance_teams([mmr for _, mmr in popped], top_k=1)[0].gap
+        assert dict(popped)['6'] == now
+        print('OK')
+    finally:
+        await db.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+if __name__ == '__main__':
+    asyncio.run(main())
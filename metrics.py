@@ -0,0 +1,171 @@
+import asyncio
+import bisect
+import functools
+import inspect
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+# Prometheus-style cumulative bucket bounds, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# recent samples kept per series for percentiles
+WINDOW = 1024
+LOOP_LAG_INTERVAL = 0.5
+
+class LatencyStats:
+    """Counters, fixed buckets and a rolling window of recent samples for one series."""
+
+    __slots__ = ('count', 'errors', 'total', 'buckets', 'recent')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)  # last slot is +Inf
+        self.recent = deque(maxlen=WINDOW)
+
+    def observe(self, seconds: float, error: bool = False):
+        self.count += 1
+        self.total += seconds
+        if error:
+            self.errors += 1
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.recent.append(seconds)
+
+    def percentiles(self, *ps: float) -> List[float]:
+        values = sorted(self.recent)
+        if not values:
+            return [0.0 for _ in ps]
+        return [values[min(len(values) - 1, int(p * len(values)))] for p in ps]
+
+class Metrics:
+    """In-memory registry of latency series (``kind`` + ``name``) and gauges."""
+
+    def __init__(self):
+        self.series: Dict[tuple, LatencyStats] = {}
+        self.gauges: Dict[str, float] = {}
+
+    def observe(self, kind: str, name: str, seconds: float, error: bool = False):
+        stats = self.series.get((kind, name))
+        if stats is None:
+            stats = self.series[(kind, name)] = LatencyStats()
+        stats.observe(seconds, error)
+
+    def set_gauge(self, name: str, value: float):
+        self.gauges[name] = value
+
+    @contextmanager
+    def timer(self, kind: str, name: str):
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.observe(kind, name, time.perf_counter() - start, error)
+
+    def wrap(self, kind: str, name: str, func):
+        """Wrap a coroutine function so every call is timed under (kind, name)."""
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with self.timer(kind, name):
+                return await func(*args, **kwargs)
+        return wrapper
+
+    def summary_lines(self, kind: Optional[str] = None, limit: int = 10) -> List[str]:
+        """Human-readable per-series lines, slowest p95 first."""
+        rows = []
+        for (k, name), stats in self.series.items():
+            if kind is not None and k != kind:
+                continue
+            p50, p95, p99 = stats.percentiles(0.5, 0.95, 0.99)
+            rows.append((p95, f'{k}/{name}: n={stats.count} err={stats.errors} p50={p50*1000:.1f}ms p95={p95*1000:.1f}ms p99={p99*1000:.1f}ms'))
+        rows.sort(reverse=True)
+        return [line for _, line in rows[:limit]]
+
+    def render_prometheus(self) -> str:
+        out = [
+            '# TYPE mmr_bot_latency_seconds histogram',
+        ]
+        for (kind, name), stats in sorted(self.series.items()):
+            labels = f'kind="{kind}",name="{_escape(name)}"'
+            cumulative = 0
+            for bound, count in zip(BUCKETS, stats.buckets):
+                cumulative += count
+                out.append(f'mmr_bot_latency_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            out.append(f'mmr_bot_latency_seconds_bucket{{{labels},le="+Inf"}} {stats.count}')
+            out.append(f'mmr_bot_latency_seconds_sum{{{labels}}} {stats.total}')
+            out.append(f'mmr_bot_latency_seconds_count{{{labels}}} {stats.count}')
+        out.append('# TYPE mmr_bot_errors_total counter')
+        for (kind, name), stats in sorted(self.series.items()):
+            out.append(f'mmr_bot_errors_total{{kind="{kind}",name="{_escape(name)}"}} {stats.errors}')
+        for name, value in sorted(self.gauges.items()):
+            out.append(f'# TYPE mmr_bot_{name} gauge')
+            out.append(f'mmr_bot_{name} {value}')
+        return '\n'.join(out) + '\n'
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+metrics = Metrics()
+
+def instrument_db(db, registry: Metrics = metrics):
+    """Time every public coroutine method of a DB instance under kind 'db'."""
+    for name, member in inspect.getmembers(type(db), inspect.iscoroutinefunction):
+        if name.startswith('_') or name in ('connect', 'close'):
+            continue
+        setattr(db, name, registry.wrap('db', name, getattr(db, name)))
+
+def instrument_commands(bot, registry: Metrics = metrics):
+    """Time every slash and prefix command callback under kind 'command'.
+
+    Replaces the stored callback directly so discord.py doesn't re-parse the
+    (already registered) parameter signature.
+    """
+    for cmd in bot.tree.walk_commands():
+        if hasattr(cmd, '_callback'):
+            cmd._callback = registry.wrap('command', f'/{cmd.qualified_name}', cmd._callback)
+    for cmd in bot.walk_commands():
+        cmd._callback = registry.wrap('command', f'!{cmd.qualified_name}', cmd._callback)
+
+def instrument_http(bot, registry: Metrics = metrics):
+    """Time Discord REST round trips per route template (e.g. POST /channels/{channel_id}/messages)."""
+    request = bot.http.request
+
+    @functools.wraps(request)
+    async def timed_request(route, **kwargs):
+        with registry.timer('discord_http', f'{route.method} {route.path}'):
+            return await request(route, **kwargs)
+
+    bot.http.request = timed_request
+
+async def monitor_event_loop(bot=None, registry: Metrics = metrics, interval: float = LOOP_LAG_INTERVAL):
+    """Sample event-loop lag (how late a sleep wakes up) and the gateway heartbeat latency."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        registry.observe('loop', 'lag', lag)
+        registry.set_gauge('event_loop_lag_seconds', lag)
+        if bot is not None and bot.latency == bot.latency:  # NaN before the first heartbeat
+            registry.set_gauge('gateway_latency_seconds', bot.latency)
+
+async def start_http_endpoint(port: int, host: str = '127.0.0.1', registry: Metrics = metrics):
+    """Serve ``GET /metrics`` in Prometheus text format on a local port. Returns the aiohttp runner."""
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=registry.render_prometheus(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info('Metrics endpoint listening on http://%s:%d/metrics', host, port)
+    return runner
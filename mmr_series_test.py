@@ -0,0 +1,65 @@
+"""mmr_series: one OHLC point per hour/day/week bucket of a player's games.
+
+Match timestamps are set by hand so buckets and the ``days`` window are
+deterministic; imported matches without replayed ratings are skipped.
+
+usage: python mmr_series_test.py
+"""
+import asyncio
+import os
+import tempfile
+
+from db import DB
+
+async def main():
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    db = DB(path)
+    await db.connect()
+    await db.ensure()
+    try:
+        # 2026-01-05 is a Monday
+        stamps = ['2026-01-05 10:15:00', '2026-01-05 10:45:00', '2026-01-05 18:00:00', '2026-01-07 09:00:00', '2026-01-12 09:00:00']
+        for i, ts in enumerate(stamps):
+            match_id = await db.record_match(['1'], ['2'], 'BABAA'[i])
+            async with db._write() as conn:
+                await conn.execute('UPDATE matches SET ts = ? WHERE id = ?', (ts, match_id))
+        history = list(reversed(await db.player_history('1')))
+        ratings = [(h['mmr_before'], h['mmr_after']) for h in history]
+
+        def point(ts, first, last):
+            afters = [a for _, a in ratings[first:last + 1]]
+            return {'ts': ts, 'match_id': last + 1, 'open': ratings[first][0], 'close': afters[-1],
+                    'low': min(afters + [ratings[first][0]]), 'high': max(afters + [ratings[first][0]]), 'games': last - first + 1}
+
+        assert await db.mmr_series('1', resolution='hour') == [
+            point('2026-01-05 10:00:00', 0, 1), point('2026-01-05 18:00:00', 2, 2), point('2026-01-07 09:00:00', 3, 3), point('2026-01-12 09:00:00', 4, 4)]
+        assert await db.mmr_series('1') == [point('2026-01-05', 0, 2), point('2026-01-07', 3, 3), point('2026-01-12', 4, 4)]
+        assert await db.mmr_series('1', resolution='week') == [point('2026-01-05', 0, 3), point('2026-01-12', 4, 4)]
+        assert ratings[0][1] < ratings[0][0] and (await db.mmr_series('1'))[0]['low'] == min(a for _, a in ratings[:3])
+
+        # the window counts back from now; matches this old are outside a 30-day window
+        assert await db.mmr_series('1', days=30) == []
+        match_id = await db.record_match(['1'], ['3'], 'A')
+        recent = await db.mmr_series('1', days=30)
+        assert len(recent) == 1 and recent[0]['match_id'] == match_id and recent[0]['games'] == 1
+
+        # backfilled matches carry no ratings and are skipped
+        await db.import_matches([{'team_a': ['1'], 'team_b': ['2'], 'winner': 'A', 'ts': '2026-01-12 10:00:00'}])
+        assert (await db.mmr_series('1'))[-2] == point('2026-01-12', 4, 4)
+        assert await db.mmr_series('nobody') == []
+        try:
+            await db.mmr_series('1', resolution='month')
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('an unknown resolution was accepted')
+        print('OK')
+    finally:
+        await db.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+import discord
+
+# Resolved names are trusted this long before asking Discord again
+NAME_TTL = 3600.0
+NAME_CACHE_SIZE = 20000
+# request_guild_members accepts at most 100 user ids per request
+MEMBER_QUERY_CHUNK = 100
+
+class NameResolver:
+    """id -> display name lookups for ranking/history rendering, batched and cached.
+
+    Per call, every id is answered from (in order) the TTL/LRU cache, the
+    gateway member/user cache, then a chunked gateway member query for the
+    rest (100 ids per request, never one REST call per row). Ids already
+    being queried by a concurrent call are awaited rather than re-requested.
+    Ids that can't be resolved (e.g. the member left) keep their stored
+    name and are cached too, so they aren't queried on every render.
+    """
+
+    def __init__(self, ttl: float = NAME_TTL, capacity: int = NAME_CACHE_SIZE):
+        self.ttl = ttl
+        self.capacity = capacity
+        self._cache: 'OrderedDict[Tuple[Optional[int], str], Tuple[str, float]]' = OrderedDict()
+        self._inflight: Dict[Tuple[Optional[int], str], asyncio.Future] = {}
+
+    def _get(self, key) -> Optional[str]:
+        hit = self._cache.get(key)
+        if hit is None:
+            return None
+        name, expires = hit
+        if expires < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return name
+
+    def _put(self, key, name: str):
+        self._cache[key] = (name, time.monotonic() + self.ttl)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+
+    async def resolve(self, client: discord.Client, guild: Optional[discord.Guild], discord_ids: Iterable[str],
+                      stored: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        """Display names for ``discord_ids``; ``stored`` (id -> players.name) is the fallback."""
+        stored = stored or {}
+        guild_id = guild.id if guild else None
+        names: Dict[str, str] = {}
+        missing = []
+        waiting = []
+        for pid in dict.fromkeys(discord_ids):
+            key = (guild_id, pid)
+            name = self._get(key)
+            if name is None:
+                name = _from_gateway_cache(client, guild, pid)
+                if name is not None:
+                    self._put(key, name)
+            if name is not None:
+                names[pid] = name
+            elif key in self._inflight:
+                waiting.append((pid, self._inflight[key]))
+            else:
+                missing.append(pid)
+
+        if missing:
+            loop = asyncio.get_running_loop()
+            futures = {pid: loop.create_future() for pid in missing}
+            for pid, fut in futures.items():
+                self._inflight[(guild_id, pid)] = fut
+            try:
+                found = await self._query(guild, missing)
+                for pid in missing:
+                    name = found.get(pid) or stored.get(pid) or pid
+                    self._put((guild_id, pid), name)
+                    names[pid] = name
+                    futures[pid].set_result(name)
+            finally:
+                for pid, fut in futures.items():
+                    self._inflight.pop((guild_id, pid), None)
+                    if not fut.done():
+                        fut.set_result(stored.get(pid) or pid)
+        for pid, fut in waiting:
+            names[pid] = await fut
+        return names
+
+    async def _query(self, guild: Optional[discord.Guild], discord_ids) -> Dict[str, str]:
+        found: Dict[str, str] = {}
+        if guild is None:
+            return found
+        ids = [int(pid) for pid in discord_ids if pid.isdigit()]
+        for start in range(0, len(ids), MEMBER_QUERY_CHUNK):
+            chunk = ids[start:start + MEMBER_QUERY_CHUNK]
+            try:
+                members = await guild.query_members(user_ids=chunk, limit=len(chunk), cache=False)
+            except (asyncio.TimeoutError, discord.ClientException) as e:
+                logging.warning('Member query for %d ids in guild %s failed: %s', len(chunk), guild.id, e)
+                continue
+            for m in members:
+                found[str(m.id)] = m.display_name
+        return found
+
+    async def resolve_and_store(self, client: discord.Client, guild: Optional[discord.Guild], db, rows: Iterable[dict]) -> Dict[str, str]:
+        """Resolve names for player rows (with ``discord_id``/``name``) and bulk-write changed ones back to ``players.name``."""
+        stored = {r['discord_id']: r.get('name') for r in rows}
+        names = await self.resolve(client, guild, stored, stored)
+        changed = {pid: name for pid, name in names.items() if name != pid and name != stored.get(pid)}
+        if changed:
+            await db.set_player_names(changed)
+        return names
+
+def _from_gateway_cache(client: discord.Client, guild: Optional[discord.Guild], pid: str) -> Optional[str]:
+    if not pid.isdigit():
+        return None
+    if guild is not None:
+        member = guild.get_member(int(pid))
+        if member is not None:
+            return member.display_name
+        return None
+    user = client.get_user(int(pid))
+    return user.display_name if user is not None else None
+
+resolver = NameResolver()
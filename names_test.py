@@ -0,0 +1,99 @@
+"""NameResolver: gateway cache first, chunked member queries for the rest, TTL/LRU caching.
+
+The guild and client are fakes that count member queries, so nothing
+reaches Discord.
+
+usage: python names_test.py
+"""
+import asyncio
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+import names
+from db import DB
+from names import MEMBER_QUERY_CHUNK, NameResolver
+
+class FakeGuild:
+    """``cached`` members are in the gateway cache; ``remote`` ones only come back from query_members."""
+
+    def __init__(self, cached, remote, delay: float = 0.0):
+        self.id = 1
+        self.cached = cached
+        self.remote = remote
+        self.delay = delay
+        self.queries = []
+
+    def get_member(self, user_id: int):
+        name = self.cached.get(user_id)
+        return SimpleNamespace(id=user_id, display_name=name) if name else None
+
+    async def query_members(self, user_ids, limit, cache):
+        assert len(user_ids) <= MEMBER_QUERY_CHUNK and not cache
+        self.queries.append(list(user_ids))
+        await asyncio.sleep(self.delay)
+        return [SimpleNamespace(id=i, display_name=self.remote[i]) for i in user_ids if i in self.remote]
+
+async def main():
+    client = SimpleNamespace(get_user=lambda user_id: None)
+    guild = FakeGuild({1: 'cached'}, {i: f'user{i}' for i in range(2, 300)} | {2: 'remote'})
+    r = NameResolver()
+
+    # gateway cache, then one query per 100 ids; unresolved ids keep their stored name (or the id)
+    ids = [str(i) for i in range(1, 251)] + ['400', 'guest']
+    got = await r.resolve(client, guild, ids, stored={'400': 'left', '2': 'old'})
+    assert got['1'] == 'cached' and got['2'] == 'remote' and got['250'] == 'user250'
+    assert got['400'] == 'left' and got['guest'] == 'guest'
+    assert [len(q) for q in guild.queries] == [100, 100, 50], 'non-numeric ids are never queried'
+
+    # everything is cached now, including the ids that couldn't be resolved
+    guild.queries.clear()
+    assert await r.resolve(client, guild, ids) == got and guild.queries == []
+
+    # concurrent calls for the same ids share one query
+    guild.delay = 0.05
+    fresh = [str(i) for i in range(260, 270)]
+    first, second = await asyncio.gather(r.resolve(client, guild, fresh), r.resolve(client, guild, fresh + ['1']))
+    assert len(guild.queries) == 1 and first == {pid: f'user{pid}' for pid in fresh} and second['1'] == 'cached'
+
+    # entries expire after the TTL; the LRU keeps at most ``capacity``
+    short = NameResolver(ttl=0.05, capacity=3)
+    guild.queries.clear()
+    guild.delay = 0.0
+    await short.resolve(client, guild, ['2'])
+    await short.resolve(client, guild, ['2'])
+    assert len(guild.queries) == 1
+    time.sleep(0.06)
+    await short.resolve(client, guild, ['2'])
+    assert len(guild.queries) == 2
+    await short.resolve(client, guild, ['3', '4', '5'])
+    assert len(short._cache) == 3 and (1, '2') not in short._cache
+
+    # no guild (DMs): the client's user cache only, nothing to query
+    dm_client = SimpleNamespace(get_user=lambda user_id: SimpleNamespace(display_name='dm') if user_id == 7 else None)
+    assert await NameResolver().resolve(dm_client, None, ['7', '8'], {'8': 'stored'}) == {'7': 'dm', '8': 'stored'}
+
+    # resolve_and_store writes back only names that changed
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    db = DB(path)
+    await db.connect()
+    await db.ensure()
+    try:
+        await db.upsert_player('2', 'old')
+        await db.upsert_player('3', 'user3')
+        await db.upsert_player('999', '999')
+        rows = await db.list_players()
+        resolved = await names.resolver.resolve_and_store(client, guild, db, rows)
+        assert resolved == {'2': 'remote', '3': 'user3', '999': '999'}
+        assert {p['discord_id']: p['name'] for p in await db.list_players()} == {'2': 'remote', '3': 'user3', '999': '999'}
+        print('OK')
+    finally:
+        await db.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from typing import List, Optional
+
+import aiohttp
+
+from db import DB
+from metrics import metrics
+
+OUTBOX_BATCH_SIZE = 100
+# re-check for due entries at least this often even without a wake-up
+OUTBOX_POLL_INTERVAL = 30.0
+# pause between partial batches so matches recorded close together share a request
+OUTBOX_LINGER = 0.5
+OUTBOX_BASE_BACKOFF = 1.0
+OUTBOX_MAX_BACKOFF = 600.0
+OUTBOX_REQUEST_TIMEOUT = 15.0
+# an entry the API keeps refusing (4xx other than 429, or no result for it) is
+# moved to outbox_failed after this many attempts; transport errors, 429 and
+# 5xx are retried indefinitely
+OUTBOX_MAX_ATTEMPTS = 5
+
+def backoff_delay(attempts: int, base: float = OUTBOX_BASE_BACKOFF, cap: float = OUTBOX_MAX_BACKOFF) -> float:
+    """Exponential backoff (with jitter, capped) for the ``attempts``-th failure (0-based)."""
+    return random.uniform(0.5, 1.0) * min(cap, base * 2 ** attempts)
+
+def new_session() -> aiohttp.ClientSession:
+    """A keep-alive session suitable for sharing between workers."""
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=4, keepalive_timeout=60),
+        timeout=aiohttp.ClientTimeout(total=OUTBOX_REQUEST_TIMEOUT))
+
+class OutboxWorker:
+    """Drains a DB's outbox table to lol-balancer-api's ``POST /saveMatches``.
+
+    Runs as a background task: commands only ever insert outbox rows in
+    their own transaction, and this worker delivers them in batches over
+    one keep-alive aiohttp session. Every item carries its idempotency
+    key, so a batch that is retried after a timeout (but was in fact
+    stored) is acknowledged as a duplicate instead of stored twice.
+    Failed items are retried with capped exponential backoff; items the API
+    rejects (``status: error``) go straight to outbox_failed.
+    """
+
+    def __init__(self, db: DB, base_url: str, batch_size: int = OUTBOX_BATCH_SIZE,
+                 session: Optional[aiohttp.ClientSession] = None):
+        self.db = db
+        self.url = base_url.rstrip('/') + '/saveMatches'
+        self.batch_size = batch_size
+        self._session = session
+        self._owns_session = session is None
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.db.outbox_enabled = True
+        # a committed match (non-empty player changes) means new outbox rows
+        self.db.subscribe(lambda rows: rows and self._wake.set())
+        self._task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            self._session = new_session()
+        return self._session
+
+    async def run(self):
+        while True:
+            try:
+                delivered = await self.drain_once()
+            except Exception:
+                logging.exception('Outbox delivery round failed')
+                delivered = 0
+            if delivered >= self.batch_size:
+                continue  # backlog: keep sending full batches
+            next_due = await self.db.outbox_next_due()
+            timeout = OUTBOX_POLL_INTERVAL if next_due is None else min(OUTBOX_POLL_INTERVAL, max(0.0, next_due - time.time()))
+            self._wake.clear()
+            if timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            # let matches recorded close together share the next request
+            await asyncio.sleep(OUTBOX_LINGER)
+
+    async def drain_once(self) -> int:
+        """Send one batch of due entries; returns how many were acknowledged."""
+        entries = await self.db.outbox_due(self.batch_size)
+        if not entries:
+            metrics.set_gauge('outbox_pending', await self.db.outbox_size())
+            return 0
+        try:
+            with metrics.timer('outbox', 'saveMatches'):
+                results = await self._post([json.loads(e['payload']) for e in entries])
+        except aiohttp.ClientResponseError as e:
+            if 400 <= e.status < 500:
+                # the request itself was refused; retrying it unchanged only helps so often
+                await self._retry(entries, f'HTTP {e.status}: {e.message}', limited=True)
+            else:
+                await self._retry(entries, f'{type(e).__name__}: {e}')
+            return 0
+        except Exception as e:
+            await self._retry(entries, f'{type(e).__name__}: {e}', getattr(e, 'retry_after', 0.0))
+            return 0
+        statuses = {r.get('key'): r for r in results}
+        done = []
+        rejected = []
+        missing = []
+        for e in entries:
+            r = statuses.get(e['idempotency_key'])
+            if r is None:
+                missing.append(e)
+            elif r.get('status') in ('stored', 'duplicate'):
+                done.append(e['id'])
+            else:
+                rejected.append((e['id'], 'rejected: ' + json.dumps(r, ensure_ascii=False)[:500]))
+        if done:
+            await self.db.outbox_delivered(done)
+        if rejected:
+            logging.error('Outbox: %d matches rejected by the API, moved to outbox_failed (%s)', len(rejected), rejected[0][1])
+            await self.db.outbox_fail(rejected)
+        if missing:
+            await self._retry(missing, 'no result in response', limited=True)
+        return len(done)
+
+    async def _post(self, matches: List[dict]) -> List[dict]:
+        async with self._get_session().post(self.url, json={'matches': matches}) as resp:
+            if resp.status == 429 or resp.status >= 500:
+                raise _RetryableStatus(resp.status, resp.headers.get('Retry-After'))
+            resp.raise_for_status()
+            body = await resp.json()
+        return body.get('results', [])
+
+    async def _retry(self, entries: List[dict], error: str, min_delay: float = 0.0, limited: bool = False):
+        """Schedule the next attempt; with ``limited``, entries out of attempts go to outbox_failed instead."""
+        if limited:
+            spent = [e for e in entries if e['attempts'] + 1 >= OUTBOX_MAX_ATTEMPTS]
+            if spent:
+                logging.error('Outbox: %d deliveries failed %d times (%s); moved to outbox_failed', len(spent), OUTBOX_MAX_ATTEMPTS, error)
+                await self.db.outbox_fail([(e['id'], error[:500]) for e in spent])
+                entries = [e for e in entries if e['attempts'] + 1 < OUTBOX_MAX_ATTEMPTS]
+            if not entries:
+                return
+        now = time.time()
+        logging.warning('Outbox: %d deliveries failed (%s); retrying with backoff', len(entries), error)
+        await self.db.outbox_retry_later([(e['id'], now + max(min_delay, backoff_delay(e['attempts'])), error[:500]) for e in entries])
+
+class _RetryableStatus(Exception):
+    def __init__(self, status: int, retry_after: Optional[str]):
+        super().__init__(f'HTTP {status}' + (f' (Retry-After {retry_after})' if retry_after else ''))
+        self.status = status
+        try:
+            self.retry_after = float(retry_after) if retry_after else 0.0
+        except ValueError:  # HTTP-date form; fall back to normal backoff
+            self.retry_after = 0.0
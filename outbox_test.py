@@ -0,0 +1,151 @@
+"""Outbox delivery against a local stand-in for lol-balancer-api.
+
+The stand-in implements POST /saveMatches with the same idempotency
+and revision rules as server.js, but fails the first requests with 503,
+drops the response of one request after storing it and rejects one
+match, so retries, backoff, duplicate handling and dead-lettering are all
+exercised. A second phase corrects, deletes, recomputes and imports
+matches and checks the API ends up holding exactly what the database
+does. A third phase refuses every request with 400 until the entry runs
+out of attempts.
+
+usage: python outbox_test.py
+"""
+import asyncio
+import os
+import tempfile
+
+from aiohttp import web
+
+import outbox
+from db import DB
+from outbox import OutboxWorker
+
+FAIL_FIRST = 2
+MATCHES = 250
+REJECTED_MATCH = 7
+
+class StandIn:
+    def __init__(self):
+        self.stored = {}
+        # match_id -> latest payload by revision (deletes included), as server.js keeps it
+        self.live = {}
+        self.requests = 0
+        self.refuse = False
+
+    async def save_matches(self, request):
+        self.requests += 1
+        if self.requests <= FAIL_FIRST:
+            return web.json_response({'ok': False}, status=503)
+        if self.refuse:
+            return web.json_response({'ok': False, 'error': 'refused'}, status=400)
+        results = []
+        for m in (await request.json())['matches']:
+            key = m['idempotency_key']
+            if m['match_id'] == REJECTED_MATCH and m['op'] == 'record':
+                results.append({'key': key, 'status': 'error', 'error': 'invalid match'})
+                continue
+            if key in self.stored:
+                results.append({'key': key, 'status': 'duplicate'})
+                continue
+            results.append({'key': key, 'status': 'stored'})
+            self.stored[key] = m
+            current = self.live.get(m['match_id'])
+            if current is None or current['revision'] <= m['revision']:
+                self.live[m['match_id']] = m
+        if self.requests == FAIL_FIRST + 1:
+            # stored, but the client only sees a 500: the retry must come back as duplicates
+            raise ConnectionResetError()
+        return web.json_response({'ok': True, 'results': results})
+
+async def drained(db: DB):
+    for _ in range(200):
+        if await db.outbox_size() == 0:
+            return
+        await asyncio.sleep(0.05)
+
+async def assert_in_sync(db: DB, stand_in: StandIn):
+    """The API's live matches are exactly the database's, teams and replayed ratings included."""
+    live = {mid: m for mid, m in stand_in.live.items() if m['op'] != 'delete'}
+    async with db._read() as conn:
+        cur = await conn.execute('SELECT id, team_a, team_b, winner, mmr_delta FROM matches')
+        matches = {r[0]: (r[1].split(','), r[2].split(','), r[3], r[4]) for r in await cur.fetchall()}
+        cur = await conn.execute('SELECT match_id, discord_id, side, mmr_before, mmr_after FROM match_participants')
+        participants = {}
+        for mid, *row in await cur.fetchall():
+            participants.setdefault(mid, set()).add(tuple(row))
+    assert sorted(live) == sorted(matches), sorted(set(live) ^ set(matches))
+    for mid, m in live.items():
+        assert (m['team_a'], m['team_b'], m['winner'], m['mmr_delta']) == matches[mid], (mid, m)
+        assert {(p['discord_id'], p['side'], p['mmr_before'], p['mmr_after']) for p in m['participants']} == participants[mid], mid
+
+async def corrections(db: DB, worker: OutboxWorker, stand_in: StandIn):
+    await db.correct_match(10, ['1', '2'], ['3', '4'], 'B')
+    await db.delete_match(20)
+    await drained(db)
+    assert stand_in.live[20]['op'] == 'delete' and stand_in.live[10]['team_a'] == ['1', '2']
+    await assert_in_sync(db, stand_in)
+    # the replay starts at the checkpoint before match 10, so it resends the rejected match too
+    assert stand_in.live[REJECTED_MATCH]['op'] == 'update'
+
+    await db.recompute_ratings('elo', k=40)
+    await db.import_matches([{'team_a': ['1'], 'team_b': ['2'], 'winner': 'A'}])
+    await db.import_matches([{'team_a': ['3'], 'team_b': ['4'], 'winner': 'B'}], recompute=True)
+    await drained(db)
+    await assert_in_sync(db, stand_in)
+
+    # an older payload retried after a newer one is acknowledged but doesn't win
+    stale = dict(next(m for m in stand_in.stored.values() if m['match_id'] == 30 and m['op'] == 'record'), idempotency_key='stale')
+    assert (await worker._post([stale]))[0]['status'] == 'stored'
+    await assert_in_sync(db, stand_in)
+
+async def main():
+    outbox.OUTBOX_BASE_BACKOFF = 0.05
+    outbox.OUTBOX_LINGER = 0.05
+    outbox.OUTBOX_MAX_ATTEMPTS = 3
+    stand_in = StandIn()
+    app = web.Application()
+    app.router.add_post('/saveMatches', stand_in.save_matches)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    db = DB(path)
+    await db.connect()
+    await db.ensure()
+    worker = OutboxWorker(db, f'http://127.0.0.1:{port}', batch_size=100)
+    worker.start()
+    try:
+        ids = [str(i) for i in range(20)]
+        await asyncio.gather(*[db.record_match(ids[i % 10:i % 10 + 5], ids[10 + i % 5:15 + i % 5], 'AB'[i % 2]) for i in range(MATCHES)])
+        await drained(db)
+        print(f'requests: {stand_in.requests}, stored: {len(stand_in.stored)}, pending: {await db.outbox_size()}, failed: {await db.outbox_failed_count()}')
+        assert len(stand_in.stored) == MATCHES - 1, 'every accepted match delivered exactly once'
+        assert await db.outbox_size() == 0, 'outbox drained'
+        assert await db.outbox_failed_count() == 1, 'the rejected match is dead-lettered, not retried'
+        assert sorted(m['match_id'] for m in stand_in.stored.values()) == [i for i in range(1, MATCHES + 1) if i != REJECTED_MATCH]
+
+        await corrections(db, worker, stand_in)
+        assert await db.outbox_failed_count() == 1
+
+        stand_in.refuse = True
+        requests = stand_in.requests
+        await db.record_match(['1'], ['2'], 'A')
+        await drained(db)
+        assert await db.outbox_failed_count() == 2, 'a refused entry stops after OUTBOX_MAX_ATTEMPTS'
+        assert stand_in.requests - requests == outbox.OUTBOX_MAX_ATTEMPTS
+        print('OK')
+    finally:
+        await worker.stop()
+        await db.close()
+        await runner.cleanup()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+if __name__ == '__main__':
+    asyncio.run(main())
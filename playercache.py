@@ -0,0 +1,154 @@
+import asyncio
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set
+
+from db import DB
+from rating import DEFAULT_MMR
+
+# players kept in memory per database; the least recently used is evicted beyond this
+PLAYER_CACHE_SIZE = 5000
+# results kept per player for "recent form"
+RECENT_FORM_LENGTH = 5
+
+class PlayerRecord:
+    """Compact cached copy of one ``players`` row plus recent form ('W'/'L', newest first)."""
+
+    __slots__ = ('discord_id', 'name', 'mmr_regular', 'mmr_general', 'games_played', 'max_mmr', 'wins', 'losses', 'recent')
+
+    def __init__(self, row: dict, recent: str = ''):
+        self.discord_id = row['discord_id']
+        self.recent = recent
+        self._set(row)
+
+    def _set(self, row: dict):
+        self.name = row['name']
+        self.mmr_regular = row['mmr_regular']
+        self.mmr_general = row['mmr_general']
+        self.games_played = row['games_played']
+        self.max_mmr = row['max_mmr']
+        self.wins = row['wins'] or 0
+        self.losses = row['losses'] or 0
+
+    def apply(self, row: dict, form_length: int) -> bool:
+        """Write a changed row through; False if recent form can't be derived and the record should be dropped."""
+        won = (row['wins'] or 0) - self.wins
+        lost = (row['losses'] or 0) - self.losses
+        if (won, lost) == (1, 0):
+            self.recent = ('W' + self.recent)[:form_length]
+        elif (won, lost) == (0, 1):
+            self.recent = ('L' + self.recent)[:form_length]
+        elif won or lost:
+            # several matches at once, a correction or a season reset
+            return False
+        self._set(row)
+        return True
+
+class PlayerCache:
+    """Read-through LRU cache of player records in front of a DB.
+
+    Misses from one call are loaded together (one ``IN (...)`` query for
+    the rows, one for recent form); ids already being loaded by a concurrent
+    call are awaited rather than queried again. ``attach()`` subscribes to
+    DB change notifications, so record_match/upsert_player/set_player_mmr
+    update cached records in place (or drop them when the change can't be
+    applied incrementally) and hot players never touch SQLite.
+    """
+
+    def __init__(self, capacity: int = PLAYER_CACHE_SIZE, form_length: int = RECENT_FORM_LENGTH):
+        self.capacity = capacity
+        self.form_length = form_length
+        self.db: Optional[DB] = None
+        self._records: 'OrderedDict[str, PlayerRecord]' = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # ids changed while their load was in flight; the loaded copy may predate the change
+        self._stale: Set[str] = set()
+        self.hits = 0
+        self.misses = 0
+
+    def attach(self, db: DB):
+        self.db = db
+        db.subscribe(self.update)
+
+    def __len__(self):
+        return len(self._records)
+
+    def update(self, rows: List[dict]):
+        for row in rows:
+            pid = row['discord_id']
+            rec = self._records.get(pid)
+            if rec is None:
+                if pid in self._inflight:
+                    self._stale.add(pid)
+            elif not rec.apply(row, self.form_length):
+                del self._records[pid]
+
+    def invalidate(self, discord_id: Optional[str] = None):
+        """Drop one player, or everything if ``discord_id`` is None."""
+        if discord_id is None:
+            self._records.clear()
+        else:
+            self._records.pop(discord_id, None)
+
+    def _put(self, rec: PlayerRecord):
+        self._records[rec.discord_id] = rec
+        while len(self._records) > self.capacity:
+            self._records.popitem(last=False)
+
+    def peek(self, discord_id: str) -> Optional[PlayerRecord]:
+        """Cached record without loading (and without touching LRU order)."""
+        return self._records.get(discord_id)
+
+    async def get(self, discord_id: str) -> Optional[PlayerRecord]:
+        rec = self._records.get(discord_id)
+        if rec is not None:
+            self._records.move_to_end(discord_id)
+            self.hits += 1
+            return rec
+        return (await self.get_many([discord_id])).get(discord_id)
+
+    async def mmrs(self, discord_ids: List[str]) -> List[int]:
+        """mmr_general for each id, in order; players without a row count as DEFAULT_MMR and are not created."""
+        records = await self.get_many(discord_ids)
+        return [records[pid].mmr_general if pid in records else DEFAULT_MMR for pid in discord_ids]
+
+    async def get_many(self, discord_ids: Iterable[str]) -> Dict[str, PlayerRecord]:
+        """Records for ``discord_ids``; unknown players are left out."""
+        found: Dict[str, PlayerRecord] = {}
+        missing = []
+        waiting = []
+        for pid in dict.fromkeys(discord_ids):
+            rec = self._records.get(pid)
+            if rec is not None:
+                self._records.move_to_end(pid)
+                self.hits += 1
+                found[pid] = rec
+            elif pid in self._inflight:
+                waiting.append((pid, self._inflight[pid]))
+            else:
+                missing.append(pid)
+
+        if missing:
+            self.misses += len(missing)
+            loop = asyncio.get_running_loop()
+            futures = {pid: loop.create_future() for pid in missing}
+            self._inflight.update(futures)
+            try:
+                rows = await self.db.get_players(missing)
+                forms = await self.db.recent_results(list(rows), self.form_length)
+                for pid, row in rows.items():
+                    rec = PlayerRecord(row, forms.get(pid, ''))
+                    if pid not in self._stale:
+                        self._put(rec)
+                    found[pid] = rec
+                    futures[pid].set_result(rec)
+            finally:
+                for pid, fut in futures.items():
+                    self._inflight.pop(pid, None)
+                    self._stale.discard(pid)
+                    if not fut.done():
+                        fut.set_result(None)
+        for pid, fut in waiting:
+            rec = await fut
+            if rec is not None:
+                found[pid] = rec
+        return found
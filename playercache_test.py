@@ -0,0 +1,83 @@
+"""PlayerCache: hits, misses, write-through on record, invalidation on corrections and LRU eviction.
+
+/내정보 answers from this cache, so a cached record must always match the
+players row it stands for; a change that can't be applied in place must
+drop the record instead.
+
+usage: python playercache_test.py
+"""
+import asyncio
+import os
+import tempfile
+
+from db import DB
+from playercache import PlayerCache
+
+async def same_as_db(db: DB, players: PlayerCache, pid: str):
+    rec = players.peek(pid)
+    row = await db.get_player(pid)
+    assert (rec.mmr_general, rec.games_played, rec.wins, rec.losses, rec.max_mmr) == \
+        (row['mmr_general'], row['games_played'], row['wins'], row['losses'], row['max_mmr']), (pid, row)
+    assert rec.recent == (await db.recent_results([pid], players.form_length)).get(pid, ''), pid
+
+async def main():
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    db = DB(path)
+    await db.connect()
+    await db.ensure()
+    try:
+        for i in range(1, 5):
+            await db.upsert_player(str(i), f'p{i}', regular=1200, general=1200)
+        players = PlayerCache(capacity=3, form_length=3)
+        players.attach(db)
+
+        # miss, then hit; concurrent loads of one id share a query; unknown ids stay unknown
+        assert (await players.get('1')).mmr_general == 1200 and (players.hits, players.misses) == (0, 1)
+        assert await players.get('1') is players.peek('1') and (players.hits, players.misses) == (1, 1)
+        a, b = await asyncio.gather(players.get('2'), players.get('2'))
+        assert a is b and players.misses == 2
+        assert await players.get('nobody') is None and players.peek('nobody') is None
+        assert await db.get_player('nobody') is None
+
+        # a recorded match is written through to cached records without a reload
+        match_id = await db.record_match(['1'], ['2'], 'A')
+        await db.record_match(['1'], ['3'], 'B')
+        assert (players.peek('1').recent, players.peek('2').recent) == ('LW', 'L')
+        await same_as_db(db, players, '1')
+        await same_as_db(db, players, '2')
+        assert players.misses == 3
+
+        # a correction can't be applied in place: the touched records are dropped and reloaded
+        await db.correct_match(match_id, ['2'], ['1'], 'A')
+        assert players.peek('1') is None and players.peek('2') is None
+        await players.get_many(['1', '2'])
+        assert players.misses == 5 and (players.peek('1').recent, players.peek('2').recent) == ('LL', 'W')
+        await same_as_db(db, players, '1')
+        await same_as_db(db, players, '2')
+        players.invalidate('2')
+        assert players.peek('2') is None and players.peek('1') is not None
+
+        # least recently used goes first: '1' was touched, so '4' pushes out '2' and then '2' pushes out '3'
+        players.invalidate()
+        assert len(players) == 0
+        await players.get_many(['1', '2', '3'])
+        await players.get('1')
+        await players.get('4')
+        assert len(players) == 3 and players.peek('2') is None and players.peek('1') is not None
+        await players.get('2')
+        assert players.peek('3') is None and [p for p in ('1', '2', '4') if players.peek(p)] == ['1', '2', '4']
+        for _ in range(4):
+            await db.record_match(['1'], ['4'], 'A')
+        assert players.peek('1').recent == 'WWW', 'recent form is capped at form_length'
+        await same_as_db(db, players, '1')
+        await same_as_db(db, players, '4')
+        print('OK')
+    finally:
+        await db.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+if __name__ == '__main__':
+    asyncio.run(main())
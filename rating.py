@@ -0,0 +1,331 @@
+"""Rating formulas and full-history replay.
+
+A formula takes the current ratings and games played of both sides plus
+the result, and returns the per-player rating deltas:
+
+    formula(a_mmrs, b_mmrs, a_games, b_games, score_a) -> (a_deltas, b_deltas)
+
+``replay`` streams (team_a_ids, team_b_ids, winner) tuples through a
+formula into array-backed player state, so memory grows with the number
+of players, not the number of matches.
+"""
+from array import array
+from collections import deque
+import sqlite3
+import zlib
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from mmr import team_mmr_from_members, expected_score, update_elo, distribute_team_delta_equal, dynamic_k_factor
+
+DEFAULT_MMR = 1200
+REPLAY_BATCH_SIZE = 10000
+# A rating checkpoint is stored after every match whose id is a multiple of this
+CHECKPOINT_INTERVAL = 500
+
+Formula = Callable[[Sequence[int], Sequence[int], Sequence[int], Sequence[int], float], Tuple[List[int], List[int]]]
+
+def flat(delta: int = 25) -> Formula:
+    """The original fixed +/-delta per player."""
+    def formula(a_mmrs, b_mmrs, a_games, b_games, score_a):
+        d = delta if score_a > 0.5 else -delta
+        return [d] * len(a_mmrs), [-d] * len(b_mmrs)
+    return formula
+
+def top_weighted(member_mmrs: Sequence[int], decay: float = 0.8) -> float:
+    """Weighted mean with the strongest member weighted most (weights 1, decay, decay**2, ...)."""
+    weights = [decay ** i for i in range(len(member_mmrs))]
+    return sum(w * m for w, m in zip(weights, sorted(member_mmrs, reverse=True))) / sum(weights)
+
+def power_mean(member_mmrs: Sequence[int], p: float = 4.0) -> float:
+    """Generalised mean; p > 1 leans toward the stronger members."""
+    return (sum(m ** p for m in member_mmrs) / len(member_mmrs)) ** (1.0 / p)
+
+# How a side's member ratings become one team rating for expected_score
+TEAM_AGGREGATIONS: Dict[str, Callable[[Sequence[int]], float]] = {
+    'mean': team_mmr_from_members,
+    'top_weighted': top_weighted,
+    'power_mean': power_mean,
+    'max': max,
+}
+
+def get_team_aggregation(name: str) -> Callable[[Sequence[int]], float]:
+    try:
+        return TEAM_AGGREGATIONS[name]
+    except KeyError:
+        raise ValueError(f'unknown team aggregation: {name} (choose from {", ".join(TEAM_AGGREGATIONS)})')
+
+def elo(k: float = 24.0, team: str = 'mean') -> Formula:
+    """Team Elo with fixed K on team ratings (``team`` names a TEAM_AGGREGATIONS entry).
+
+    Each side's pool (K per member) is split with distribute_team_delta_equal
+    so integer totals stay consistent.
+    """
+    aggregate = get_team_aggregation(team)
+    def formula(a_mmrs, b_mmrs, a_games, b_games, score_a):
+        ea = expected_score(aggregate(a_mmrs), aggregate(b_mmrs))
+        pool_a = round(k * len(a_mmrs) * (score_a - ea))
+        pool_b = round(k * len(b_mmrs) * (ea - score_a))
+        new_a = distribute_team_delta_equal(a_mmrs, pool_a)
+        new_b = distribute_team_delta_equal(b_mmrs, pool_b)
+        return [n - o for n, o in zip(new_a, a_mmrs)], [n - o for n, o in zip(new_b, b_mmrs)]
+    return formula
+
+def elo_dynamic(scale: float = 1.0, team: str = 'mean') -> Formula:
+    """Team Elo where each player moves with their own dynamic_k_factor(games_played) * scale."""
+    aggregate = get_team_aggregation(team)
+    def formula(a_mmrs, b_mmrs, a_games, b_games, score_a):
+        ra = round(aggregate(a_mmrs))
+        rb = round(aggregate(b_mmrs))
+        a_deltas = [update_elo(ra, rb, score_a, dynamic_k_factor(g) * scale)[0] - ra for g in a_games]
+        b_deltas = [update_elo(ra, rb, score_a, dynamic_k_factor(g) * scale)[1] - rb for g in b_games]
+        return a_deltas, b_deltas
+    return formula
+
+FORMULAS: Dict[str, Callable[..., Formula]] = {
+    'flat': flat,
+    'elo': elo,
+    'elo_dynamic': elo_dynamic,
+}
+
+def get_formula(name: str, **params) -> Formula:
+    try:
+        factory = FORMULAS[name]
+    except KeyError:
+        raise ValueError(f'unknown rating formula: {name} (choose from {", ".join(FORMULAS)})')
+    return factory(**params)
+
+class RatingState:
+    """Per-player ratings and counters in parallel arrays indexed by a slot number."""
+
+    __slots__ = ('index', 'ids', 'mmr', 'games', 'wins', 'losses', 'max_mmr', 'seeds')
+
+    def __init__(self, seeds: Optional[Dict[str, int]] = None):
+        self.index: Dict[str, int] = {}
+        self.ids: List[str] = []
+        self.mmr = array('i')
+        self.games = array('i')
+        self.wins = array('i')
+        self.losses = array('i')
+        self.max_mmr = array('i')
+        # starting rating for players whose first match isn't at DEFAULT_MMR
+        self.seeds = seeds or {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def slot(self, pid: str) -> int:
+        i = self.index.get(pid)
+        if i is None:
+            i = len(self.ids)
+            self.index[pid] = i
+            self.ids.append(pid)
+            start = self.seeds.get(pid, DEFAULT_MMR)
+            self.mmr.append(start)
+            self.games.append(0)
+            self.wins.append(0)
+            self.losses.append(0)
+            self.max_mmr.append(start)
+        return i
+
+    def apply_match(self, team_a_ids: Sequence[str], team_b_ids: Sequence[str], winner: str, formula: Formula) -> Tuple[List[int], List[int]]:
+        """Apply one result and return the slots of both sides."""
+        a = [self.slot(pid) for pid in team_a_ids]
+        b = [self.slot(pid) for pid in team_b_ids]
+        mmr = self.mmr
+        games = self.games
+        score_a = 1.0 if winner == 'A' else 0.0
+        a_deltas, b_deltas = formula([mmr[i] for i in a], [mmr[i] for i in b], [games[i] for i in a], [games[i] for i in b], score_a)
+        for slots, deltas, won in ((a, a_deltas, winner == 'A'), (b, b_deltas, winner == 'B')):
+            for i, d in zip(slots, deltas):
+                new = max(0, mmr[i] + d)
+                mmr[i] = new
+                games[i] += 1
+                if won:
+                    self.wins[i] += 1
+                else:
+                    self.losses[i] += 1
+                if new > self.max_mmr[i]:
+                    self.max_mmr[i] = new
+        return a, b
+
+    def adjust(self, pid: str, mmr: int):
+        """Set a rating by hand (a re-seed), as DB.upsert_player/set_player_mmr do."""
+        i = self.slot(pid)
+        self.mmr[i] = mmr
+        if mmr > self.max_mmr[i]:
+            self.max_mmr[i] = mmr
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[str, int, int, int, int, int]], seeds: Optional[Dict[str, int]] = None) -> 'RatingState':
+        """Build state from (discord_id, mmr, games_played, wins, losses, max_mmr) rows."""
+        state = cls(seeds)
+        for pid, mmr, games, wins, losses, max_mmr in rows:
+            state.index[pid] = len(state.ids)
+            state.ids.append(pid)
+            state.mmr.append(mmr)
+            state.games.append(games)
+            state.wins.append(wins)
+            state.losses.append(losses)
+            state.max_mmr.append(max_mmr)
+        return state
+
+    def to_blob(self) -> bytes:
+        """Compact encoding: NUL-joined ids followed by the five int32 arrays, zlib-compressed."""
+        ids = '\0'.join(self.ids).encode()
+        header = array('i', [len(self.ids), len(ids)]).tobytes()
+        body = b''.join(a.tobytes() for a in (self.mmr, self.games, self.wins, self.losses, self.max_mmr))
+        return zlib.compress(header + ids + body)
+
+    @classmethod
+    def from_blob(cls, blob: bytes, seeds: Optional[Dict[str, int]] = None) -> 'RatingState':
+        raw = zlib.decompress(blob)
+        n, ids_len = array('i', raw[:8])
+        state = cls(seeds)
+        state.ids = raw[8:8 + ids_len].decode().split('\0') if n else []
+        state.index = {pid: i for i, pid in enumerate(state.ids)}
+        offset = 8 + ids_len
+        arrays = []
+        for _ in range(5):
+            a = array('i')
+            a.frombytes(raw[offset:offset + 4 * n])
+            arrays.append(a)
+            offset += 4 * n
+        state.mmr, state.games, state.wins, state.losses, state.max_mmr = arrays
+        return state
+
+    def rows(self) -> Iterator[Tuple[int, int, int, int, int, str]]:
+        """(mmr, games_played, wins, losses, max_mmr, discord_id) per player, for executemany."""
+        for i, pid in enumerate(self.ids):
+            yield self.mmr[i], self.games[i], self.wins[i], self.losses[i], self.max_mmr[i], pid
+
+class ReplayLog:
+    """What a replay wrote per match, for match_participants.mmr_before/mmr_after
+    and matches.mmr_delta: flat int arrays rather than row tuples, so a
+    full-history replay stays small in memory."""
+
+    __slots__ = ('match_ids', 'deltas', 'sizes', 'slots', 'before', 'after')
+
+    def __init__(self):
+        self.match_ids = array('q')
+        self.deltas = array('i')
+        self.sizes = array('i')
+        self.slots = array('i')
+        self.before = array('i')
+        self.after = array('i')
+
+    def __len__(self):
+        return len(self.match_ids)
+
+    def batches(self, state: RatingState, size: int = REPLAY_BATCH_SIZE) -> Iterator[Tuple[List[tuple], List[tuple]]]:
+        """(participant rows, delta rows) per ``size`` matches, in the parameter order of
+        ``UPDATE match_participants SET mmr_before = ?, mmr_after = ? WHERE match_id = ? AND discord_id = ?``
+        and ``UPDATE matches SET mmr_delta = ? WHERE id = ?``."""
+        offset = 0
+        for start in range(0, len(self.match_ids), size):
+            participant_rows = []
+            delta_rows = []
+            for k in range(start, min(start + size, len(self.match_ids))):
+                mid = self.match_ids[k]
+                for j in range(offset, offset + self.sizes[k]):
+                    participant_rows.append((self.before[j], self.after[j], mid, state.ids[self.slots[j]]))
+                offset += self.sizes[k]
+                delta_rows.append((self.deltas[k], mid))
+            yield participant_rows, delta_rows
+
+def parse_match_rows(rows: Iterable[tuple]) -> Iterator[Tuple[int, List[str], List[str], str]]:
+    """(id, team_a, team_b, winner) rows from ``matches`` -> (id, a_ids, b_ids, winner)."""
+    for match_id, team_a, team_b, winner in rows:
+        yield match_id, team_a.split(',') if team_a else [], team_b.split(',') if team_b else [], winner
+
+def stream_matches(conn: sqlite3.Connection, after_id: int = 0, batch_size: int = REPLAY_BATCH_SIZE) -> Iterator[tuple]:
+    """Yield raw ``matches`` rows in id order using keyset-paginated batches."""
+    last_id = after_id
+    while True:
+        rows = conn.execute('SELECT id, team_a, team_b, winner FROM matches WHERE id > ? ORDER BY id LIMIT ?', (last_id, batch_size)).fetchall()
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1][0]
+
+def load_seeds(conn: sqlite3.Connection) -> Dict[str, int]:
+    """Each player's rating before their first recorded match, where it is known."""
+    # SQLite returns the bare mmr_before column from the row that has MIN(match_id)
+    cur = conn.execute('SELECT discord_id, mmr_before, MIN(match_id) FROM match_participants GROUP BY discord_id')
+    return {pid: before for pid, before, _ in cur if before is not None}
+
+def load_base(conn: sqlite3.Connection) -> Optional[Tuple[int, bytes]]:
+    """(match_id, blob) of the latest base checkpoint; no replay starts before it."""
+    return conn.execute('SELECT match_id, state FROM rating_checkpoints WHERE base = 1 ORDER BY match_id DESC LIMIT 1').fetchone()
+
+def load_adjustments(conn: sqlite3.Connection, after_id: int = 0) -> Deque[Tuple[int, str, int]]:
+    """Re-seeds made after match ``after_id`` or later, as (after_match_id, discord_id, mmr) in order."""
+    return deque(conn.execute('SELECT after_match_id, discord_id, mmr FROM rating_adjustments WHERE after_match_id >= ? ORDER BY after_match_id, id', (after_id,)))
+
+def apply_adjustments(state: RatingState, pending: Deque[Tuple[int, str, int]], before_id: Optional[int] = None):
+    """Apply (and pop) the pending re-seeds made before match ``before_id``, or all of them.
+
+    A checkpoint at match N doesn't include re-seeds made after N, so a
+    replay from it starts with pending = every adjustment with after_match_id >= N.
+    """
+    while pending and (before_id is None or pending[0][0] < before_id):
+        _, pid, mmr = pending.popleft()
+        state.adjust(pid, mmr)
+
+def replay(
+    matches: Iterable[Tuple[int, List[str], List[str], str]],
+    formula: Formula,
+    state: Optional[RatingState] = None,
+    checkpoints: Optional[List[Tuple[int, bytes]]] = None,
+    pending: Optional[Deque[Tuple[int, str, int]]] = None,
+    log: Optional[ReplayLog] = None,
+) -> Tuple[RatingState, int]:
+    """Fold parsed matches into ``state``; returns (state, last match id).
+
+    If a ``checkpoints`` list is given, (match_id, blob) snapshots are
+    appended to it after every match id divisible by CHECKPOINT_INTERVAL.
+    Re-seeds in ``pending`` (see load_adjustments) are applied before the
+    first match that follows them; the ones after the last match are left
+    in it for the caller. Each match's ratings are appended to ``log`` if given.
+    """
+    state = state if state is not None else RatingState()
+    last_id = 0
+    for match_id, a_ids, b_ids, winner in matches:
+        if pending:
+            apply_adjustments(state, pending, match_id)
+        if log is None:
+            state.apply_match(a_ids, b_ids, winner, formula)
+        else:
+            slots = [state.slot(pid) for pid in a_ids + b_ids]
+            before = [state.mmr[i] for i in slots]
+            state.apply_match(a_ids, b_ids, winner, formula)
+            gains = [state.mmr[i] - b for i, b in zip(slots, before)]
+            win_gains = gains[:len(a_ids)] if winner == 'A' else gains[len(a_ids):]
+            log.match_ids.append(match_id)
+            log.deltas.append(round(sum(win_gains) / len(win_gains)) if win_gains else 0)
+            log.sizes.append(len(slots))
+            log.slots.extend(slots)
+            log.before.extend(before)
+            log.after.extend(state.mmr[i] for i in slots)
+        last_id = match_id
+        if checkpoints is not None and match_id % CHECKPOINT_INTERVAL == 0:
+            checkpoints.append((match_id, state.to_blob()))
+    return state, last_id
+
+def replay_database(path: str, formula: Formula, checkpoints: Optional[List[Tuple[int, bytes]]] = None,
+                    log: Optional[ReplayLog] = None) -> Tuple[RatingState, int]:
+    """Replay every match after the base checkpoint in the database file at ``path``
+    on a private read connection. Re-seeds after the last match are left out.
+
+    Blocking; run it in a worker thread. In WAL mode it reads a consistent
+    snapshot while the bot keeps writing.
+    """
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        conn.execute('BEGIN')  # hold one snapshot for the whole replay
+        seeds = load_seeds(conn)
+        base = load_base(conn)
+        base_id, state = (base[0], RatingState.from_blob(base[1], seeds)) if base else (0, RatingState(seeds))
+        state, last_id = replay(parse_match_rows(stream_matches(conn, base_id)), formula, state, checkpoints, load_adjustments(conn, base_id), log)
+        return state, max(last_id, base_id)
+    finally:
+        conn.close()
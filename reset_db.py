@@ -1,14 +1,20 @@
-import sqlite3
-import shutil
 import os
 
+from backup import backup_file, backup_path, BACKUP_DIR
+
 DB_FILE = 'mmr_bot.db'
-BACKUP = 'mmr_bot.db.bak'
 
+# Stop the bot first: this deletes the database. To start a new season
+# while keeping history, use /시즌종료 instead.
 if os.path.exists(DB_FILE):
-    print(f'Backing up {DB_FILE} -> {BACKUP}')
-    shutil.copyfile(DB_FILE, BACKUP)
-    os.remove(DB_FILE)
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    dest = backup_path(DB_FILE, BACKUP_DIR, label='reset')
+    print(f'Backing up {DB_FILE} -> {dest}')
+    # the backup API copies committed WAL content too, which copyfile would miss
+    backup_file(DB_FILE, dest)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(DB_FILE + suffix):
+            os.remove(DB_FILE + suffix)
     print('Database file removed. Run init_db_test.py or start the bot to recreate schema.')
 else:
     print('No DB file found; nothing to backup or remove.')
@@ -0,0 +1,221 @@
+"""History rewrites (correct_match/delete_match) against a full recompute.
+
+Each scenario builds a database, rewrites matches and checks the players
+table and the stored history (participant mmr_before/mmr_after,
+mmr_delta) against recompute_ratings() on the same history, plus the
+values the scenario expects outright. Checkpoints are taken every few
+matches so rewrites start from one.
+
+usage: python rewrite_test.py
+"""
+import asyncio
+import io
+import os
+import random
+import tempfile
+
+import aiosqlite
+
+import db as db_module
+import rating
+import transfer
+from db import DB, MIGRATIONS, SCHEMA_VERSION
+
+# the schema as the first release of the bot created it (user_version 0)
+BASELINE_SCHEMA = '''
+CREATE TABLE players (discord_id TEXT PRIMARY KEY, name TEXT, mmr_regular INTEGER DEFAULT 1200, mmr_general INTEGER DEFAULT 1200,
+                      games_played INTEGER DEFAULT 0, max_mmr INTEGER DEFAULT 1200, wins INTEGER DEFAULT 0, losses INTEGER DEFAULT 0);
+CREATE TABLE teams (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, member_ids TEXT, seed_mmr INTEGER DEFAULT 0);
+CREATE TABLE matches (id INTEGER PRIMARY KEY AUTOINCREMENT, team_a TEXT, team_b TEXT, winner TEXT, mmr_delta INTEGER,
+                      ts DATETIME DEFAULT CURRENT_TIMESTAMP);
+'''
+# seeds 1600/1600/1000/1000, then four wins for 1 and 2 at the original +/-25
+LEGACY_PLAYERS = {'1': (1700, 4, 4, 0), '2': (1700, 4, 4, 0), '3': (900, 4, 0, 4), '4': (900, 4, 0, 4)}
+
+async def players(db: DB) -> dict:
+    return {p['discord_id']: (p['mmr_general'], p['games_played'], p['wins'], p['losses']) for p in await db.list_players()}
+
+async def history(db: DB) -> dict:
+    """Every player's (match_id, mmr_before, mmr_after) list, plus each match's mmr_delta."""
+    found = {pid: [(h['match_id'], h['mmr_before'], h['mmr_after']) for h in await db.player_history(pid, limit=1000)] for pid in await players(db)}
+    found['mmr_delta'] = [(m['id'], m['mmr_delta']) async for m in db.export_matches()]
+    return found
+
+async def assert_recompute_agrees(db: DB):
+    rewritten = await players(db), await history(db)
+    await db.recompute_ratings()
+    assert (await players(db), await history(db)) == rewritten, (rewritten, await players(db), await history(db))
+
+async def open_db(path: str) -> DB:
+    db = DB(path)
+    await db.connect()
+    await db.ensure()
+    return db
+
+async def legacy_db(path: str):
+    """A baseline database: no match_participants, seeded ratings, four matches."""
+    conn = await aiosqlite.connect(path)
+    await conn.executescript(BASELINE_SCHEMA)
+    await conn.executemany('INSERT INTO players(discord_id, name, mmr_general, games_played, max_mmr, wins, losses) VALUES(?,?,?,?,?,?,?)',
+                           [(pid, f'p{pid}', mmr, games, 1700 if wins else 1000, wins, losses) for pid, (mmr, games, wins, losses) in LEGACY_PLAYERS.items()])
+    await conn.executemany('INSERT INTO matches(team_a, team_b, winner, mmr_delta) VALUES(?,?,?,?)', [('1,2', '3,4', 'A', 25)] * 4)
+    await conn.commit()
+    await conn.close()
+
+async def check_legacy_locked(db: DB):
+    try:
+        await db.delete_match(4)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('a legacy match was rewritten')
+
+async def baseline_migration(path: str):
+    """A baseline database migrates to the current schema with its data intact."""
+    await legacy_db(path)
+    db = await open_db(path)
+    try:
+        async with db._read() as conn:
+            cur = await conn.execute('PRAGMA user_version')
+            assert (await cur.fetchone())[0] == SCHEMA_VERSION == len(MIGRATIONS)
+            cur = await conn.execute('SELECT COUNT(*), COUNT(mmr_before) FROM match_participants')
+            assert await cur.fetchone() == (16, 0), 'legacy participants backfilled without ratings'
+            cur = await conn.execute('SELECT match_id FROM rating_checkpoints WHERE base = 1')
+            assert await cur.fetchall() == [(4,)], 'base checkpoint at the last legacy match'
+        assert await players(db) == LEGACY_PLAYERS
+        assert [h['match_id'] for h in await db.player_history('1')] == [4, 3, 2, 1]
+        team_id = await db.register_team('t', ['1', '3'])
+        assert (await db.get_team(team_id))['rating'] == 1300
+    finally:
+        await db.close()
+
+async def upgraded_db(path: str):
+    await legacy_db(path)
+    db = await open_db(path)
+    try:
+        match_id = await db.record_match(['1', '3'], ['2', '4'], 'B')
+        assert match_id == 5
+        await db.delete_match(match_id)
+        assert await players(db) == LEGACY_PLAYERS, await players(db)
+        await assert_recompute_agrees(db)
+        await check_legacy_locked(db)
+    finally:
+        await db.close()
+
+async def upgraded_in_use(path: str):
+    """Upgraded (participants backfilled) and used before the base checkpoint existed."""
+    await legacy_db(path)
+    conn = await aiosqlite.connect(path)
+    for step in MIGRATIONS[:9]:
+        await step(conn)
+    await conn.execute("INSERT INTO matches(team_a, team_b, winner, mmr_delta) VALUES('1,3', '2,4', 'B', 25)")
+    await conn.executemany('INSERT INTO match_participants(match_id, discord_id, side, mmr_before, mmr_after) VALUES(5,?,?,?,?)',
+                           [('1', 'A', 1700, 1675), ('3', 'A', 900, 875), ('2', 'B', 1700, 1725), ('4', 'B', 900, 925)])
+    await conn.executemany('UPDATE players SET mmr_general = ?, games_played = 5, wins = wins + ?, losses = losses + ?, max_mmr = MAX(max_mmr, ?) WHERE discord_id = ?',
+                           [(1675, 0, 1, 1675, '1'), (875, 0, 1, 875, '3'), (1725, 1, 0, 1725, '2'), (925, 1, 0, 925, '4')])
+    await conn.execute('PRAGMA user_version = 9')
+    await conn.commit()
+    await conn.close()
+    db = await open_db(path)
+    try:
+        await db.delete_match(5)
+        assert await players(db) == LEGACY_PLAYERS, await players(db)
+        await assert_recompute_agrees(db)
+        await check_legacy_locked(db)
+    finally:
+        await db.close()
+
+async def corrections(path: str):
+    """Random corrections and deletions under an order-sensitive formula match a full recompute."""
+    rnd = random.Random(7)
+    ids = [str(i) for i in range(1, 13)]
+    db = await open_db(path)
+    db.set_rating_formula('elo')
+    try:
+        for _ in range(40):
+            lobby = rnd.sample(ids, 6)
+            await db.record_match(lobby[:3], lobby[3:], rnd.choice('AB'))
+        for _ in range(6):
+            match = await db.get_match(rnd.randint(1, 40))
+            if match is None:
+                continue
+            if rnd.random() < 0.5:
+                await db.delete_match(match['id'])
+            else:
+                # swap one player for a newcomer, who must start from their seed
+                newcomer = str(100 + match['id'])
+                await db.correct_match(match['id'], match['team_a'][1:] + [newcomer], match['team_b'], match['winner'])
+            await assert_recompute_agrees(db)
+    finally:
+        await db.close()
+
+async def reseed(path: str):
+    """A re-seed between matches survives corrections before and after it."""
+    db = await open_db(path)
+    try:
+        for i in range(6):
+            await db.record_match(['1', '2'], ['3', '4'], 'A' if i % 3 else 'B')
+        await db.upsert_player('2', 'b', regular=1500, general=1500)
+        match_id = await db.record_match(['2', '3'], ['1', '4'], 'A')
+        await db.delete_match(match_id)
+        assert (await players(db))['2'][0] == 1500, await players(db)
+        await assert_recompute_agrees(db)
+        await db.record_match(['2', '3'], ['1', '4'], 'A')
+        await db.set_player_mmr('4', general=1000)
+        await db.correct_match(2, ['1', '3'], ['2', '4'], 'B')
+        await assert_recompute_agrees(db)
+        await db.delete_match(5)
+        assert (await players(db))['4'][0] == 1000, await players(db)
+        await assert_recompute_agrees(db)
+    finally:
+        await db.close()
+
+async def formula_change(path: str):
+    """Recomputing under another formula rewrites the stored history too."""
+    db = await open_db(path)
+    try:
+        for i in range(8):
+            await db.record_match(['1', '2'], ['3', '4'], 'A' if i % 3 else 'B')
+        await db.recompute_ratings('elo')
+        now = await players(db)
+        for pid, (mmr, games, _, _) in now.items():
+            rows = await db.player_history(pid, limit=1000)
+            assert len(rows) == games and rows[0]['mmr_after'] == mmr, (pid, rows, mmr)
+            assert all(newer['mmr_before'] == older['mmr_after'] for newer, older in zip(rows, rows[1:])), rows
+        gains = [h[0]['mmr_after'] - h[0]['mmr_before'] for h in [await db.player_history(pid, limit=1) for pid in ('1', '2')]]
+        assert (await db.get_match(8))['mmr_delta'] == round(sum(gains) / 2), gains
+        await db.delete_match(3)
+        await assert_recompute_agrees(db)
+    finally:
+        await db.close()
+
+async def repeated_ids(path: str):
+    """An import with a player listed twice in one team is rejected before anything is written."""
+    db = await open_db(path)
+    try:
+        f = io.StringIO('{"team_a": ["1", "2"], "team_b": ["3"], "winner": "A"}\n{"team_a": ["1", "1"], "team_b": ["3"], "winner": "B"}\n')
+        try:
+            await transfer.import_table(db, 'matches', f, 'jsonl')
+        except ValueError as e:
+            assert str(e).startswith('2번째 행'), e
+        else:
+            raise AssertionError('repeated id imported')
+        assert (await db.table_counts())['matches'] == 0
+    finally:
+        await db.close()
+
+async def run():
+    db_module.CHECKPOINT_INTERVAL = rating.CHECKPOINT_INTERVAL = 3
+    for scenario in (baseline_migration, upgraded_db, upgraded_in_use, corrections, reseed, formula_change, repeated_ids):
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        try:
+            await scenario(path)
+        finally:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+        print(scenario.__name__, 'OK')
+
+if __name__ == '__main__':
+    asyncio.run(run())
@@ -0,0 +1,99 @@
+"""Season rollover and online backups.
+
+A backup taken while matches are being recorded must open as a valid
+database; end_season must archive the season, soft-reset every rating
+and clear the checkpoints and re-seeds of the old history, so that new
+matches replay from the reset ratings.
+
+usage: python season_test.py
+"""
+import asyncio
+import math
+import os
+import shutil
+import tempfile
+
+import db as db_module
+import rating
+from backup import backup_database, prune_backups
+from db import DB
+
+CARRYOVER = 0.5
+
+def soft_reset(mmr: int) -> int:
+    # SQLite's ROUND: half away from zero
+    x = rating.DEFAULT_MMR + (mmr - rating.DEFAULT_MMR) * CARRYOVER
+    return int(math.copysign(math.floor(abs(x) + 0.5), x))
+
+async def count(db: DB, table: str) -> int:
+    async with db._read() as conn:
+        cur = await conn.execute(f'SELECT COUNT(*) FROM {table}')
+        return (await cur.fetchone())[0]
+
+async def backup_under_writes(db: DB, backup_dir: str):
+    before = await count(db, 'matches')
+    writes = asyncio.gather(*[db.record_match([str(i % 8)], [str(8 + i % 3)], 'AB'[i % 2]) for i in range(60)])
+    path = await backup_database(db.path, backup_dir, label='season')
+    await writes
+    copy = DB(path)
+    await copy.connect()
+    try:
+        async with copy._read() as conn:
+            cur = await conn.execute('PRAGMA integrity_check')
+            assert (await cur.fetchone())[0] == 'ok'
+        copied = await count(copy, 'matches')
+        assert before <= copied <= before + 60, copied
+        # a consistent snapshot: every copied match comes with its participants and nothing else
+        async with copy._read() as conn:
+            cur = await conn.execute('SELECT COUNT(DISTINCT match_id), COUNT(*) FILTER (WHERE match_id NOT IN (SELECT id FROM matches)) FROM match_participants')
+            assert await cur.fetchone() == (copied, 0)
+    finally:
+        await copy.close()
+    assert prune_backups(db.path, backup_dir, label='season', keep=0) == [path] and not os.listdir(backup_dir)
+
+async def main():
+    db_module.CHECKPOINT_INTERVAL = rating.CHECKPOINT_INTERVAL = 3
+    work = tempfile.mkdtemp()
+    db = DB(os.path.join(work, 'season.db'))
+    await db.connect()
+    await db.ensure()
+    try:
+        for i in range(10):
+            await db.record_match(['1', '2'], ['3', '4'], 'A' if i % 4 else 'B')
+        await db.upsert_player('5', 'five', regular=1500, general=1500)
+        await db.record_match(['5'], ['1'], 'A')
+        await backup_under_writes(db, os.path.join(work, 'backups'))
+        assert await count(db, 'rating_checkpoints') and await count(db, 'rating_adjustments')
+
+        old = {p['discord_id']: p for p in await db.list_players()}
+        played = sum(1 for p in old.values() if p['games_played'])
+        matches = await count(db, 'matches')
+        season = await db.end_season('S1', CARRYOVER)
+        assert (season['matches'], season['players']) == (matches, played)
+
+        new = {p['discord_id']: p for p in await db.list_players()}
+        for pid, p in new.items():
+            assert p['mmr_general'] == p['max_mmr'] == soft_reset(old[pid]['mmr_general']), (pid, old[pid], p)
+            assert p['mmr_regular'] == soft_reset(old[pid]['mmr_regular'])
+            assert (p['games_played'], p['wins'], p['losses']) == (0, 0, 0)
+        for table in ('matches', 'match_participants', 'rating_checkpoints', 'rating_adjustments'):
+            assert await count(db, table) == 0, table
+        assert await count(db, 'season_matches') == matches
+        standings = await db.season_standings(season['season_id'], limit=100)
+        assert len(standings) == played and [s['mmr'] for s in standings] == sorted((p['mmr_general'] for p in old.values() if p['games_played']), reverse=True)
+
+        # the new season replays from the reset ratings, not from old checkpoints or re-seeds
+        match_id = await db.record_match(['1', '5'], ['2', '3'], 'B')
+        await db.delete_match(match_id)
+        assert {p['discord_id']: p for p in await db.list_players()} == new
+        await db.record_match(['1', '5'], ['2', '3'], 'B')
+        after = await db.list_players()
+        await db.recompute_ratings()
+        assert await db.list_players() == after
+        print('OK')
+    finally:
+        await db.close()
+        shutil.rmtree(work, ignore_errors=True)
+
+if __name__ == '__main__':
+    asyncio.run(main())
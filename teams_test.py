@@ -0,0 +1,78 @@
+"""Materialised team ratings: teams.rating must always equal the aggregate of its members' current MMR.
+
+Checked after every kind of write that moves ratings, and after
+switching the aggregation.
+
+usage: python teams_test.py
+"""
+import asyncio
+import os
+import tempfile
+
+from db import DB
+from rating import DEFAULT_MMR, get_team_aggregation
+
+async def assert_current(db: DB, team_ids, aggregation: str = 'mean'):
+    aggregate = get_team_aggregation(aggregation)
+    mmrs = {p['discord_id']: p['mmr_general'] for p in await db.list_players()}
+    teams = await db.get_teams(team_ids)
+    for tid in team_ids:
+        t = teams[tid]
+        assert t['rating'] == round(aggregate([mmrs.get(pid, DEFAULT_MMR) for pid in t['member_ids']])), t
+
+async def main():
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    db = DB(path)
+    await db.connect()
+    await db.ensure()
+    try:
+        for pid, mmr in (('1', 1600), ('2', 1400), ('3', 1000), ('4', 1100), ('5', 1300)):
+            await db.upsert_player(pid, pid, regular=mmr, general=mmr)
+        # a member without a players row counts as DEFAULT_MMR
+        a = await db.register_team('a', ['1', '2'])
+        b = await db.register_team('b', ['3', '4'])
+        c = await db.register_team('c', ['5', 'ghost'])
+        teams = [a, b, c]
+        assert [(await db.get_team(t))['rating'] for t in teams] == [1500, 1050, 1250]
+        assert [t['id'] for t in await db.list_top_teams()] == [a, c, b]
+        assert [t['id'] for t in await db.list_top_teams(limit=1, offset=1)] == [c]
+
+        match_id = await db.record_match(['3', '4'], ['1', '2'], 'A')
+        await assert_current(db, teams)
+        assert (await db.get_team(b))['rating'] > 1050 and (await db.get_team(c))['rating'] == 1250
+        await db.set_player_mmr('5', general=1900)
+        await assert_current(db, teams)
+        assert [t['id'] for t in await db.list_top_teams()][0] == c
+
+        await db.record_match(['5'], ['1'], 'B')
+        await db.correct_match(match_id, ['1', '2'], ['3', '4'], 'A')
+        await assert_current(db, teams)
+        await db.delete_match(match_id)
+        await assert_current(db, teams)
+        await db.recompute_ratings()
+        await assert_current(db, teams)
+
+        assert await db.set_team_aggregation('max') == 3
+        await assert_current(db, teams, 'max')
+        await db.record_match(['2'], ['4'], 'B')
+        await assert_current(db, teams, 'max')
+        try:
+            await db.set_team_aggregation('median')
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('an unknown aggregation was accepted')
+        await assert_current(db, teams, 'max')
+
+        await db.end_season('S1', 0.5)
+        await assert_current(db, teams, 'max')
+        print('OK')
+    finally:
+        await db.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+if __name__ == '__main__':
+    asyncio.run(main())
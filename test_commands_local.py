@@ -1,6 +1,7 @@
 import asyncio
 from db import DB
-from commands import parse_member_input
+from commands import parse_member_input, validate_match_teams
+from transfer import parse_match
 
 async def main():
     db = DB('mmr_test.db')
@@ -12,6 +13,20 @@ async def main():
 
     a_ids = parse_member_input(team_a_mentions)
     print('Parsed team A IDs:', a_ids)
+    # /기록, !기록 and /기록수정 all parse this way: a mention and a bare ID are one player
+    assert a_ids == ['1430192573816897598', '1002']
+    assert parse_member_input('1430192573816897598 1002') == a_ids
+
+    # A repeated ID is rejected before anything reaches the database
+    error = validate_match_teams(['1001', '1001'], ['2001'], 'A')
+    assert error, 'repeated ID accepted'
+    print('Repeated ID rejected:', error)
+    try:
+        parse_match({'team_a': '1001 1001', 'team_b': '2001', 'winner': 'A'})
+    except ValueError as e:
+        print('Repeated ID rejected on import:', e)
+    else:
+        raise AssertionError('repeated ID accepted on import')
 
     # Upsert players for both teams
     for pid in a_ids:
@@ -0,0 +1,276 @@
+"""Tournaments between registered teams: schedules, advancement and title odds.
+
+Teams are seeded by their materialised rating (teams.rating). Schedules
+work on seed indices (0 = top seed) and games are (round, a, b, winner)
+tuples, b being None for a bye; the same functions drive the real
+tournament and the Monte Carlo simulation, so simulated brackets pair
+teams exactly as the real one would.
+
+- single_elimination: standard bracket (1 vs N, ...), byes for the top
+  seeds up to the next power of two; a round is created when the previous
+  one is complete.
+- round_robin: every pairing, scheduled up front with the circle method.
+- swiss: a fixed number of rounds; round 1 pairs the top half against the
+  bottom half, later rounds pair teams by points (seed breaks ties),
+  avoiding rematches where possible.
+
+Title odds come from a pairwise win-probability matrix and many simulated
+tournaments from the current state, spread over a process pool.
+"""
+import asyncio
+import math
+import os
+import random
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from db import DB
+from mmr import expected_score
+from rating import DEFAULT_MMR
+
+FORMATS = ('single_elimination', 'round_robin', 'swiss')
+MIN_TEAMS = 2
+MAX_TEAMS = 64
+SIMULATIONS = 100_000
+PREDICT_WORKERS = os.cpu_count() or 1
+# running tournaments whose odds are kept; the least recently predicted is dropped beyond this
+ODDS_CACHE_SIZE = 32
+
+Game = Tuple[int, int, Optional[int], Optional[str]]
+
+_pool: Optional[ProcessPoolExecutor] = None
+# (db path, tournament id) -> (leaderboard version, team ratings, odds), least recently used first
+_odds_cache: 'OrderedDict[Tuple[str, int], Tuple[int, Tuple[int, ...], List[float]]]' = OrderedDict()
+
+def team_strength(team: dict) -> int:
+    if team.get('rating') is not None:
+        return team['rating']
+    return team.get('seed_mmr') or DEFAULT_MMR
+
+def seed_teams(teams: List[dict]) -> List[dict]:
+    """Teams in seed order: highest rating first, earlier registration on ties."""
+    return sorted(teams, key=lambda t: (-team_strength(t), t['id']))
+
+def default_rounds(fmt: str, n: int) -> int:
+    if fmt == 'round_robin':
+        return n - 1 if n % 2 == 0 else n
+    return max(1, math.ceil(math.log2(n)))
+
+def bracket_order(size: int) -> List[int]:
+    """Seed indices in bracket line order for a power-of-two ``size`` (0, size-1, ...)."""
+    order = [0]
+    while len(order) < size:
+        m = len(order) * 2
+        order = [s for seed in order for s in (seed, m - 1 - seed)]
+    return order
+
+def round_robin_schedule(n: int) -> List[List[Tuple[int, int]]]:
+    """Circle method: n-1 rounds (n rounds if odd, one team sitting out each round)."""
+    ids: List[Optional[int]] = list(range(n)) + ([None] if n % 2 else [])
+    m = len(ids)
+    rounds = []
+    for _ in range(m - 1):
+        pairs = [(ids[i], ids[m - 1 - i]) for i in range(m // 2)]
+        rounds.append([(a, b) if a < b else (b, a) for a, b in pairs if a is not None and b is not None])
+        ids = [ids[0], ids[-1]] + ids[1:-1]
+    return rounds
+
+def points(n: int, games: Sequence[Game]) -> List[int]:
+    """Wins per seed index; a bye counts as a win."""
+    pts = [0] * n
+    for _, a, b, winner in games:
+        if winner == 'A':
+            pts[a] += 1
+        elif winner == 'B':
+            pts[b] += 1
+    return pts
+
+def swiss_pairs(n: int, games: Sequence[Game]) -> List[Tuple[int, Optional[int]]]:
+    """Next Swiss round: teams ordered by points (seed breaks ties), each paired with the
+    next team it hasn't played; with an odd count the lowest team without a bye sits out."""
+    pts = points(n, games)
+    order = sorted(range(n), key=lambda i: (-pts[i], i))
+    played = set()
+    had_bye = set()
+    for _, a, b, _ in games:
+        if b is None:
+            had_bye.add(a)
+        else:
+            played.add((a, b))
+            played.add((b, a))
+    pairs: List[Tuple[int, Optional[int]]] = []
+    if n % 2:
+        bye = next((i for i in reversed(order) if i not in had_bye), order[-1])
+        order.remove(bye)
+        pairs.append((bye, None))
+    while order:
+        a = order.pop(0)
+        j = next((k for k, b in enumerate(order) if (a, b) not in played), 0)
+        pairs.insert(len(pairs) - (1 if n % 2 else 0), (a, order.pop(j)))
+    return pairs
+
+def first_games(fmt: str, n: int) -> List[Tuple[int, int, Optional[int]]]:
+    """(round, a, b) for the games created with the tournament."""
+    if fmt == 'round_robin':
+        return [(r, a, b) for r, pairs in enumerate(round_robin_schedule(n), start=1) for a, b in pairs]
+    if fmt == 'swiss':
+        # round 1 pairs the top half against the bottom half; the lowest seed takes the bye
+        half = n // 2
+        return [(1, i, i + half) for i in range(half)] + ([(1, n - 1, None)] if n % 2 else [])
+    size = 1 << (n - 1).bit_length()
+    order = bracket_order(size)
+    games = []
+    for i in range(0, size, 2):
+        a, b = order[i], order[i + 1]
+        games.append((1, a, b if b < n else None))
+    return games
+
+def next_games(fmt: str, n: int, rounds: int, games: Sequence[Game]) -> List[Tuple[int, int, Optional[int]]]:
+    """Games of the round after the last one (all decided); empty when the tournament is over."""
+    if fmt == 'round_robin' or not games:
+        return []
+    last = max(g[0] for g in games)
+    if fmt == 'swiss':
+        if last >= rounds:
+            return []
+        return [(last + 1, a, b) for a, b in swiss_pairs(n, games)]
+    winners = [a if w == 'A' else b for r, a, b, w in games if r == last]
+    if len(winners) == 1:
+        return []
+    return [(last + 1, winners[i], winners[i + 1]) for i in range(0, len(winners), 2)]
+
+def champion(fmt: str, n: int, games: Sequence[Game]) -> int:
+    if fmt == 'single_elimination':
+        _, a, b, w = games[-1]
+        return a if w == 'A' else b
+    pts = points(n, games)
+    return min(range(n), key=lambda i: (-pts[i], i))
+
+def win_matrix(ratings: Sequence[float]) -> List[float]:
+    """Flat n*n matrix of mmr.expected_score(ratings[i], ratings[j]), computed once per prediction."""
+    return [expected_score(a, b) for a in ratings for b in ratings]
+
+def simulate(fmt: str, n: int, rounds: int, p: Sequence[float], games: Sequence[Game], sims: int, seed: Optional[int] = None) -> List[int]:
+    """Title count per seed index over ``sims`` tournaments played out from ``games``."""
+    rnd = random.Random(seed).random
+    counts = [0] * n
+    for _ in range(sims):
+        played = [g if g[3] is not None else (g[0], g[1], g[2], 'A' if rnd() < p[g[1] * n + g[2]] else 'B') for g in games]
+        while True:
+            upcoming = next_games(fmt, n, rounds, played)
+            if not upcoming:
+                break
+            for r, a, b in upcoming:
+                played.append((r, a, b, 'A' if b is None or rnd() < p[a * n + b] else 'B'))
+        counts[champion(fmt, n, played)] += 1
+    return counts
+
+def _simulate_chunk(args) -> List[int]:
+    return simulate(*args)
+
+async def title_odds(fmt: str, ratings: Sequence[int], rounds: int, games: Sequence[Game],
+                     sims: int = SIMULATIONS, processes: int = PREDICT_WORKERS) -> List[float]:
+    """Estimated title probability per seed index, simulated in the process pool."""
+    global _pool
+    n = len(ratings)
+    p = win_matrix(ratings)
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=processes)
+    loop = asyncio.get_running_loop()
+    chunks = [sims // processes + (1 if i < sims % processes else 0) for i in range(processes)]
+    seeds = [random.getrandbits(64) for _ in chunks]
+    results = await asyncio.gather(*[loop.run_in_executor(_pool, _simulate_chunk, (fmt, n, rounds, p, list(games), c, s))
+                                     for c, s in zip(chunks, seeds) if c])
+    totals = [sum(col) for col in zip(*results)]
+    return [c / sims for c in totals]
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def index_games(t: dict) -> List[Game]:
+    """A DB.get_tournament() result's games in seed-index form."""
+    index = {team_id: i for i, team_id in enumerate(t['team_ids'])}
+    return [(g['round'], index[g['team_a']], index.get(g['team_b']), g['winner']) for g in t['games']]
+
+async def create(db: DB, name: str, fmt: str, team_ids: List[int], rounds: Optional[int] = None) -> int:
+    """Seed the given registered teams by rating and store the tournament with its first games.
+
+    Raises ValueError for an unknown format, team, a player listed twice in
+    one team, or teams sharing a player.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f'알 수 없는 방식입니다: {fmt}')
+    team_ids = list(dict.fromkeys(team_ids))
+    if not MIN_TEAMS <= len(team_ids) <= MAX_TEAMS:
+        raise ValueError(f'팀은 {MIN_TEAMS}~{MAX_TEAMS}개여야 합니다')
+    teams = await db.get_teams(team_ids)
+    unknown = [tid for tid in team_ids if tid not in teams]
+    if unknown:
+        raise ValueError(f'등록되지 않은 팀: {", ".join(map(str, unknown))}')
+    seen: Dict[str, int] = {}
+    for t in teams.values():
+        if not t['member_ids']:
+            raise ValueError(f'{t["name"]} 팀에 멤버가 없습니다')
+        if len(set(t['member_ids'])) != len(t['member_ids']):
+            raise ValueError(f'{t["name"]} 팀에 같은 유저가 두 번 들어 있습니다')
+        for pid in t['member_ids']:
+            if pid in seen:
+                raise ValueError(f'{pid} 유저가 여러 팀에 속해 있습니다')
+            seen[pid] = t['id']
+    seeded = [t['id'] for t in seed_teams(list(teams.values()))]
+    n = len(seeded)
+    if fmt != 'swiss' or not rounds:
+        rounds = default_rounds(fmt, n)
+    games = [(r, slot, seeded[a], seeded[b] if b is not None else None) for slot, (r, a, b) in enumerate(first_games(fmt, n), start=1)]
+    return await db.create_tournament(name, fmt, seeded, min(rounds, n - 1) if fmt == 'swiss' else rounds, games)
+
+def next_step(t: dict) -> Optional[Tuple[List[Tuple[int, int, int, Optional[int]]], Optional[int]]]:
+    """What a result leads to: None while the round is still being played, else
+    (next round's games, None) or ([], champion team id). See DB.record_tournament_game."""
+    if t is None or t['status'] != 'running':
+        return None
+    games = index_games(t)
+    if any(g[3] is None for g in games):
+        return None
+    n = len(t['team_ids'])
+    upcoming = next_games(t['format'], n, t['rounds'], games)
+    if upcoming:
+        return [(r, slot, t['team_ids'][a], t['team_ids'][b] if b is not None else None) for slot, (r, a, b) in enumerate(upcoming, start=1)], None
+    return [], t['team_ids'][champion(t['format'], n, games)]
+
+async def record_result(db: DB, game_id: int, winner: str) -> Tuple[dict, int]:
+    """Record a game and create the next round (or finish) in the same transaction.
+
+    Returns (refreshed tournament, match id); raises like DB.record_tournament_game.
+    """
+    tournament_id, match_id = await db.record_tournament_game(game_id, winner, next_step)
+    t = await db.get_tournament(tournament_id)
+    if t['status'] != 'running':
+        _odds_cache.pop((db.path, tournament_id), None)
+    return t, match_id
+
+async def predict(db: DB, t: dict, version: int, sims: int = SIMULATIONS) -> Tuple[List[dict], List[float]]:
+    """(teams in seed order, title odds) for a running tournament, cached until ``version``
+    (the guild leaderboard's) or a team rating changes."""
+    teams = await db.get_teams(t['team_ids'])
+    ordered = [teams[tid] for tid in t['team_ids']]
+    ratings = tuple(team_strength(team) for team in ordered)
+    key = (db.path, t['id'])
+    if t['status'] != 'running':
+        # nothing left to simulate; the champion's odds are 1
+        _odds_cache.pop(key, None)
+        return ordered, [1.0 if tid == t['champion_team_id'] else 0.0 for tid in t['team_ids']]
+    cached = _odds_cache.get(key)
+    if cached is not None and cached[0] == version and cached[1] == ratings:
+        _odds_cache.move_to_end(key)
+        return ordered, cached[2]
+    odds = await title_odds(t['format'], ratings, t['rounds'], index_games(t), sims)
+    _odds_cache[key] = (version, ratings, odds)
+    _odds_cache.move_to_end(key)
+    while len(_odds_cache) > ODDS_CACHE_SIZE:
+        _odds_cache.popitem(last=False)
+    return ordered, odds
@@ -0,0 +1,141 @@
+"""Tournaments: schedules, advancement through the database and seeded simulations.
+
+Schedules are checked on small brackets; a single elimination and a
+Swiss tournament are then played to the end through record_result on a
+temporary database, and the Monte Carlo simulation is run with fixed
+seeds.
+
+usage: python tournament_test.py
+"""
+import asyncio
+import os
+import random
+import tempfile
+from itertools import combinations
+
+import tournament
+from db import DB
+from tournament import (bracket_order, champion, first_games, index_games, next_games, points, record_result,
+                        round_robin_schedule, simulate, swiss_pairs, win_matrix)
+
+def schedules():
+    assert bracket_order(8) == [0, 7, 3, 4, 1, 6, 2, 5]
+    # 6 teams in an 8 bracket: the top two seeds get byes
+    assert first_games('single_elimination', 6) == [(1, 0, None), (1, 3, 4), (1, 1, None), (1, 2, 5)]
+    assert first_games('swiss', 5) == [(1, 0, 2), (1, 1, 3), (1, 4, None)]
+    for n in (4, 5, 6, 7):
+        rounds = round_robin_schedule(n)
+        assert len(rounds) == (n - 1 if n % 2 == 0 else n)
+        for pairs in rounds:
+            teams = [i for pair in pairs for i in pair]
+            assert len(teams) == len(set(teams)) and len(pairs) == n // 2
+        assert sorted(p for pairs in rounds for p in pairs) == list(combinations(range(n), 2))
+        assert first_games('round_robin', n) == [(r, a, b) for r, pairs in enumerate(rounds, start=1) for a, b in pairs]
+
+    # swiss: teams meet by points without rematches; the bye goes to the lowest team without one
+    games = [(1, 0, 2, 'A'), (1, 1, 3, 'B'), (1, 4, None, 'A')]
+    assert points(5, games) == [1, 0, 0, 1, 1]
+    pairs = swiss_pairs(5, games)
+    assert pairs[-1] == (2, None) and sorted(i for pair in pairs for i in pair if i is not None) == [0, 1, 2, 3, 4]
+    assert all((a, b) not in {(0, 2), (1, 3)} and (b, a) not in {(0, 2), (1, 3)} for a, b in pairs if b is not None)
+    assert pairs[:2] == [(0, 3), (4, 1)]
+
+    # single elimination: winners meet in bracket order until one is left
+    games = [(1, a, b, 'A') for _, a, b in first_games('single_elimination', 6)]
+    assert next_games('single_elimination', 6, 3, games) == [(2, 0, 3), (2, 1, 2)]
+    games += [(2, 0, 3, 'B'), (2, 1, 2, 'A')]
+    assert next_games('single_elimination', 6, 3, games) == [(3, 3, 1)]
+    games.append((3, 3, 1, 'A'))
+    assert next_games('single_elimination', 6, 3, games) == [] and champion('single_elimination', 6, games) == 3
+
+def simulations():
+    p = win_matrix([1600, 1400, 1200, 1000])
+    assert all(abs(p[i * 4 + j] + p[j * 4 + i] - 1) < 1e-9 for i in range(4) for j in range(4))
+    for fmt, rounds in (('single_elimination', 2), ('round_robin', 3), ('swiss', 2)):
+        # as predict() does: from the games stored with a new tournament
+        games = [(r, a, b, None) for r, a, b in first_games(fmt, 4)]
+        counts = simulate(fmt, 4, rounds, p, games, 2000, seed=7)
+        assert sum(counts) == 2000 and counts == simulate(fmt, 4, rounds, p, games, 2000, seed=7)
+        assert counts[0] == max(counts) and counts[0] > counts[3], (fmt, counts)
+    # played games are kept: after the semifinals only their winners can take the title
+    games = [(1, 0, 3, 'B'), (1, 1, 2, 'A')]
+    counts = simulate('single_elimination', 4, 2, p, games, 1000, seed=1)
+    assert counts[0] == counts[2] == 0 and counts[1] + counts[3] == 1000 and counts[1] > counts[3]
+    # an undecided game already on the schedule is simulated too
+    counts = simulate('single_elimination', 4, 2, p, [(1, 0, 3, 'A'), (1, 1, 2, None)], 1000, seed=1)
+    assert counts[3] == 0 and counts[2] > 0
+
+async def play(db: DB, tournament_id: int, pick) -> dict:
+    """Record every open game (winner from ``pick(a_index, b_index)``) until the tournament finishes."""
+    t = await db.get_tournament(tournament_id)
+    index = {team_id: i for i, team_id in enumerate(t['team_ids'])}
+    while t['status'] == 'running':
+        open_games = [g for g in t['games'] if g['winner'] is None]
+        assert open_games, 'a running tournament always has a game to play'
+        for g in open_games:
+            t, match_id = await record_result(db, g['id'], pick(index[g['team_a']], index[g['team_b']]))
+            assert (await db.get_match(match_id))['winner'] is not None
+    return t
+
+async def real_tournaments(db: DB):
+    mmrs = {'1': 1500, '2': 1500, '3': 1300, '4': 1300, '5': 1100, '6': 1100, '7': 1400, '8': 1400, '9': 1200, '10': 1200}
+    for pid, mmr in mmrs.items():
+        await db.upsert_player(pid, pid, regular=mmr, general=mmr)
+    team_ids = [await db.register_team(f't{i}', [str(2 * i + 1), str(2 * i + 2)]) for i in range(5)]
+
+    # seeded by rating; the top seeds win every game
+    tid = await tournament.create(db, 'cup', 'single_elimination', team_ids[:4])
+    t = await db.get_tournament(tid)
+    assert t['team_ids'] == [team_ids[0], team_ids[3], team_ids[1], team_ids[2]]
+    assert [(g['round'], g['team_a'], g['team_b']) for g in t['games']] == [(1, team_ids[0], team_ids[2]), (1, team_ids[3], team_ids[1])]
+    t = await play(db, tid, lambda a, b: 'A' if a < b else 'B')
+    assert t['status'] == 'finished' and t['champion_team_id'] == team_ids[0]
+    assert [g['round'] for g in t['games']] == [1, 1, 2]
+    try:
+        await record_result(db, t['games'][0]['id'], 'B')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('a decided game was recorded again')
+
+    # swiss with an odd count: a bye per round, no rematches, the champion leads on points
+    rng = random.Random(3)
+    tid = await tournament.create(db, 'swiss', 'swiss', team_ids, rounds=3)
+    t = await play(db, tid, lambda a, b: rng.choice('AB'))
+    games = index_games(t)
+    assert t['status'] == 'finished' and max(g[0] for g in games) == 3
+    pairs = [frozenset(g[1:3]) for g in games if g[2] is not None]
+    assert len(pairs) == len(set(pairs)) == 6
+    assert len([g for g in games if g[2] is None]) == 3 and len({g[1] for g in games if g[2] is None}) == 3
+    assert t['champion_team_id'] == t['team_ids'][champion('swiss', 5, games)]
+
+    # invalid rosters
+    doubled = await db.register_team('doubled', ['1', '1'])
+    shared = await db.register_team('shared', ['1', '11'])
+    for ids, message in (([team_ids[1], doubled], '두 번'), ([team_ids[0], shared], '여러 팀'), ([team_ids[0]], '팀은')):
+        try:
+            await tournament.create(db, 'bad', 'round_robin', ids)
+        except ValueError as e:
+            assert message in str(e), e
+        else:
+            raise AssertionError(f'{ids} accepted')
+
+async def main():
+    schedules()
+    simulations()
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    db = DB(path)
+    await db.connect()
+    await db.ensure()
+    try:
+        await real_tournaments(db)
+        print('OK')
+    finally:
+        await db.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,158 @@
+"""Bulk import/export of players and match history as CSV or JSONL.
+
+Rows are streamed through generators in both directions: exports page
+through the table with fetchmany, imports parse and insert in batches
+inside one transaction with secondary indexes rebuilt at the end.
+
+Players: discord_id,name,mmr_regular,mmr_general,games_played,max_mmr,wins,losses
+Matches: team_a,team_b,winner[,ts][,mmr_delta]  (teams as space/comma-separated ids
+         in CSV or lists in JSONL; exported files also carry the original id)
+
+usage:
+  python transfer.py export players players.csv
+  python transfer.py export matches matches.jsonl
+  python transfer.py import players players.csv
+  python transfer.py import matches matches.jsonl --recompute
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import time
+from typing import AsyncIterator, Iterable, Iterator, Optional, TextIO
+
+from db import DB, DB_PATH, PLAYER_COLUMNS
+from rating import DEFAULT_MMR
+
+TABLES = ('players', 'matches')
+FORMATS = ('csv', 'jsonl')
+MATCH_FIELDS = ('id', 'team_a', 'team_b', 'winner', 'mmr_delta', 'ts')
+MAX_TEAM_SIZE = 6  # same limit as /기록
+
+def detect_format(path: str, fmt: Optional[str] = None) -> str:
+    if fmt:
+        return fmt
+    ext = os.path.splitext(path)[1].lower().lstrip('.')
+    if ext in ('jsonl', 'ndjson', 'json'):
+        return 'jsonl'
+    return 'csv'
+
+def read_records(f: TextIO, fmt: str) -> Iterator[dict]:
+    if fmt == 'csv':
+        yield from csv.DictReader(f)
+        return
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+def _int(value, default: Optional[int]) -> Optional[int]:
+    if value is None or value == '':
+        return default
+    return int(value)
+
+def _ids(value) -> list:
+    if isinstance(value, list):
+        return [str(v) for v in value]
+    return (value or '').replace(',', ' ').split()
+
+def parse_player(rec: dict) -> dict:
+    pid = str(rec.get('discord_id') or '').strip()
+    if not pid:
+        raise ValueError('discord_id가 없습니다')
+    general = _int(rec.get('mmr_general'), DEFAULT_MMR)
+    return {
+        'discord_id': pid,
+        'name': rec.get('name') or pid,
+        'mmr_regular': _int(rec.get('mmr_regular'), DEFAULT_MMR),
+        'mmr_general': general,
+        'games_played': _int(rec.get('games_played'), 0),
+        'max_mmr': _int(rec.get('max_mmr'), general),
+        'wins': _int(rec.get('wins'), 0),
+        'losses': _int(rec.get('losses'), 0),
+    }
+
+def parse_match(rec: dict) -> dict:
+    a_ids = _ids(rec.get('team_a'))
+    b_ids = _ids(rec.get('team_b'))
+    winner = str(rec.get('winner') or '').strip().upper()
+    if winner not in ('A', 'B'):
+        raise ValueError('winner는 A 또는 B여야 합니다')
+    if not a_ids or not b_ids or len(a_ids) > MAX_TEAM_SIZE or len(b_ids) > MAX_TEAM_SIZE:
+        raise ValueError(f'각 팀은 1~{MAX_TEAM_SIZE}명이어야 합니다')
+    if len(set(a_ids)) != len(a_ids) or len(set(b_ids)) != len(b_ids):
+        raise ValueError('같은 유저가 한 팀에 두 번 있습니다')
+    if set(a_ids) & set(b_ids):
+        raise ValueError('같은 유저가 양 팀에 있습니다')
+    return {'team_a': a_ids, 'team_b': b_ids, 'winner': winner, 'ts': rec.get('ts') or None, 'mmr_delta': _int(rec.get('mmr_delta'), None)}
+
+def parse_records(records: Iterable[dict], table: str) -> Iterator[dict]:
+    """Validate and normalise raw records lazily; errors name the (1-based) record number."""
+    parse = parse_player if table == 'players' else parse_match
+    for n, rec in enumerate(records, start=1):
+        try:
+            yield parse(rec)
+        except (ValueError, TypeError) as e:
+            raise ValueError(f'{n}번째 행: {e}') from None
+
+async def write_records(f: TextIO, fmt: str, fields, rows: AsyncIterator[dict]) -> int:
+    count = 0
+    writer = csv.DictWriter(f, fieldnames=fields) if fmt == 'csv' else None
+    if writer:
+        writer.writeheader()
+    async for row in rows:
+        if writer:
+            writer.writerow({k: ' '.join(v) if isinstance(v, list) else v for k, v in row.items()})
+        else:
+            f.write(json.dumps(row, ensure_ascii=False) + '\n')
+        count += 1
+    return count
+
+async def export_table(db: DB, table: str, f: TextIO, fmt: str) -> int:
+    if table == 'players':
+        return await write_records(f, fmt, PLAYER_COLUMNS, db.export_players())
+    return await write_records(f, fmt, MATCH_FIELDS, db.export_matches())
+
+async def import_table(db: DB, table: str, f: TextIO, fmt: str, recompute: bool = False) -> int:
+    """Import one file into ``table``; returns the number of rows imported.
+
+    Raises ValueError (nothing is written) if any record is invalid.
+    """
+    rows = parse_records(read_records(f, fmt), table)
+    if table == 'players':
+        return await db.import_players(rows)
+    count, _ = await db.import_matches(rows, recompute=recompute)
+    return count
+
+async def main(args):
+    db = DB(args.db)
+    await db.connect()
+    await db.ensure()
+    try:
+        fmt = detect_format(args.path, args.format)
+        start = time.perf_counter()
+        if args.command == 'export':
+            with open(args.path, 'w', encoding='utf-8', newline='') as f:
+                count = await export_table(db, args.table, f, fmt)
+        else:
+            with open(args.path, encoding='utf-8-sig', newline='') as f:
+                count = await import_table(db, args.table, f, fmt, recompute=args.recompute)
+        print(f'{args.command} {args.table}: {count} rows ({time.perf_counter() - start:.1f}s)')
+    finally:
+        await db.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=('import', 'export'))
+    parser.add_argument('table', choices=TABLES)
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=FORMATS, help='default: from the file extension')
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--recompute', action='store_true', help='after importing matches, replay ratings from the first imported match')
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args))
+    except ValueError as e:
+        sys.exit(f'import failed: {e}')
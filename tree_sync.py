@@ -0,0 +1,70 @@
+import hashlib
+import json
+import logging
+import os
+from typing import Optional
+
+import discord
+from discord import app_commands
+
+# Last synced fingerprint per (application, scope); kept next to the bot so restarts can skip syncing
+SYNC_STATE_PATH = 'command_sync.json'
+
+def _command_payload(command, tree: app_commands.CommandTree) -> dict:
+    try:
+        return command.to_dict(tree)
+    except TypeError:
+        # discord.py < 2.4 takes no tree argument
+        return command.to_dict()
+
+def tree_fingerprint(tree: app_commands.CommandTree, guild: Optional[discord.abc.Snowflake] = None) -> str:
+    """SHA-256 of exactly what ``tree.sync(guild=guild)`` would upload.
+
+    The payload carries names, localisations, descriptions, parameters,
+    choices and guild-only/permission flags, so any change that needs a
+    sync changes the fingerprint.
+    """
+    payload = sorted((_command_payload(c, tree) for c in tree.get_commands(guild=guild)), key=lambda d: (d.get('type', 1), d['name']))
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def _load_state(path: str) -> dict:
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_state(path: str, state: dict):
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+async def sync_if_changed(tree: app_commands.CommandTree, guild: Optional[discord.abc.Snowflake] = None,
+                          path: str = SYNC_STATE_PATH, force: bool = False) -> bool:
+    """Sync the command tree (globally or to one guild) only if its fingerprint changed.
+
+    Returns True if a sync request was sent.
+    """
+    scope = f'{tree.client.application_id}:{guild.id if guild else "global"}'
+    fingerprint = tree_fingerprint(tree, guild)
+    state = _load_state(path)
+    if not force and state.get(scope) == fingerprint:
+        logging.info('Slash commands unchanged (%s); skipping sync', scope)
+        return False
+    await tree.sync(guild=guild)
+    state[scope] = fingerprint
+    _save_state(path, state)
+    logging.info('Slash commands synced (%s)', scope)
+    return True
+
+async def sync_command_tree(tree: app_commands.CommandTree, dev_guild_ids=(), force: bool = False, path: str = SYNC_STATE_PATH):
+    """Sync globally, or only to ``dev_guild_ids`` (guild syncs apply instantly, handy while developing)."""
+    if not dev_guild_ids:
+        await sync_if_changed(tree, path=path, force=force)
+        return
+    for guild_id in dev_guild_ids:
+        guild = discord.Object(id=guild_id)
+        tree.copy_global_to(guild=guild)
+        await sync_if_changed(tree, guild=guild, path=path, force=force)
@@ -0,0 +1,83 @@
+"""Command tree fingerprinting: a sync is sent only when the uploaded payload changes.
+
+tree.sync is replaced by a counter, so nothing is sent to Discord. The
+bot's real command tree must fingerprint the same when it is built twice.
+
+usage: python tree_sync_test.py
+"""
+import asyncio
+import os
+import tempfile
+
+import discord
+from discord import app_commands
+from discord.ext import commands
+
+from commands import setup_commands
+from tree_sync import sync_command_tree, sync_if_changed, tree_fingerprint
+
+def new_tree():
+    client = discord.Client(intents=discord.Intents.default())
+    tree = app_commands.CommandTree(client)
+    synced = []
+
+    async def fake_sync(guild=None):
+        synced.append(guild.id if guild else None)
+        return []
+    tree.sync = fake_sync
+    return tree, synced
+
+def bot_fingerprint() -> str:
+    bot = commands.Bot(command_prefix='!', intents=discord.Intents.default())
+    setup_commands(bot)
+    return tree_fingerprint(bot.tree)
+
+async def main():
+    fd, path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    os.remove(path)
+    try:
+        tree, synced = new_tree()
+
+        @tree.command(name='ping', description='first')
+        async def ping(interaction: discord.Interaction):
+            pass
+
+        assert await sync_if_changed(tree, path=path), 'first run syncs'
+        assert not await sync_if_changed(tree, path=path), 'unchanged tree is skipped'
+        assert await sync_if_changed(tree, path=path, force=True), 'force syncs anyway'
+        assert synced == [None, None]
+
+        # a fresh process with the same commands still skips (state is on disk)
+        tree, synced = new_tree()
+
+        @tree.command(name='ping', description='first')
+        async def ping_again(interaction: discord.Interaction):
+            pass
+        assert not await sync_if_changed(tree, path=path) and synced == []
+
+        # a changed description or a new parameter changes the payload
+        before = tree_fingerprint(tree)
+        ping_again.description = 'second'
+        assert tree_fingerprint(tree) != before
+        assert await sync_if_changed(tree, path=path) and synced == [None]
+
+        @tree.command(name='echo', description='x')
+        @app_commands.describe(text='what to say')
+        async def echo(interaction: discord.Interaction, text: str):
+            pass
+        assert await sync_if_changed(tree, path=path) and synced == [None, None]
+
+        # dev guilds are tracked separately from the global scope
+        await sync_command_tree(tree, dev_guild_ids=[123], path=path)
+        await sync_command_tree(tree, dev_guild_ids=[123], path=path)
+        assert synced == [None, None, 123], synced
+
+        assert bot_fingerprint() == bot_fingerprint(), 'fingerprint depends on build order'
+        print('OK')
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+if __name__ == '__main__':
+    asyncio.run(main())